@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+"""
+Benchmark the cost of discovering the pangenomics plugin.
+
+sourmash imports every installed plugin and builds its argument parser
+on each run, so this is paid by every 'sourmash' command. Each
+measurement runs in a new process:
+
+    python benchmarks/bench_import.py --repeat 20
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# build the full sourmash argument parser, which discovers all plugins
+DISCOVER = "import sourmash.cli; sourmash.cli.get_parser()"
+
+# list the modules imported by the plugin and its argument parsers
+IMPORTS = """
+import argparse, json, sys
+import sourmash.cli
+before = set(sys.modules)
+import sourmash_plugin_pangenomics as plugin
+subparsers = argparse.ArgumentParser().add_subparsers()
+for name in dir(plugin):
+    if name.startswith("Command_"):
+        cls = getattr(plugin, name)
+        cls(subparsers.add_parser(cls.command))
+print(json.dumps(sorted(set(sys.modules) - before)))
+"""
+
+
+def plugin_imports():
+    "Return the modules imported by discovering the plugin."
+    out = subprocess.check_output([sys.executable, "-c", IMPORTS])
+    return json.loads(out)
+
+
+def plugin_import_time():
+    "Return the cumulative import time of the plugin, in seconds."
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                           "import sourmash.cli; import sourmash_plugin_pangenomics"],
+                          stderr=subprocess.PIPE, text=True, check=True)
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [ x.strip() for x in line.split("|") ]
+        if len(fields) == 3 and fields[2] == "sourmash_plugin_pangenomics":
+            return int(fields[1]) / 1e6
+    raise RuntimeError("no import time found for sourmash_plugin_pangenomics")
+
+
+def discover_time():
+    "Return the wall time to start Python and build sourmash's parser."
+    cmd = [sys.executable, "-c", DISCOVER]
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__,
+                                formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--repeat", type=int, default=10,
+                   help="measure this many times (default: 10)")
+    p.add_argument("--json", help="also write results to this JSON file")
+    args = p.parse_args(argv)
+
+    modules = plugin_imports()
+    import_times = [ plugin_import_time() for _ in range(args.repeat) ]
+    discover_times = [ discover_time() for _ in range(args.repeat) ]
+
+    print(f"modules imported by the plugin: {', '.join(modules)}")
+    print(f"plugin import time (ms):        {1000 * statistics.median(import_times):.1f}")
+    print(f"sourmash parser build time (ms): {1000 * statistics.median(discover_times):.1f}")
+
+    if args.json:
+        results = dict(modules=modules, import_times=import_times,
+                       discover_times=discover_times)
+        with open(args.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+        print(f"\nwrote results to '{args.json}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#! /usr/bin/env python
+"""
+Benchmark the pangenome_* commands on synthetic pangenomes.
+
+Generates a reproducible synthetic sketch collection and taxonomy, then
+runs 'sourmash scripts pangenome_createdb', 'pangenome_merge',
+'pangenome_ranktable' and 'pangenome_classify' on it, each in its own
+process, reporting wall-clock time and peak memory (max RSS).
+
+Each genome in a lineage has a set of core hashes present in every
+genome, samples half of the lineage's shell pool, and has its own
+genome-unique cloud hashes:
+
+    python benchmarks/bench_pangenome.py --lineages 20 \\
+        --genomes-per-lineage 100 --hashes-per-genome 5000 --repeat 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import sourmash
+from sourmash.save_load import SaveSignaturesToLocation
+
+KSIZE = 31
+
+
+def make_pangenome(location, *, n_lineages, genomes_per_lineage,
+                   hashes_per_genome, core_fraction, shell_fraction,
+                   seed):
+    """
+    Write synthetic genome sketches and a matching taxonomy to 'location'.
+    Returns (sketch zip, taxonomy CSV, list of lineage names).
+    """
+    rng = np.random.default_rng(seed)
+    n_core = int(hashes_per_genome * core_fraction)
+    n_shell = int(hashes_per_genome * shell_fraction)
+    n_cloud = hashes_per_genome - n_core - n_shell
+    assert n_cloud >= 0, "core and shell fractions must add up to <= 1"
+
+    def new_hashes(n):
+        return rng.integers(1, 2**63, size=n, dtype=np.uint64)
+
+    sketch_zip = os.path.join(location, "genomes.sig.zip")
+    taxonomy_csv = os.path.join(location, "genomes.lineages.csv")
+    lineages = []
+    with SaveSignaturesToLocation(sketch_zip) as save_sigs, \
+         open(taxonomy_csv, "w") as tax_fp:
+        tax_fp.write("ident,superkingdom,phylum,class,order,family,genus,species\n")
+        for lin_n in range(n_lineages):
+            species = f"s__Synthetica species{lin_n}"
+            lineages.append(species)
+            core = new_hashes(n_core)
+            shell = new_hashes(2 * n_shell)
+            for g_n in range(genomes_per_lineage):
+                ident = f"GCA_{lin_n:05d}{g_n:06d}.1"
+                hashes = np.concatenate([core,
+                                         rng.choice(shell, n_shell, replace=False),
+                                         new_hashes(n_cloud)])
+                mh = sourmash.MinHash(n=0, ksize=KSIZE, scaled=1)
+                mh.add_many(hashes.tolist())
+                save_sigs.add(sourmash.SourmashSignature(mh, name=f"{ident} synthetic"))
+                tax_fp.write(f"{ident},d__Bacteria,p__Synthota,c__Synthia,"
+                             f"o__Synthales,f__Synthaceae,g__Synthetica,{species}\n")
+
+    return sketch_zip, taxonomy_csv, lineages
+
+
+def make_metagenomes(location, sketch_zip, *, n_samples, genomes_per_sample,
+                     n_unknown, seed):
+    "Write 'n_samples' metagenome sketches, each mixing random genomes."
+    rng = np.random.default_rng(seed + 1)
+    genomes = [ ss.minhash for ss in sourmash.load_file_as_signatures(sketch_zip) ]
+
+    filename = os.path.join(location, "metagenomes.sig.zip")
+    with SaveSignaturesToLocation(filename) as save_sigs:
+        for n in range(n_samples):
+            mh = sourmash.MinHash(n=0, ksize=KSIZE, scaled=1,
+                                  track_abundance=True)
+            picks = rng.choice(len(genomes), min(genomes_per_sample, len(genomes)),
+                               replace=False)
+            for i in picks:
+                mh.add_many(genomes[i].hashes)
+            mh.add_many(rng.integers(1, 2**63, size=n_unknown,
+                                     dtype=np.uint64).tolist())
+            save_sigs.add(sourmash.SourmashSignature(mh, name=f"sample{n}"))
+
+    return filename
+
+
+def run_command(args, cwd):
+    """
+    Run 'sourmash scripts <args>' in a new process. Returns (seconds,
+    peak RSS in bytes).
+    """
+    cmd = [sys.executable, "-m", "sourmash", "scripts", *args]
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE)
+    # collect the child ourselves, to get its resource usage
+    stderr = proc.stderr.read()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    proc.stderr.close()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    if proc.returncode != 0:
+        sys.stderr.write(stderr.decode("utf-8", errors="replace"))
+        raise RuntimeError(f"command failed: {' '.join(cmd)}")
+
+    return elapsed, rusage.ru_maxrss * 1024     # ru_maxrss is in KB on Linux
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__,
+                                formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--lineages", type=int, default=5)
+    p.add_argument("--genomes-per-lineage", type=int, default=20)
+    p.add_argument("--hashes-per-genome", type=int, default=2000)
+    p.add_argument("--core-fraction", type=float, default=0.5,
+                   help="fraction of each genome's hashes in the lineage core (default: 0.5)")
+    p.add_argument("--shell-fraction", type=float, default=0.3,
+                   help="fraction of each genome's hashes sampled from the lineage shell; the rest are cloud (default: 0.3)")
+    p.add_argument("--samples", type=int, default=10,
+                   help="number of metagenomes to classify (default: 10)")
+    p.add_argument("--cores", type=int, default=1,
+                   help="passed to the commands that support --cores (default: 1)")
+    p.add_argument("--repeat", type=int, default=1,
+                   help="run each command this many times (default: 1)")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--workdir",
+                   help="keep generated data and outputs in this directory")
+    p.add_argument("--json", help="also write results to this JSON file")
+    args = p.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="pangenome_bench_") as tmpdir:
+        workdir = args.workdir or tmpdir
+        os.makedirs(workdir, exist_ok=True)
+
+        print(f"generating {args.lineages} lineages x {args.genomes_per_lineage} genomes x {args.hashes_per_genome} hashes in '{workdir}'")
+        start = time.perf_counter()
+        sketches, taxonomy, lineages = make_pangenome(
+            workdir, n_lineages=args.lineages,
+            genomes_per_lineage=args.genomes_per_lineage,
+            hashes_per_genome=args.hashes_per_genome,
+            core_fraction=args.core_fraction,
+            shell_fraction=args.shell_fraction, seed=args.seed)
+        metagenomes = make_metagenomes(workdir, sketches,
+                                       n_samples=args.samples,
+                                       genomes_per_sample=5,
+                                       n_unknown=args.hashes_per_genome,
+                                       seed=args.seed)
+        print(f"...generated in {time.perf_counter() - start:.1f}s")
+
+        select = ["-k", str(KSIZE), "--scaled", "1"]
+        cores = ["--cores", str(args.cores)]
+        # (name, command, output file to remove before each run)
+        commands = [
+            ("pangenome_createdb",
+             ["pangenome_createdb", sketches, "-t", taxonomy,
+              "-o", "db.sig.zip", "--abund", *cores, *select],
+             "db.sig.zip"),
+            ("pangenome_merge",
+             ["pangenome_merge", sketches, "-o", "merged.sig.zip",
+              *cores, *select],
+             "merged.sig.zip"),
+            ("pangenome_ranktable",
+             ["pangenome_ranktable", "db.sig.zip", "-o", "rt.csv",
+              "-l", lineages[0], *select],
+             "rt.csv"),
+            ("pangenome_classify",
+             ["pangenome_classify", metagenomes, "rt.csv",
+              "-o", "classify.csv", *cores, *select],
+             "classify.csv"),
+        ]
+
+        results = []
+        print(f"\n{'command':<22} {'min (s)':>9} {'median (s)':>11} {'max RSS (MB)':>13}")
+        for name, cmd, output in commands:
+            output = os.path.join(workdir, output)
+            times = []
+            max_rss = 0
+            for _ in range(args.repeat):
+                if os.path.exists(output):
+                    os.unlink(output)
+                elapsed, rss = run_command(cmd, workdir)
+                times.append(elapsed)
+                max_rss = max(max_rss, rss)
+
+            results.append(dict(command=name, times=times,
+                                max_rss=max_rss))
+            print(f"{name:<22} {min(times):>9.2f} {statistics.median(times):>11.2f} {max_rss / 2**20:>13.1f}")
+
+    if args.json:
+        params = { k: v for k, v in vars(args).items()
+                   if k not in ("json", "workdir") }
+        with open(args.json, "w") as fp:
+            json.dump(dict(parameters=params, results=results), fp, indent=2)
+        print(f"\nwrote results to '{args.json}'")
+
+
+if __name__ == "__main__":
+    main()
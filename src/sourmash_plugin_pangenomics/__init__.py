@@ -0,0 +1,414 @@
+"""pangenomics plugin"""
+
+epilog = """
+See https://github.com/dib-lab/sourmash_plugin_pangenomics for more examples.
+
+Need help? Have questions? Ask at http://github.com/sourmash-bio/sourmash/issues!
+"""
+
+# sourmash imports this module to discover its commands on every run, so
+# only the command-line classes live here; the commands themselves are in
+# .pangenomics, which is imported when a command is run.
+
+import argparse
+import importlib
+import os
+import sys
+
+from sourmash.cli import utils as sourmash_cli
+from sourmash.plugins import CommandLinePlugin
+
+# default location of the parsed-ranktable cache; see RanktableCache.
+RANKTABLE_CACHE_ENV = "PANGENOME_RANKTABLE_CACHE"
+DEFAULT_RANKTABLE_CACHE_SIZE = "1G"
+
+
+###
+
+#
+# CLI plugins - supports 'sourmash scripts <commands>'
+#
+
+
+class Command_CreateDB(CommandLinePlugin):
+    command = "pangenome_createdb"  # 'scripts <command>'
+    description = "create a database of sketches merged at given rank"  # output with -h
+    usage = "pangenome_createdb <db> -t <lineagedb> -o <merged>.zip"  # output with no args/bad args as well as -h
+    epilog = epilog  # output with -h
+    formatter_class = argparse.RawTextHelpFormatter  # do not reformat multiline
+
+    def __init__(self, subparser):
+        super().__init__(subparser)
+        p = subparser
+
+        p.add_argument(
+            "-t",
+            "--taxonomy-file",
+            "--taxonomy",
+            metavar="FILE",
+            action="extend",
+            nargs="+",
+            required=True,
+            help="database lineages file, or a taxonomy index from pangenome_taxindex",
+        )
+        p.add_argument("sketches", nargs="+", help="sketches to combine")
+        p.add_argument(
+            "-o",
+            "--output",
+            required=True,
+            help="Define a filename for the pangenome signatures (.zip preferred); '{rank}', '{ksize}', '{moltype}' and '{scaled}' are filled in.",
+        )
+        p.add_argument(
+            "--csv",
+            help="A CSV file generated to contain the lineage rank, genome name, hash count, and genome count; gzip-compressed if it ends in .gz.",
+        )
+        p.add_argument(
+            "--presence",
+            metavar="FILE",
+            help="also write a presence matrix recording which genomes in each lineage contain each hash; see PresenceMatrix",
+        )
+        p.add_argument(
+            "-r",
+            "--rank",
+            default="species",
+            help="rank to merge sketches at, or a comma-separated list of ranks such as species,genus,family; with several ranks, -o must contain '{rank}' (default: species)",
+        )
+        p.add_argument(
+            "-a",
+            "--abund",
+            action="store_true",
+            help="Enable abundance tracking of hashes across rank selection.",
+        )
+        p.add_argument(
+            "-c",
+            "--cores",
+            type=int,
+            default=1,
+            help="number of worker processes to use for loading and merging sketches (default: 1)",
+        )
+        p.add_argument(
+            "-u",
+            "--update",
+            metavar="DATABASE",
+            help="add genomes to an existing 'pangenome_createdb --abund' database, skipping genomes it already contains",
+        )
+        p.add_argument(
+            "-M",
+            "--max-memory",
+            type=parse_memory_size,
+            help="approximate limit on memory used for merged sketches, e.g. 4G; beyond this, partial sketches are spilled to temporary files",
+        )
+        p.add_argument(
+            "-s",
+            "--select",
+            metavar="SPEC",
+            action="append",
+            help="also build a database for these sketches, e.g. 'k=51' or 'protein,k=10,scaled=200', in the same pass over the input; -o must then contain '{ksize}', '{moltype}' or '{scaled}'. May be repeated.",
+        )
+        add_standard_minhash_args(p)
+        add_timing_args(p)
+
+    def main(self, args):
+        super().main(args)
+        from .pangenomics import run_with_timings, pangenome_createdb_main
+        return run_with_timings(self.command, pangenome_createdb_main, args)
+
+
+class Command_TaxIndex(CommandLinePlugin):
+    command = "pangenome_taxindex"  # 'scripts <command>'
+    description = "compile taxonomy files into an index for pangenome_createdb"  # output with -h
+    usage = "pangenome_taxindex -t <lineagedb> -o <index>.taxidx"  # output with no args/bad args as well as -h
+    epilog = epilog  # output with -h
+    formatter_class = argparse.RawTextHelpFormatter  # do not reformat multiline
+
+    def __init__(self, subparser):
+        super().__init__(subparser)
+        p = subparser
+
+        p.add_argument(
+            "-t",
+            "--taxonomy-file",
+            "--taxonomy",
+            metavar="FILE",
+            action="extend",
+            nargs="+",
+            required=True,
+            help="database lineages file",
+        )
+        p.add_argument(
+            "-o",
+            "--output",
+            required=True,
+            help="filename for the compiled taxonomy index",
+        )
+        add_timing_args(p)
+
+    def main(self, args):
+        super().main(args)
+        from .pangenomics import run_with_timings, pangenome_taxindex_main
+        return run_with_timings(self.command, pangenome_taxindex_main, args)
+
+
+class Command_Merge(CommandLinePlugin):
+    command = "pangenome_merge"  # 'scripts <command>'
+    description = "merge sketches into a pangenome database a la createdb"  # output with -h
+    usage = "pangenome_merge <sketches> -o <merged>.zip"  # output with no args/bad args as well as -h
+    epilog = epilog  # output with -h
+    formatter_class = argparse.RawTextHelpFormatter  # do not reformat multiline
+
+    def __init__(self, subparser):
+        super().__init__(subparser)
+        p = subparser
+
+        p.add_argument("sketches", nargs="+", help="sketches to combine")
+        p.add_argument(
+            "-o",
+            "--output",
+            required=True,
+            help="Define a filename for the pangenome signatures (.zip preferred).",
+        )
+        p.add_argument(
+            "-c",
+            "--cores",
+            type=int,
+            default=1,
+            help="number of worker processes to use for loading and counting sketches (default: 1)",
+        )
+        add_standard_minhash_args(p)
+        add_timing_args(p)
+
+    def main(self, args):
+        super().main(args)
+        from .pangenomics import run_with_timings, pangenome_merge_main
+        return run_with_timings(self.command, pangenome_merge_main, args)
+
+
+class Command_RankTable(CommandLinePlugin):
+    command = "pangenome_ranktable"  # 'scripts <command>'
+    description = "create a CSV ranktable that annotates hashes with pangenome characters"  # output with -h
+    usage = "pangenome_ranktable <merged.zip> -o <ranktable>.csv -l <lineage>"  # output with no args/bad args as well as -h
+    epilog = epilog  # output with -h
+    formatter_class = argparse.RawTextHelpFormatter  # do not reformat multiline
+
+    def __init__(self, subparser):
+        super().__init__(subparser)
+        p = subparser
+        p.add_argument(
+            "data",
+            metavar="SOURMASH_DATABASE",
+            help="The sourmash dictionary created from 'pangenome_creatdb --abund'",
+        )
+        p.add_argument(
+            "-l",
+            "--lineage",
+            help='The specific lineage to extract from the sourmash pangenome database (e.g. "s__Escherichia coli")',
+        )
+        p.add_argument(
+            "-i",
+            "--ignore-case",
+            action="store_true",
+            help="Ignore the casing of search terms",
+        )
+        p.add_argument(
+            "-o",
+            "--output-hash-classification",
+            help="CSV file containing classification of each hash; use a '.bin' extension to write a binary ranktable instead",
+        )
+        p.add_argument(
+            "--all-lineages",
+            action="store_true",
+            help="write a ranktable for every signature in the database, into --output-dir",
+        )
+        p.add_argument(
+            "--output-dir",
+            help="directory for --all-lineages ranktables, along with an index 'ranktables.csv'",
+        )
+        p.add_argument(
+            "--output-format",
+            choices=["csv", "bin"],
+            default="csv",
+            help="format of --all-lineages ranktables (default: csv)",
+        )
+        p.add_argument(
+            "--pyramid",
+            metavar="SCALED,...",
+            type=parse_scaled_values,
+            help="also write copies of the ranktable downsampled to each of these scaled values, e.g. 10000,100000, for 'pangenome_classify --resolution'",
+        )
+        p.add_argument(
+            "-c",
+            "--cores",
+            type=int,
+            default=1,
+            help="number of worker processes to use with --all-lineages (default: 1)",
+        )
+        add_standard_minhash_args(p)
+        add_timing_args(p)
+
+    def main(self, args):
+        super().main(args)
+        from .pangenomics import (run_with_timings,
+                                  pangenome_ranktable_all_main,
+                                  pangenome_ranktable_main)
+        if args.all_lineages:
+            if not args.output_dir or args.lineage or args.output_hash_classification:
+                print("--all-lineages requires --output-dir, and cannot be used with -l/--lineage or -o.")
+                sys.exit(-1)
+            if args.pyramid:
+                print("--pyramid cannot be used with --all-lineages.")
+                sys.exit(-1)
+            return run_with_timings(self.command, pangenome_ranktable_all_main, args)
+        if not args.output_hash_classification:
+            print("-o/--output-hash-classification is required.")
+            sys.exit(-1)
+        return run_with_timings(self.command, pangenome_ranktable_main, args)
+
+
+class Command_Classify(CommandLinePlugin):
+    command = "pangenome_classify"  # 'scripts <command>'
+    description = "classify the hashes in a sketch based on given ranktable characters"  # output with -h
+    usage = "pangenome_classify <sketch(es)> <ranktable1> [<ranktable2> ...]"  # output with no args/bad args as well as -h
+    epilog = epilog  # output with -h
+    formatter_class = argparse.RawTextHelpFormatter  # do not reformat multiline
+
+    def __init__(self, subparser):
+        super().__init__(subparser)
+        p = subparser
+        p.add_argument("metagenome_sig",
+                       help="metagenome sketch, or a collection of sketches to classify")
+        p.add_argument("ranktable_csv_files", nargs="*",
+                       help="rank tables produced by pangenome_ranktable (CSV or binary)")
+        p.add_argument("--thresholds",
+                       help="colon-separated thresholds for central core, external core, shell, inner cloud, surface cloud, e.g. 95:90:10:01:00 (which is the default")
+        p.add_argument("-o", "--output",
+                       help="write results to this CSV file, with columns metagenome, ranktable, class, count, percent")
+        p.add_argument("-c", "--cores", type=int, default=1,
+                       help="number of worker processes to use for classifying sketches (default: 1)")
+        p.add_argument("--cache-dir", default=os.environ.get(RANKTABLE_CACHE_ENV),
+                       help=f"cache parsed CSV ranktables in this directory (default: ${RANKTABLE_CACHE_ENV}, if set)")
+        p.add_argument("--cache-max-size", type=parse_memory_size,
+                       default=DEFAULT_RANKTABLE_CACHE_SIZE,
+                       help=f"evict least recently used ranktables when the cache exceeds this size, e.g. 500M or 4G (default: {DEFAULT_RANKTABLE_CACHE_SIZE})")
+        p.add_argument("--abund-weighted", action="store_true",
+                       help="weight each hash by its abundance in the sketch, rather than counting distinct hashes")
+        p.add_argument("--output-class-sketches", metavar="LOCATION",
+                       help="save the hashes of each sketch in each class, per ranktable, as sketches to this location")
+        p.add_argument("--prefetch", type=int, default=16,
+                       help="load up to this many sketches ahead in a reader thread, while classifying; 0 to disable (default: 16)")
+        p.add_argument("--server", metavar="ADDRESS",
+                       help="classify using the ranktables loaded by a running pangenome_serve, at a Unix socket path, PORT or HOST:PORT")
+        p.add_argument("--resolution", metavar="SCALED,...", type=parse_scaled_values,
+                       help="classify at this scaled value, using the ranktables from 'pangenome_ranktable --pyramid' if present; with several values, start at the coarsest and refine only while a class estimate is uncertain")
+        p.add_argument("--max-error", type=float, default=1.0,
+                       help="with several --resolution values, refine while the standard error of any class percentage is above this, in percentage points (default: 1.0)")
+        add_standard_minhash_args(p)
+        add_timing_args(p)
+
+    def main(self, args):
+        super().main(args)
+        from .pangenomics import run_with_timings, classify_hashes_main
+
+        if args.server:
+            if args.ranktable_csv_files or args.thresholds:
+                print("ranktables and --thresholds are set by the server, and cannot be given with --server.")
+                sys.exit(-1)
+            if args.output_class_sketches:
+                print("--output-class-sketches cannot be used with --server.")
+                sys.exit(-1)
+            if args.resolution:
+                print("--resolution cannot be used with --server.")
+                sys.exit(-1)
+        elif not args.ranktable_csv_files:
+            print("at least one ranktable is required, unless --server is given.")
+            sys.exit(-1)
+        if args.resolution and args.output_class_sketches:
+            print("--output-class-sketches cannot be used with --resolution.")
+            sys.exit(-1)
+        if args.cores > 1 and args.output_class_sketches:
+            print("--output-class-sketches cannot be used with --cores > 1.")
+            sys.exit(-1)
+
+        return run_with_timings(self.command, classify_hashes_main, args)
+
+
+class Command_Serve(CommandLinePlugin):
+    command = "pangenome_serve"  # 'scripts <command>'
+    description = "serve pangenome_classify requests from ranktables held in memory"  # output with -h
+    usage = "pangenome_serve <ranktable1> [<ranktable2> ...] (--socket PATH | --port PORT)"  # output with no args/bad args as well as -h
+    epilog = epilog  # output with -h
+    formatter_class = argparse.RawTextHelpFormatter  # do not reformat multiline
+
+    def __init__(self, subparser):
+        super().__init__(subparser)
+        p = subparser
+        p.add_argument("ranktable_csv_files", nargs="+",
+                       help="rank tables produced by pangenome_ranktable (CSV or binary)")
+        where = p.add_mutually_exclusive_group(required=True)
+        where.add_argument("--socket",
+                           help="listen on this Unix socket path")
+        where.add_argument("--port", type=int,
+                           help="listen on this TCP port on localhost")
+        p.add_argument("--thresholds",
+                       help="colon-separated thresholds for central core, external core, shell, inner cloud, surface cloud, e.g. 95:90:10:01:00 (which is the default")
+        p.add_argument("--cache-dir", default=os.environ.get(RANKTABLE_CACHE_ENV),
+                       help=f"cache parsed CSV ranktables in this directory (default: ${RANKTABLE_CACHE_ENV}, if set)")
+        p.add_argument("--cache-max-size", type=parse_memory_size,
+                       default=DEFAULT_RANKTABLE_CACHE_SIZE,
+                       help=f"evict least recently used ranktables when the cache exceeds this size, e.g. 500M or 4G (default: {DEFAULT_RANKTABLE_CACHE_SIZE})")
+        p.add_argument("--batch-wait", type=float, default=0.,
+                       help="seconds to wait for more requests before classifying a batch (default: 0, classify requests that are already waiting)")
+
+    def main(self, args):
+        super().main(args)
+        from .pangenomics import pangenome_serve_main
+
+        return pangenome_serve_main(args)
+
+
+def add_standard_minhash_args(p):
+    "As sourmash_utils.add_standard_minhash_args, without importing it."
+    sourmash_cli.add_construct_moltype_args(p)
+    sourmash_cli.add_ksize_arg(p)
+    sourmash_cli.add_scaled_arg(p)
+
+
+def add_timing_args(p):
+    p.add_argument("--timings", metavar="FILE",
+                   help="write a JSON report of the time, peak memory, and sketch and hash rates for each phase of the command")
+    p.add_argument("--profile", metavar="FILE",
+                   help="write a cProfile dump of the command, for use with pstats or snakeviz")
+
+
+def parse_memory_size(value):
+    """
+    Parse a memory size such as '500M' or '4G' into bytes. Plain numbers
+    are taken as bytes.
+    """
+    units = dict(K=2**10, M=2**20, G=2**30, T=2**40)
+    value = value.strip().upper().removesuffix("B")
+    try:
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"cannot parse memory size '{value}'")
+
+
+def parse_scaled_values(value):
+    "Parse a comma-separated list of scaled values, such as '1000,10000'."
+    try:
+        scaled_values = [ int(x) for x in value.split(",") ]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"cannot parse scaled values '{value}'")
+    if any( scaled <= 0 for scaled in scaled_values ):
+        raise argparse.ArgumentTypeError(f"scaled values must be positive: '{value}'")
+    return scaled_values
+
+
+def __getattr__(name):
+    "Look up everything else in .pangenomics, importing it on first use."
+    pangenomics = importlib.import_module(".pangenomics", __name__)
+    try:
+        return getattr(pangenomics, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
@@ -0,0 +1,3620 @@
+"""pangenomics plugin commands; see __init__ for the command-line interface."""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import cProfile
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import re
+import pprint
+import queue
+import resource
+import signal
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from difflib import get_close_matches
+
+import numpy as np
+import sourmash
+import sourmash_utils
+from sourmash import sourmash_args
+from sourmash.tax import tax_utils
+from sourmash.index import ZipFileLinearIndex
+from sourmash.logging import debug_literal
+from sourmash.manifest import CollectionManifest
+from sourmash.minhash import _get_max_hash_for_scaled
+from sourmash.save_load import SaveSignaturesToLocation
+from sourmash.sbt_storage import ZipStorage
+
+DEFAULT_THRESHOLDS = dict(
+    CENTRAL_CORE = 0.95,
+    EXTERNAL_CORE = 0.90,
+    SHELL = 0.10,
+    INNER_CLOUD = 0.01,
+    SURFACE_CLOUD = 0.00,
+)
+
+CENTRAL_CORE = 1
+EXTERNAL_CORE = 2
+SHELL = 3
+INNER_CLOUD = 4
+SURFACE_CLOUD = 5
+
+NAMES = {
+    CENTRAL_CORE: "central core",
+    EXTERNAL_CORE: "external core",
+    SHELL: "shell",
+    INNER_CLOUD: "inner cloud",
+    SURFACE_CLOUD: "surface cloud",
+}
+
+
+#
+# timing and profiling, for --timings and --profile
+#
+
+
+class Phase:
+    "Accumulated time and counts for one named phase of a command."
+    __slots__ = ("name", "lock", "seconds", "calls", "sketches", "hashes",
+                 "max_rss_at_end")
+
+    def __init__(self, name, lock):
+        self.name = name
+        self.lock = lock            # shared with PhaseTimings
+        self.seconds = 0.
+        self.calls = 0
+        self.sketches = 0
+        self.hashes = 0
+        self.max_rss_at_end = 0     # process max RSS when last finished
+
+    def add(self, *, sketches=0, hashes=0):
+        with self.lock:
+            self.sketches += sketches
+            self.hashes += hashes
+
+    def report(self):
+        def rate(count):
+            if not count or not self.seconds:
+                return None
+            return count / self.seconds
+
+        return dict(name=self.name, seconds=self.seconds, calls=self.calls,
+                    sketches=self.sketches, hashes=self.hashes,
+                    sketches_per_second=rate(self.sketches),
+                    hashes_per_second=rate(self.hashes),
+                    max_rss_at_end_bytes=self.max_rss_at_end)
+
+
+def max_rss():
+    """
+    Maximum resident set size so far in bytes, of this process and its
+    children. This is a lifetime maximum, not the usage of any one phase.
+    """
+    # ru_maxrss is in KB on Linux
+    return 1024 * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+class PhaseTimings:
+    """
+    Track the phases of a command - e.g. taxonomy load, manifest select,
+    sketch decode, accumulate, write. A phase may be entered many times,
+    e.g. once per sketch; its time and counts are summed, and it records
+    the process max RSS (see max_rss) when the phase last finished.
+    Phases may be updated from other threads, e.g. a prefetch thread.
+    """
+    def __init__(self):
+        self.phases = {}
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    def get_phase(self, name):
+        with self.lock:
+            phase = self.phases.get(name)
+            if phase is None:
+                phase = self.phases[name] = Phase(name, self.lock)
+            return phase
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        phase = self.get_phase(name)
+        start = time.perf_counter()
+        try:
+            yield phase
+        finally:
+            elapsed = time.perf_counter() - start
+            rss = max_rss()
+            with self.lock:
+                phase.seconds += elapsed
+                phase.calls += 1
+                phase.max_rss_at_end = rss
+
+    def iterate(self, items, name, *, n_hashes=None):
+        """
+        Time each step of iterating over 'items' as phase 'name', counting
+        items as sketches; n_hashes(item), if given, counts their hashes.
+        """
+        phase = self.get_phase(name)
+        items = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                break
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    phase.seconds += elapsed
+                    phase.calls += 1
+            phase.add(sketches=1,
+                      hashes=n_hashes(item) if n_hashes is not None else 0)
+            yield item
+
+        rss = max_rss()
+        with self.lock:
+            phase.max_rss_at_end = rss
+
+    def report(self, command):
+        wall = time.perf_counter() - self.start
+        with self.lock:
+            phases = [ phase.report() for phase in self.phases.values() ]
+        return dict(command=command, wall_seconds=wall,
+                    max_rss_bytes=max_rss(), phases=phases)
+
+
+# timings for the command being run; see run_with_timings.
+_timings = PhaseTimings()
+
+
+def timed_phase(name):
+    "Context manager timing a phase of the current command."
+    return _timings.phase(name)
+
+
+def timed_sketches(items, name="sketch decode", *, n_hashes=None):
+    "Time iteration over 'items' as a phase of the current command."
+    return _timings.iterate(items, name, n_hashes=n_hashes)
+
+
+def run_with_timings(command, main_func, args):
+    """
+    Run main_func(args), writing a --timings report and --profile dump
+    if requested.
+    """
+    global _timings
+    _timings = PhaseTimings()
+
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    retval = main_func(args)
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print(f"wrote cProfile dump to '{args.profile}'")
+
+    if args.timings:
+        report = _timings.report(command)
+        with open(args.timings, "w") as fp:
+            json.dump(report, fp, indent=2)
+        print(f"wrote timings for {len(report['phases'])} phases to '{args.timings}'")
+
+    return retval
+
+
+#
+# hash count accumulation
+#
+
+class HashCounts:
+    """
+    Count the number of sketches containing each hash.
+
+    Counts are stored as parallel sorted uint64 hashval / uint32 count
+    arrays rather than a Counter. Sketch hashes are buffered and merged
+    into the arrays in batches.
+
+    'items()' yields (hashval, count) pairs, so a HashCounts can be
+    passed directly to 'MinHash.set_abundances'.
+    """
+    batch_size = 2_000_000      # number of buffered hashes to trigger a merge
+
+    def __init__(self):
+        self.hashvals = np.empty(0, dtype=np.uint64)
+        self.counts = np.empty(0, dtype=np.uint32)
+        self._pending = []
+        self._n_pending = 0
+
+    def add_sketch(self, minhash):
+        "Count each hash in 'minhash' once, ignoring abundances."
+        hashvals = np.fromiter(minhash.hashes, dtype=np.uint64,
+                               count=len(minhash))
+        self.add_hashvals(hashvals)
+
+    def add_hashvals(self, hashvals):
+        "Count each hash in 'hashvals' once; values must be distinct."
+        self._pending.append(hashvals)
+        self._n_pending += len(hashvals)
+        if self._n_pending >= self.batch_size:
+            self._flush()
+
+    def update(self, other):
+        "Add in the counts from another HashCounts object."
+        self._flush()
+        other._flush()
+        self.hashvals, self.counts = merge_hash_counts(self.hashvals,
+                                                       self.counts,
+                                                       other.hashvals,
+                                                       other.counts)
+
+    def _flush(self):
+        if not self._pending:
+            return
+
+        new_hashvals = np.concatenate(self._pending)
+        self._pending = []
+        self._n_pending = 0
+
+        new_hashvals, new_counts = np.unique(new_hashvals, return_counts=True)
+        self.hashvals, self.counts = merge_hash_counts(self.hashvals,
+                                                       self.counts,
+                                                       new_hashvals,
+                                                       new_counts.astype(np.uint32))
+
+    @classmethod
+    def from_arrays(cls, hashvals, counts):
+        "Create from sorted, distinct hashvals and matching counts."
+        obj = cls()
+        obj.hashvals = hashvals
+        obj.counts = counts
+        return obj
+
+    def arrays(self):
+        "Return the sorted (hashvals, counts) arrays."
+        self._flush()
+        return self.hashvals, self.counts
+
+    def nbytes(self):
+        "Approximate memory used, including buffered hashes."
+        return self.hashvals.nbytes + self.counts.nbytes + 8 * self._n_pending
+
+    def __len__(self):
+        self._flush()
+        return len(self.hashvals)
+
+    def items(self):
+        self._flush()
+        return zip(self.hashvals.tolist(), self.counts.tolist())
+
+    def __getstate__(self):
+        self._flush()
+        return self.__dict__
+
+
+def merge_hash_counts(hashvals_a, counts_a, hashvals_b, counts_b):
+    """
+    Merge two sorted hashval/count arrays, summing counts for shared
+    hashvals. Returns sorted (hashvals, counts).
+    """
+    if not len(hashvals_a):
+        return hashvals_b, counts_b
+    if not len(hashvals_b):
+        return hashvals_a, counts_a
+
+    return merge_hash_count_runs([(hashvals_a, counts_a),
+                                  (hashvals_b, counts_b)])
+
+
+def merge_hash_count_runs(runs):
+    """
+    Merge a list of sorted (hashvals, counts) runs in a single pass,
+    summing counts for shared hashvals. Returns sorted (hashvals, counts).
+    """
+    hashvals = np.concatenate([ h for h, _ in runs ])
+    counts = np.concatenate([ c for _, c in runs ])
+
+    # each run is sorted, so a stable sort only merges the runs
+    order = np.argsort(hashvals, kind="stable")
+    hashvals = hashvals[order]
+    counts = counts[order]
+    if not len(hashvals):
+        return hashvals, counts
+
+    starts = np.flatnonzero(np.concatenate(([True],
+                                            hashvals[1:] != hashvals[:-1])))
+    return hashvals[starts], np.add.reduceat(counts, starts)
+
+
+#
+# pangenome_createdb
+#
+
+def pangenome_createdb_main(args):
+    if args.csv and (args.cores > 1 or args.max_memory or args.update):
+        print("--csv tracks running hash counts in input order, and cannot be used with --cores > 1, --max-memory, or --update.")
+        sys.exit(-1)
+
+    if args.update:
+        if not args.abund:
+            print("--update adds genome counts to an existing database, and requires --abund.")
+            sys.exit(-1)
+
+    if args.presence and (args.cores > 1 or args.update):
+        print("--presence cannot be used with --cores > 1 or --update.")
+        sys.exit(-1)
+
+    ranks = parse_ranks(args.rank)
+    selectors = parse_selectors(args)
+    if (len(ranks) > 1 or len(selectors) > 1) and (args.csv or args.update):
+        print("--csv and --update cannot be used with more than one rank or --select.")
+        sys.exit(-1)
+    if len(selectors) > 1 and args.presence:
+        print("--presence cannot be used with more than one --select.")
+        sys.exit(-1)
+    outputs = createdb_outputs(args.output, ranks, selectors)
+
+    # sketches are merged at the lowest rank, and the merged sketches
+    # are then merged again into each higher rank; see RankRollup.
+    rank = ranks[0]
+
+    if args.update and os.path.abspath(args.update) == os.path.abspath(outputs[0, rank]):
+        print("--update database and -o/--output must be different files.")
+        sys.exit(-1)
+
+    with timed_phase("taxonomy load"):
+        taxdb, ident_index = load_taxonomy(args.taxonomy_file, rank)
+        parents = { parent_rank: lineage_parents(taxdb, rank, parent_rank)
+                    for parent_rank in ranks[1:] }
+
+    if args.csv:
+        csv_file = check_csv(args.csv)
+
+    for select_mh in selectors:
+        print(f"selecting sketches: {select_mh}")
+
+    with tempfile.TemporaryDirectory(prefix="pangenome_createdb_") as spill_dir:
+        if args.update:
+            return pangenome_createdb_update(args, outputs[0, rank], rank,
+                                             taxdb, ident_index, selectors[0],
+                                             spill_dir)
+
+        max_memory = createdb_memory_share(args.max_memory, len(ranks),
+                                           len(selectors), args.cores)
+
+        def new_accumulator():
+            return LineageAccumulator(abund=args.abund, max_memory=max_memory,
+                                      spill_dir=spill_dir)
+
+        targets = []
+        for sel_n, select_mh in enumerate(selectors):
+            rollups = [ RankRollup(parent_rank, outputs[sel_n, parent_rank],
+                                   parents[parent_rank], new_accumulator())
+                        for parent_rank in ranks[1:] ]
+            targets.append(CreatedbTarget(select_mh, outputs[sel_n, rank],
+                                          new_accumulator(), rollups))
+
+        # group manifest rows by lineage before loading any sketches
+        with timed_phase("manifest select"):
+            plan = plan_createdb(args.sketches, selectors, ident_index, taxdb)
+
+        if args.cores > 1:
+            if plan is None:
+                print("all sketch collections must have manifests to use --cores > 1.")
+                sys.exit(-1)
+
+            # sketches are decoded and accumulated in the worker processes
+            with timed_phase("accumulate") as phase:
+                createdb_parallel(args, plan, targets, spill_dir,
+                                  max_memory=max_memory)
+                phase.add(sketches=sum( len(rows) for _, _, rows in plan ))
+
+            for target in targets:
+                print(f"Writing output sketches to '{target.output}'")
+                with sourmash_args.SaveSignaturesToLocation(target.output) as save_sigs:
+                    save_lineage_sketches(save_sigs, target.lineages,
+                                          rollups=target.rollups)
+
+                target.genomes = [ (ident, lineage_name)
+                                   for _, _, rows in plan
+                                   for _, row, ident, lineage_name in rows
+                                   if target.matches_row(row) ]
+                target.save_genomes(rank)
+            return
+
+        if plan is None:
+            # no manifests; stream each file, and save everything at the end.
+            sketch_groups = stream_sketches(args.sketches, selectors)
+            groups_are_lineages = False
+        else:
+            sketch_groups = load_sketches_by_plan(plan)
+            groups_are_lineages = True
+
+        with contextlib.ExitStack() as stack:
+            for target in targets:
+                print(f"Writing output sketches to '{target.output}'")
+                target.save_sigs = stack.enter_context(
+                    sourmash_args.SaveSignaturesToLocation(target.output))
+
+            if args.csv:
+                csv_writer = stack.enter_context(CsvRowWriter(csv_file))
+                genome_counts = defaultdict(int)    # lineage -> genomes so far
+
+            # genome membership of each hash, at the lowest rank
+            if args.presence:
+                presence = stack.enter_context(
+                    PresenceMatrixWriter(args.presence))
+
+            n = 0
+            for group in sketch_groups:
+                # Work on a single signature at a time across the group
+                group = timed_sketches(group,
+                                       n_hashes=lambda item: len(item[2].minhash))
+                for file_n, row_n, ss in group:
+                    if n and n % 1000 == 0:
+                        print(f"...{n} - loading")
+                    n += 1
+
+                    # sketches that match no selection are ignored,
+                    # whether or not they are in the taxonomy
+                    sketch_targets = matching_targets(targets, ss.minhash)
+                    if not sketch_targets:
+                        continue
+
+                    name = ss.name
+                    ident, lineage_name = find_lineage_name(ident_index,
+                                                            taxdb, name)
+
+                    # track merged sketches (and hash counts, with --abund)
+                    # for each selection that this sketch matches
+                    for target in sketch_targets:
+                        target.genomes.append((ident, lineage_name))
+                        with timed_phase("accumulate") as phase:
+                            mh = target.lineages.add(lineage_name, ident,
+                                                     (file_n, row_n),
+                                                     ss.minhash)
+                            phase.add(sketches=1, hashes=len(ss.minhash))
+
+                    if args.presence:
+                        presence.add(lineage_name, ident, ss.minhash)
+
+                    # record the running number of distinct hashes and
+                    # genomes in the lineage; len() of the merged sketch
+                    # is O(1), unlike building its .hashes dict. The
+                    # --csv output has no header row.
+                    if args.csv:
+                        genome_counts[lineage_name] += 1
+                        csv_writer.writerow((lineage_name, name, len(mh),
+                                             genome_counts[lineage_name]))
+
+                # each lineage is complete; finalize it and free memory.
+                if groups_are_lineages:
+                    for target in targets:
+                        target.save_lineages()
+                    if args.presence:
+                        presence.finish()
+
+            for target in targets:
+                target.save_lineages()
+
+        for target in targets:
+            target.save_genomes(rank)
+
+
+def pangenome_createdb_update(args, output, rank, taxdb, ident_index,
+                              select_mh, spill_dir):
+    """
+    Add new genomes to an existing 'createdb --abund' database. Only
+    lineages that gain genomes are rebuilt, starting from their existing
+    genome counts; all other sketches are copied over unchanged. Genomes
+    listed in the existing database's sidecar are skipped.
+    """
+    genomes, params = load_genomes_sidecar(args.update)
+    expected = sidecar_params(rank, select_mh)
+    if params is not None and params != expected:
+        print(f"'{args.update}' was built with {format_sidecar_params(params)}, not {format_sidecar_params(expected)}; use the same -r/--rank and sketch selection with --update.")
+        sys.exit(-1)
+    known_idents = { ident.split(".")[0] for ident, _ in genomes }
+    print(f"'{args.update}' contains {len(known_idents)} genomes.")
+
+    with timed_phase("manifest select"):
+        plan = plan_createdb(args.sketches, [select_mh], ident_index, taxdb,
+                             exclude_idents=known_idents)
+    if plan is None:
+        print("all sketch collections must have manifests to use --update.")
+        sys.exit(-1)
+
+    groups = group_plan_by_lineage(plan)
+    n_new = sum( len(group) for group in groups.values() )
+    print(f"adding {n_new} new genomes to {len(groups)} lineages.")
+
+    def add_new_genomes(lineage_name, group):
+        sketches = timed_sketches(load_lineage_group(plan, group),
+                                  n_hashes=lambda item: len(item[2].minhash))
+        for file_n, row_n, ss in sketches:
+            ident, _ = find_lineage_name(ident_index, taxdb, ss.name)
+            with timed_phase("accumulate") as phase:
+                lineages.add(lineage_name, ident, (file_n, row_n), ss.minhash)
+                phase.add(sketches=1, hashes=len(ss.minhash))
+            genomes.append((ident, lineage_name))
+
+    lineages = LineageAccumulator(abund=True,
+                                  max_memory=args.max_memory,
+                                  spill_dir=spill_dir)
+
+    existing_db = sourmash_utils.load_index_and_select(args.update, select_mh)
+
+    n_copied = 0
+    n_updated = 0
+    print(f"Writing output sketches to '{output}'")
+    with sourmash_args.SaveSignaturesToLocation(output) as save_sigs:
+        for n, ss in enumerate(existing_db.signatures()):
+            ident, lineage_name = ss.name.split(" ", 1)
+            group = groups.pop(lineage_name, None)
+            if group is None:
+                save_sigs.add(ss)
+                n_copied += 1
+                continue
+
+            # existing genome counts come first, then the new genomes
+            lineages.add_counts(lineage_name, ident, (-1, n), ss.minhash)
+            add_new_genomes(lineage_name, group)
+            save_lineage_sketches(save_sigs, lineages)
+            n_updated += 1
+
+        # lineages not in the existing database
+        for lineage_name, group in groups.items():
+            add_new_genomes(lineage_name, group)
+            save_lineage_sketches(save_sigs, lineages)
+
+    print(f"copied {n_copied} unchanged sketches, updated {n_updated}, and added {len(groups)} new lineages.")
+
+    write_genomes_sidecar(output, genomes, rank=rank, select_mh=select_mh)
+    write_lineage_index(output)
+
+
+def parse_ranks(rank_str):
+    """
+    Parse a comma-separated list of ranks, and return them ordered from
+    the lowest rank (e.g. species) up.
+    """
+    all_ranks = tax_utils.RankLineageInfo().ranks
+    ranks = set()
+    for rank in rank_str.split(","):
+        rank = rank.strip()
+        if rank not in all_ranks:
+            print(f"unknown rank '{rank}'; available ranks are {', '.join(all_ranks)}.")
+            sys.exit(-1)
+        ranks.add(rank)
+
+    return sorted(ranks, key=all_ranks.index, reverse=True)
+
+
+def parse_selectors(args):
+    """
+    Return a list of FracMinHash sketch selections: one from the standard
+    -k/--scaled/moltype arguments, then one per -s/--select SPEC. Values
+    missing from a SPEC default to those of the first selection, or to
+    the sourmash_utils defaults for a different moltype.
+    """
+    base_mh = sourmash_utils.create_minhash_from_args(args)
+    moltypes = { m.lower(): m for m in sourmash_utils.DEFAULTS }
+
+    selectors = { (base_mh.ksize, base_mh.moltype, base_mh.scaled): base_mh }
+    for spec in args.select or []:
+        params = {}
+        try:
+            for item in spec.split(","):
+                key, sep, value = item.strip().partition("=")
+                if not sep and key.lower() in moltypes:
+                    params["moltype"] = moltypes[key.lower()]
+                elif key in ("k", "ksize"):
+                    params["ksize"] = int(value)
+                elif key == "scaled":
+                    params["scaled"] = int(value)
+                else:
+                    raise ValueError(item)
+        except ValueError:
+            print(f"cannot parse --select '{spec}'; use e.g. 'k=51' or 'protein,k=10,scaled=200'.")
+            sys.exit(-1)
+
+        moltype = params.get("moltype", base_mh.moltype)
+        defaults = sourmash_utils.DEFAULTS[moltype]
+        if moltype == base_mh.moltype:
+            defaults = dict(ksize=base_mh.ksize, scaled=base_mh.scaled)
+        select_mh = sourmash_utils.FracMinHash(
+            moltype=moltype,
+            ksize=params.get("ksize", defaults["ksize"]),
+            scaled=params.get("scaled", defaults["scaled"]))
+        selectors.setdefault((select_mh.ksize, select_mh.moltype,
+                              select_mh.scaled), select_mh)
+
+    return list(selectors.values())
+
+
+def createdb_outputs(output, ranks, selectors):
+    """
+    Return a dict of output filenames keyed by (selector number, rank),
+    filling in '{rank}', '{ksize}', '{moltype}' and '{scaled}' in 'output'.
+    """
+    outputs = {}
+    for sel_n, select_mh in enumerate(selectors):
+        for rank in ranks:
+            filename = output.replace("{rank}", rank)
+            filename = filename.replace("{ksize}", str(select_mh.ksize))
+            filename = filename.replace("{moltype}", select_mh.moltype)
+            filename = filename.replace("{scaled}", str(select_mh.scaled))
+            outputs[sel_n, rank] = filename
+
+    if len(set(outputs.values())) < len(outputs):
+        if len(ranks) > 1 and "{rank}" not in output:
+            print("-o/--output must contain '{rank}' when building more than one rank.")
+        else:
+            print("-o/--output must contain '{ksize}', '{moltype}' or '{scaled}' to name the output for each --select.")
+        sys.exit(-1)
+
+    return outputs
+
+
+class CreatedbTarget:
+    """
+    The merged sketches built by pangenome_createdb for one sketch
+    selection, at the lowest rank and at each higher rank in 'rollups'.
+    """
+    def __init__(self, select_mh, output, lineages, rollups):
+        self.select_mh = select_mh
+        self.output = output
+        self.lineages = lineages    # LineageAccumulator at the lowest rank
+        self.rollups = rollups      # list of RankRollup
+        self.genomes = []           # (ident, lineage name) of each sketch
+        self.save_sigs = None
+
+    def matches(self, ksize, moltype, scaled, track_abundance):
+        "Would sourmash select() pick a sketch with these parameters?"
+        return (ksize == self.select_mh.ksize and
+                moltype == self.select_mh.moltype and
+                0 < scaled <= self.select_mh.scaled and
+                (track_abundance or not self.select_mh.track_abundance))
+
+    def matches_row(self, row):
+        return self.matches(row["ksize"], row["moltype"], row["scaled"],
+                            row["with_abundance"])
+
+    def save_lineages(self):
+        "Save the finished lineages to self.save_sigs."
+        save_lineage_sketches(self.save_sigs, self.lineages,
+                              rollups=self.rollups)
+
+    def save_genomes(self, rank):
+        """
+        Write the genome list for the lineages at 'rank', and save the
+        sketches at higher ranks.
+        """
+        write_genomes_sidecar(self.output, self.genomes, rank=rank,
+                              select_mh=self.select_mh)
+        write_lineage_index(self.output)
+        save_rollups(self.rollups, self.genomes, select_mh=self.select_mh)
+
+
+def matching_targets(targets, minhash):
+    """
+    Return the CreatedbTargets whose selection matches 'minhash'. A single
+    target was used to select the sketches, so it matches them all.
+    """
+    if len(targets) == 1:
+        return targets
+    return [ target for target in targets
+             if target.matches(minhash.ksize, minhash.moltype, minhash.scaled,
+                               minhash.track_abundance) ]
+
+
+def lineage_parents(taxdb, rank, parent_rank):
+    """
+    Map each lineage name at 'rank' to its lineage name at 'parent_rank'.
+    Exits if a lineage has more than one parent.
+    """
+    if isinstance(taxdb, TaxonomyIndex):
+        pairs = taxdb.lineage_pairs(rank, parent_rank)
+    else:
+        ident_index = build_ident_index(taxdb, rank)
+        parent_index = build_ident_index(taxdb, parent_rank)
+        pairs = { (name, parent_index[ident])
+                  for ident, name in ident_index.items() }
+
+    parents = {}
+    for name, parent_name in pairs:
+        if parents.setdefault(name, parent_name) != parent_name:
+            print(f"{rank} '{name}' is in more than one {parent_rank}: '{parents[name]}' and '{parent_name}'.")
+            sys.exit(-1)
+
+    return parents
+
+
+class RankRollup:
+    """
+    Merged sketches at a higher rank, built by merging the sketches of
+    their lineages at a lower rank - e.g. genus sketches from species
+    sketches - rather than from the individual genome sketches.
+    """
+    def __init__(self, rank, output, parents, lineages):
+        self.rank = rank
+        self.output = output
+        self.parents = parents      # lower rank lineage name -> name at rank
+        self.lineages = lineages    # LineageAccumulator at rank
+
+    def add(self, lineage_name, state, minhash):
+        "Add a finished lower-rank lineage; see LineageAccumulator.finished."
+        self.lineages.add_lineage(self.parents[lineage_name], state, minhash)
+
+
+def save_rollups(rollups, genomes, *, select_mh):
+    "Save the sketches and genome list for each RankRollup."
+    for rollup in rollups:
+        print(f"Writing {rollup.rank} sketches to '{rollup.output}'")
+        with sourmash_args.SaveSignaturesToLocation(rollup.output) as save_sigs:
+            save_lineage_sketches(save_sigs, rollup.lineages)
+
+        write_genomes_sidecar(rollup.output,
+                              [ (ident, rollup.parents[lineage_name])
+                                for ident, lineage_name in genomes ],
+                              rank=rollup.rank, select_mh=select_mh)
+        write_lineage_index(rollup.output)
+
+
+def genomes_sidecar_path(db_filename):
+    "Return the filename of the genome list kept alongside a database."
+    return db_filename + ".genomes.csv"
+
+
+SIDECAR_PARAMS = ["rank", "ksize", "moltype", "scaled"]
+
+
+def sidecar_params(rank, select_mh):
+    "Return the build parameters recorded in a genomes sidecar."
+    return dict(rank=rank, ksize=str(select_mh.ksize),
+                moltype=select_mh.moltype, scaled=str(select_mh.scaled))
+
+
+def format_sidecar_params(params):
+    return ", ".join( f"{key}={params[key]}" for key in SIDECAR_PARAMS )
+
+
+def write_genomes_sidecar(db_filename, genomes, *, rank, select_mh):
+    """
+    Record the (ident, lineage) of each genome included in a database,
+    along with the rank and sketch selection the database was built with.
+    """
+    filename = genomes_sidecar_path(db_filename)
+    params = list(sidecar_params(rank, select_mh).values())
+    print(f"Writing list of {len(genomes)} included genomes to '{filename}'")
+    with open(filename, "w", newline="") as fp:
+        w = csv.writer(fp)
+        w.writerow(["ident", "lineage"] + SIDECAR_PARAMS)
+        w.writerows( list(genome) + params for genome in genomes )
+
+
+def load_genomes_sidecar(db_filename):
+    """
+    Load a genomes sidecar, returning a list of (ident, lineage) and a
+    dict of the build parameters; the parameters are None if the
+    sidecar lists no genomes.
+    """
+    filename = genomes_sidecar_path(db_filename)
+    if not os.path.exists(filename):
+        print(f"cannot find list of included genomes '{filename}' for '{db_filename}'.")
+        sys.exit(-1)
+
+    with open(filename, "r", newline="") as fp:
+        r = csv.DictReader(fp)
+        missing = set(SIDECAR_PARAMS) - set(r.fieldnames or [])
+        if missing:
+            print(f"'{filename}' does not record the {', '.join(sorted(missing))} that '{db_filename}' was built with; please rebuild it.")
+            sys.exit(-1)
+
+        genomes = []
+        all_params = set()
+        for row in r:
+            genomes.append((row["ident"], row["lineage"]))
+            all_params.add(tuple( row[key] for key in SIDECAR_PARAMS ))
+
+    if len(all_params) > 1:
+        print(f"'{filename}' lists genomes from more than one build.")
+        sys.exit(-1)
+
+    params = None
+    if all_params:
+        params = dict(zip(SIDECAR_PARAMS, all_params.pop()))
+    return genomes, params
+
+
+LINEAGE_INDEX_COLUMNS = ["internal_location", "md5", "md5short", "ksize",
+                         "moltype", "num", "scaled", "n_hashes",
+                         "with_abundance", "name", "filename"]
+
+
+def lineage_index_path(db_filename):
+    "Return the filename of the lineage lookup index kept alongside a database."
+    return db_filename + ".lineages.sqlite"
+
+
+def write_lineage_index(db_filename):
+    """
+    Index the manifest rows of a createdb database by lineage and sketch
+    name, so that
+    'pangenome_ranktable -l' can find a lineage without scanning the whole
+    manifest. Only zip databases, which can load sketches directly from a
+    manifest row, are indexed.
+    """
+    if not db_filename.endswith(".zip"):
+        return
+
+    filename = lineage_index_path(db_filename)
+    manifest = sourmash.load_file_as_index(db_filename).manifest
+    print(f"Writing lineage index for {len(manifest)} sketches to '{filename}'")
+
+    if os.path.exists(filename):
+        os.unlink(filename)
+
+    columns = ", ".join(LINEAGE_INDEX_COLUMNS)
+    placeholders = ", ".join("?" * (len(LINEAGE_INDEX_COLUMNS) + 3))
+    with contextlib.closing(sqlite3.connect(filename)) as conn:
+        with conn:
+            conn.execute(f"CREATE TABLE lineages (lineage TEXT, lineage_lower TEXT, name_lower TEXT, {columns})")
+            # sketch names are "{ident} {lineage_name}"; see save_lineage_sketches
+            conn.executemany(f"INSERT INTO lineages VALUES ({placeholders})",
+                             ( (lineage, lineage.lower(), row["name"].lower(),
+                                *(row[col] for col in LINEAGE_INDEX_COLUMNS))
+                               for row in manifest.rows
+                               for lineage in [row["name"].split(" ", 1)[-1]] ))
+            conn.execute("CREATE INDEX lineages_by_name ON lineages (lineage)")
+            conn.execute("CREATE INDEX lineages_by_lower ON lineages (lineage_lower)")
+            conn.execute("CREATE INDEX names_by_name ON lineages (name)")
+            conn.execute("CREATE INDEX names_by_lower ON lineages (name_lower)")
+
+
+def find_lineage_rows(db_filename, lineage_name, *, ignore_case=False):
+    """
+    Look up 'lineage_name' in the lineage index of a createdb database and
+    return the matching manifest rows: exact matches to a lineage or sketch
+    name if there are any, else all lineages and names starting with
+    'lineage_name'. Returns None if the database
+    has no up-to-date lineage index.
+    """
+    filename = lineage_index_path(db_filename)
+    if not os.path.exists(filename) or \
+       os.path.getmtime(filename) < os.path.getmtime(db_filename):
+        return None
+
+    if ignore_case:
+        lineage_col, name_col = "lineage_lower", "name_lower"
+        key = lineage_name.lower()
+    else:
+        lineage_col, name_col = "lineage", "name"
+        key = lineage_name
+
+    # U+10FFFF sorts after any character that can follow a prefix
+    end = key + "\U0010ffff"
+    columns = ", ".join(LINEAGE_INDEX_COLUMNS)
+    with contextlib.closing(sqlite3.connect(filename)) as conn:
+        found = conn.execute(f"""SELECT {columns} FROM lineages
+                                 WHERE {lineage_col} = ? OR {name_col} = ?
+                                 ORDER BY rowid""",
+                             (key, key)).fetchall()
+        if not found:
+            found = conn.execute(f"""SELECT {columns} FROM lineages
+                                     WHERE ({lineage_col} >= ? AND {lineage_col} < ?)
+                                        OR ({name_col} >= ? AND {name_col} < ?)
+                                     ORDER BY rowid""",
+                                 (key, end, key, end)).fetchall()
+
+    return [ dict(zip(LINEAGE_INDEX_COLUMNS, values)) for values in found ]
+
+
+#
+# presence matrix
+#
+# A presence matrix records which genomes in each lineage contain each
+# hash. It is a zip file containing PRESENCE_MATRIX_INDEX, a JSON list of
+# {"lineage": name, "genomes": [ident, ...]}, and for the n'th lineage
+# three .npy arrays of posting lists:
+#
+#   {n}/hashvals.npy  distinct hashvals, sorted and delta-encoded, uint64
+#   {n}/counts.npy    number of genomes containing each hash, uint32
+#   {n}/genomes.npy   genome indices for each hash in turn, ascending and
+#                     delta-encoded within each hash, uint32
+#
+# The small deltas compress well in the deflated zip members.
+#
+
+PRESENCE_MATRIX_INDEX = "lineages.json"
+
+
+def _delta_encode(values, starts=None):
+    "Delta-encode ascending runs of 'values', each beginning at 'starts'."
+    deltas = values.copy()
+    deltas[1:] -= values[:-1]
+    if starts is not None:
+        deltas[starts] = values[starts]
+    return deltas
+
+
+class PresenceMatrixWriter:
+    """
+    Write a presence matrix; see PresenceMatrix. Sketches are buffered by
+    lineage, and written out by 'finish'.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.zf = zipfile.ZipFile(filename, "w",
+                                  compression=zipfile.ZIP_DEFLATED)
+        self.index = []         # lineage name and genome list, by number
+        self.pending = {}       # lineage name -> [ (ident, hashvals) ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, lineage_name, ident, minhash):
+        "Record the hashes in 'minhash' for genome 'ident' in a lineage."
+        hashvals = np.fromiter(minhash.hashes, dtype=np.uint64,
+                               count=len(minhash))
+        self.pending.setdefault(lineage_name, []).append((ident, hashvals))
+
+    def finish(self):
+        "Write out the buffered lineages."
+        for lineage_name, sketches in self.pending.items():
+            self._write_lineage(lineage_name, sketches)
+        self.pending = {}
+
+    def _write_lineage(self, lineage_name, sketches):
+        sizes = [ len(hashvals) for _, hashvals in sketches ]
+        all_hashvals = np.concatenate([ hashvals for _, hashvals in sketches ])
+        all_genomes = np.repeat(np.arange(len(sketches), dtype=np.uint32),
+                                sizes)
+
+        # sort by hashval, then genome: each hash's genomes are a run
+        order = np.lexsort((all_genomes, all_hashvals))
+        all_hashvals = all_hashvals[order]
+        all_genomes = all_genomes[order]
+        hashvals, starts, counts = np.unique(all_hashvals, return_index=True,
+                                             return_counts=True)
+
+        n = len(self.index)
+        self._write_array(f"{n}/hashvals.npy", _delta_encode(hashvals))
+        self._write_array(f"{n}/counts.npy", counts.astype(np.uint32))
+        self._write_array(f"{n}/genomes.npy",
+                          _delta_encode(all_genomes, starts))
+        self.index.append({"lineage": lineage_name,
+                           "genomes": [ ident for ident, _ in sketches ]})
+
+    def _write_array(self, name, array):
+        with self.zf.open(name, "w", force_zip64=True) as fp:
+            np.lib.format.write_array(fp, array, allow_pickle=False)
+
+    def close(self):
+        self.finish()
+        self.zf.writestr(PRESENCE_MATRIX_INDEX, json.dumps(self.index))
+        self.zf.close()
+        print(f"Wrote presence matrix for {len(self.index)} lineages to '{self.filename}'")
+
+
+class PresenceMatrix:
+    """
+    Read a presence matrix written by 'pangenome_createdb --presence'.
+    Lineages are loaded on demand, as LineagePresence objects:
+
+        presence = PresenceMatrix("db.presence.zip")
+        lineage = presence["s__Escherichia coli"]
+        counts = lineage.frequencies(["GCF_000005845", "GCF_000008865"])
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.zf = zipfile.ZipFile(filename)
+        self.index = { entry["lineage"]: (n, entry["genomes"]) for n, entry
+                       in enumerate(json.loads(self.zf.read(PRESENCE_MATRIX_INDEX))) }
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __contains__(self, lineage_name):
+        return lineage_name in self.index
+
+    def _read_array(self, name):
+        with self.zf.open(name) as fp:
+            return np.lib.format.read_array(fp, allow_pickle=False)
+
+    def __getitem__(self, lineage_name):
+        n, genomes = self.index[lineage_name]
+        hashvals = np.cumsum(self._read_array(f"{n}/hashvals.npy"),
+                             dtype=np.uint64)
+        counts = self._read_array(f"{n}/counts.npy")
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        # undo the delta encoding, restarting at each hash's first genome
+        deltas = self._read_array(f"{n}/genomes.npy")
+        sums = np.cumsum(deltas, dtype=np.int64)
+        starts = offsets[:-1]
+        restart = np.repeat(sums[starts] - deltas[starts], counts)
+        genome_idx = (sums - restart).astype(np.uint32)
+
+        return LineagePresence(lineage_name, genomes, hashvals, offsets,
+                               genome_idx)
+
+
+class LineagePresence:
+    """
+    The genomes containing each hash in one lineage, as posting lists:
+    the genomes containing hashvals[i] are genome_idx[offsets[i]:offsets[i+1]].
+    """
+    def __init__(self, lineage_name, genomes, hashvals, offsets, genome_idx):
+        self.lineage_name = lineage_name
+        self.genomes = genomes          # list of idents
+        self.hashvals = hashvals
+        self.offsets = offsets
+        self.genome_idx = genome_idx
+        self._genome_numbers = { ident: n for n, ident in enumerate(genomes) }
+
+    def __len__(self):
+        return len(self.hashvals)
+
+    def genome_mask(self, genomes=None):
+        "Return a boolean array selecting 'genomes' (default: all) by ident."
+        if genomes is None:
+            return np.ones(len(self.genomes), dtype=bool)
+
+        mask = np.zeros(len(self.genomes), dtype=bool)
+        for ident in genomes:
+            if ident not in self._genome_numbers:
+                raise KeyError(f"genome '{ident}' is not in lineage '{self.lineage_name}'")
+            mask[self._genome_numbers[ident]] = True
+        return mask
+
+    def frequencies(self, genomes=None):
+        """
+        Return the number of 'genomes' (default: all) containing each hash
+        in self.hashvals, as a uint32 array.
+        """
+        if not len(self.hashvals):
+            return np.empty(0, dtype=np.uint32)
+        present = self.genome_mask(genomes)[self.genome_idx].astype(np.uint32)
+        return np.add.reduceat(present, self.offsets[:-1])
+
+    def genomes_with_hash(self, hashval):
+        "Return the idents of the genomes containing 'hashval'."
+        i = np.searchsorted(self.hashvals, np.uint64(hashval))
+        if i == len(self.hashvals) or self.hashvals[i] != hashval:
+            return []
+        return [ self.genomes[g] for g in
+                 self.genome_idx[self.offsets[i]:self.offsets[i + 1]] ]
+
+
+def load_taxonomy(taxonomy_files, rank):
+    """
+    Load taxonomy files, or a compiled taxonomy index, and return
+    (taxdb, ident_index) where ident_index maps version-stripped
+    identifiers to their lineage name at 'rank'.
+    """
+    if any( is_taxonomy_index(filename) for filename in taxonomy_files ):
+        if len(taxonomy_files) > 1:
+            print("a taxonomy index from pangenome_taxindex cannot be combined with other taxonomy files.")
+            sys.exit(-1)
+
+        filename = taxonomy_files[0]
+        print(f"loading taxonomy index from '{filename}'")
+        taxdb = TaxonomyIndex(filename)
+        print(f"found {len(taxdb)} identifiers in taxonomy index.")
+        if rank not in taxdb.ranks:
+            print(f"rank '{rank}' is not in the taxonomy index; available ranks are {', '.join(taxdb.ranks)}.")
+            sys.exit(-1)
+        return taxdb, taxdb.ident_index(rank)
+
+    print(f"loading taxonomies from {taxonomy_files}")
+    taxdb = tax_utils.MultiLineageDB.load(taxonomy_files)
+    print(f"found {len(taxdb)} identifiers in taxdb.")
+
+    return taxdb, build_ident_index(taxdb, rank)
+
+
+def select_ident_versions(taxdb):
+    """
+    Map each version-stripped identifier in taxdb to the lineage of one
+    version of it. If an identifier is present in several versions, an
+    unversioned entry is preferred, then the lowest version.
+    """
+    def version_key(ident):
+        if "." not in ident:
+            return -1
+        version = ident.split(".", 1)[1]
+        return int(version) if version.isdigit() else sys.maxsize
+
+    best_version = {}
+    lineages = {}
+    for ident, lineage_tup in taxdb.items():
+        short_ident = ident.split(".")[0]
+        version = version_key(ident)
+        if short_ident in best_version and best_version[short_ident] <= version:
+            continue
+        best_version[short_ident] = version
+        lineages[short_ident] = lineage_tup
+
+    return lineages
+
+
+def lineage_name_at_rank(lineage_tup, rank):
+    "Return the name of a lineage tuple at 'rank'."
+    lineage_info = tax_utils.RankLineageInfo(lineage=lineage_tup)
+    lineage = lineage_info.lineage_at_rank(rank)
+    return lineage[-1].name if lineage else None
+
+
+def build_ident_index(taxdb, rank):
+    """
+    Build a dict mapping version-stripped identifiers in taxdb to their
+    lineage name at 'rank'; see select_ident_versions.
+    """
+    ident_index = {}
+    lineage_names = {}
+    for short_ident, lineage_tup in select_ident_versions(taxdb).items():
+        # many identifiers share a lineage; only resolve the rank once
+        if lineage_tup not in lineage_names:
+            lineage_names[lineage_tup] = lineage_name_at_rank(lineage_tup,
+                                                              rank)
+        ident_index[short_ident] = lineage_names[lineage_tup]
+
+    return ident_index
+
+
+def find_lineage_name(ident_index, taxdb, name):
+    """
+    Find the lineage for a signature name, and return (ident, lineage
+    name). Exits if the ident cannot be found.
+    """
+    ident = tax_utils.get_ident(name)
+    lineage_name = ident_index.get(ident.split(".")[0])
+
+    if lineage_name is None:
+        report_missing_idents([ident], taxdb)
+        sys.exit(-1)
+
+    return ident, lineage_name
+
+
+def report_missing_idents(idents, taxdb, *, show=3):
+    print(f"cannot find {len(idents)} ident(s) in the provided taxonomy file.")
+    for ident in idents[:show]:
+        print(f"The three closest matches to {ident} are:")
+        for k in get_close_matches(ident, taxdb):
+            print(f"* '{k}'")
+
+
+#
+# Compiled taxonomy index, written by 'pangenome_taxindex'. It maps each
+# version-stripped identifier (see select_ident_versions) to an integer
+# lineage name id at every rank, and is memory-mapped by createdb:
+#
+#   8 bytes   magic, b"PGTAXIX1"
+#   8 bytes   h, the length of the header, as little-endian uint64
+#   h bytes   JSON header, with the ranks and the array sizes
+#
+# followed by these arrays, each padded to a multiple of 8 bytes:
+#
+#   slots          uint32[table_size]     hash table of ident number + 1
+#   ident_hashes   uint64[n]              hash of each ident; see taxindex_hash
+#   ident_offsets  uint64[n + 1]          start of each ident in ident_blob
+#   ident_blob     uint8[]                UTF-8 idents
+#   lineage_ids    uint32[n, n_ranks]     name id of each ident at each rank
+#   name_offsets   uint64[n_names + 1]    start of each name in name_blob
+#   name_blob      uint8[]                UTF-8 lineage names
+#
+# 'slots' is an open-addressing table with linear probing, so looking up
+# an ident takes O(1) reads of the memory map.
+#
+
+TAXONOMY_INDEX_MAGIC = b"PGTAXIX1"
+NO_LINEAGE_NAME = 2**32 - 1
+
+
+def taxindex_hash(ident):
+    "A 64-bit hash of an identifier that is stable across processes."
+    digest = hashlib.blake2b(ident.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _taxindex_layout(header):
+    "Return the (name, dtype, count) of each array in a taxonomy index."
+    n = header["n_idents"]
+    return [("slots", "<u4", header["table_size"]),
+            ("ident_hashes", "<u8", n),
+            ("ident_offsets", "<u8", n + 1),
+            ("ident_blob", "u1", header["ident_blob_size"]),
+            ("lineage_ids", "<u4", n * len(header["ranks"])),
+            ("name_offsets", "<u8", header["n_names"] + 1),
+            ("name_blob", "u1", header["name_blob_size"])]
+
+
+def _pad8(n):
+    return -(-n // 8) * 8
+
+
+def _string_table(strings):
+    "Return (offsets, blob) arrays for a list of strings."
+    encoded = [ x.encode("utf-8") for x in strings ]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([ len(x) for x in encoded ], dtype=np.uint64)
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return offsets, blob
+
+
+def write_taxonomy_index(filename, taxdb):
+    """
+    Compile taxdb into a taxonomy index at 'filename', and return
+    (number of idents, list of ranks).
+    """
+    ident_lineages = select_ident_versions(taxdb)
+    idents = list(ident_lineages)
+    ranks = list(tax_utils.RankLineageInfo().ranks)
+
+    # resolve each distinct lineage once, at every rank
+    name_ids = {}
+    lineage_rows = {}
+    lineage_ids = np.empty((len(idents), len(ranks)), dtype=np.uint32)
+    for n, lineage_tup in enumerate(ident_lineages.values()):
+        row = lineage_rows.get(lineage_tup)
+        if row is None:
+            row = []
+            for rank in ranks:
+                name = lineage_name_at_rank(lineage_tup, rank)
+                if name is None:
+                    row.append(NO_LINEAGE_NAME)
+                else:
+                    row.append(name_ids.setdefault(name, len(name_ids)))
+            lineage_rows[lineage_tup] = row
+        lineage_ids[n] = row
+
+    ident_hashes = np.fromiter(( taxindex_hash(x) for x in idents ),
+                               dtype=np.uint64, count=len(idents))
+
+    # keep the table at most half full
+    table_size = 1 << max(1, (2 * len(idents)).bit_length())
+    mask = table_size - 1
+    slots = np.zeros(table_size, dtype=np.uint32)
+    for n, h in enumerate(ident_hashes.tolist()):
+        slot = h & mask
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = n + 1
+
+    ident_offsets, ident_blob = _string_table(idents)
+    name_offsets, name_blob = _string_table(list(name_ids))
+    arrays = dict(slots=slots, ident_hashes=ident_hashes,
+                  ident_offsets=ident_offsets, ident_blob=ident_blob,
+                  lineage_ids=lineage_ids, name_offsets=name_offsets,
+                  name_blob=name_blob)
+
+    header = dict(ranks=ranks, n_idents=len(idents), table_size=table_size,
+                  n_names=len(name_ids), ident_blob_size=len(ident_blob),
+                  name_blob_size=len(name_blob))
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (_pad8(len(header_bytes)) - len(header_bytes))
+
+    with open(filename, "wb") as fp:
+        fp.write(TAXONOMY_INDEX_MAGIC)
+        fp.write(np.array([len(header_bytes)], dtype="<u8").tobytes())
+        fp.write(header_bytes)
+        for name, dtype, count in _taxindex_layout(header):
+            data = np.ascontiguousarray(arrays[name], dtype=dtype).tobytes()
+            assert len(data) == count * np.dtype(dtype).itemsize
+            fp.write(data)
+            fp.write(b"\0" * (_pad8(len(data)) - len(data)))
+
+    return len(idents), ranks
+
+
+def is_taxonomy_index(filename):
+    if not os.path.isfile(filename):
+        return False
+    with open(filename, "rb") as fp:
+        return fp.read(len(TAXONOMY_INDEX_MAGIC)) == TAXONOMY_INDEX_MAGIC
+
+
+class TaxonomyIndex:
+    """
+    A memory-mapped taxonomy index; see write_taxonomy_index. Iterating
+    over it yields the version-stripped identifiers, for get_close_matches.
+    """
+    def __init__(self, filename):
+        with open(filename, "rb") as fp:
+            magic = fp.read(len(TAXONOMY_INDEX_MAGIC))
+            assert magic == TAXONOMY_INDEX_MAGIC, filename
+            header_size, = np.frombuffer(fp.read(8), dtype="<u8")
+            header = json.loads(fp.read(int(header_size)))
+
+        self.filename = filename
+        self.ranks = header["ranks"]
+        self.n_idents = header["n_idents"]
+
+        offset = len(TAXONOMY_INDEX_MAGIC) + 8 + int(header_size)
+        for name, dtype, count in _taxindex_layout(header):
+            if count:
+                array = np.memmap(filename, dtype=dtype, mode="r",
+                                  offset=offset, shape=(count,))
+            else:
+                array = np.empty(0, dtype=dtype)
+            setattr(self, name, array)
+            offset += _pad8(count * np.dtype(dtype).itemsize)
+
+        self.lineage_ids = self.lineage_ids.reshape(self.n_idents,
+                                                    len(self.ranks))
+        self.mask = len(self.slots) - 1
+        self._names = {}
+
+    def __len__(self):
+        return self.n_idents
+
+    def __iter__(self):
+        for n in range(self.n_idents):
+            yield self._ident(n).decode("utf-8")
+
+    def _ident(self, n):
+        start, end = self.ident_offsets[n:n + 2]
+        return self.ident_blob[start:end].tobytes()
+
+    def find(self, short_ident):
+        "Return the number of a version-stripped ident, or None."
+        h = taxindex_hash(short_ident)
+        encoded = short_ident.encode("utf-8")
+        slot = h & self.mask
+        while True:
+            n = int(self.slots[slot])
+            if not n:
+                return None
+            n -= 1
+            if int(self.ident_hashes[n]) == h and self._ident(n) == encoded:
+                return n
+            slot = (slot + 1) & self.mask
+
+    def lineage_name(self, name_id):
+        "Return the lineage name for a name id, decoding each name once."
+        name = self._names.get(name_id)
+        if name is None and name_id != NO_LINEAGE_NAME:
+            start, end = self.name_offsets[name_id:name_id + 2]
+            name = self.name_blob[start:end].tobytes().decode("utf-8")
+            self._names[name_id] = name
+        return name
+
+    def lineage_pairs(self, rank, parent_rank):
+        "Return the distinct (name at rank, name at parent_rank) pairs."
+        ids = self.lineage_ids[:, [self.ranks.index(rank),
+                                   self.ranks.index(parent_rank)]]
+        return [ (self.lineage_name(int(name_id)),
+                  self.lineage_name(int(parent_id)))
+                 for name_id, parent_id in np.unique(ids, axis=0) ]
+
+    def ident_index(self, rank):
+        "Return a view mapping version-stripped idents to names at 'rank'."
+        return TaxonomyIndexRank(self, self.ranks.index(rank))
+
+
+class TaxonomyIndexRank:
+    "A dict-like view of a TaxonomyIndex at one rank; see build_ident_index."
+    def __init__(self, taxindex, rank_n):
+        self.taxindex = taxindex
+        self.rank_n = rank_n
+
+    def get(self, short_ident, default=None):
+        n = self.taxindex.find(short_ident)
+        if n is None:
+            return default
+        name_id = int(self.taxindex.lineage_ids[n, self.rank_n])
+        return self.taxindex.lineage_name(name_id)
+
+
+def pangenome_taxindex_main(args):
+    with timed_phase("taxonomy load"):
+        print(f"loading taxonomies from {args.taxonomy_file}")
+        taxdb = tax_utils.MultiLineageDB.load(args.taxonomy_file)
+        print(f"found {len(taxdb)} identifiers in taxdb.")
+
+    with timed_phase("write"):
+        n_idents, ranks = write_taxonomy_index(args.output, taxdb)
+    print(f"wrote index of {n_idents} identifiers at ranks {', '.join(ranks)} to '{args.output}'")
+
+
+def plan_createdb(filenames, selectors, ident_index, taxdb, *,
+                  exclude_idents=None):
+    """
+    Resolve the lineage of every sketch matching any of 'selectors' from
+    the manifest 'name' column, without loading any sketches. Returns a
+    list of (filename, db, rows) per file, where rows are ((file_n, row_n),
+    row, ident, lineage_name), or None if any of the files has no manifest.
+
+    Sketches whose version-stripped ident is in 'exclude_idents' are
+    skipped.
+    """
+    plan = []
+    missing = []
+    n_excluded = 0
+    for file_n, filename in enumerate(filenames):
+        print(f"loading manifest from file {filename}")
+        db = load_index_for_selectors(filename, selectors)
+        if db.manifest is None:
+            print(f"'{filename}' has no manifest; loading all sketches in order.")
+            return None
+
+        rows = []
+        for row_n, row in enumerate(db.manifest.rows):
+            ident = tax_utils.get_ident(row["name"])
+            if exclude_idents and ident.split(".")[0] in exclude_idents:
+                n_excluded += 1
+                continue
+
+            lineage_name = ident_index.get(ident.split(".")[0])
+            if lineage_name is None:
+                missing.append(ident)
+                continue
+            rows.append(((file_n, row_n), row, ident, lineage_name))
+
+        plan.append((filename, db, rows))
+
+    if missing:
+        report_missing_idents(missing, taxdb)
+        sys.exit(-1)
+
+    if n_excluded:
+        print(f"skipping {n_excluded} sketches already in the database.")
+
+    return plan
+
+
+def stream_sketches(filenames, selectors):
+    "Yield one group of (file_n, row_n, ss) per file, in file order."
+    for file_n, filename in enumerate(filenames):
+        print(f"loading sketches from file {filename}")
+        db = load_index_for_selectors(filename, selectors)
+        yield ( (file_n, n, ss) for n, ss in enumerate(db.signatures()) )
+
+
+def load_index_for_selectors(filename, selectors):
+    """
+    Load a sourmash Index from filename, selecting the sketches that match
+    any of the FracMinHash 'selectors', so that a single pass over the
+    Index loads the sketches for all of them. Without a manifest, all
+    sketches are loaded, and must be matched to the selectors as they are.
+    """
+    if len(selectors) == 1:
+        return sourmash_utils.load_index_and_select(filename, selectors[0])
+
+    db = sourmash.load_file_as_index(filename)
+    if db.manifest is None:
+        return db
+
+    def row_key(row):
+        return row["internal_location"], row["name"], row["md5"]
+
+    selected = set()
+    for select_mh in selectors:
+        sub_db = db.select(ksize=select_mh.ksize, moltype=select_mh.moltype,
+                           scaled=select_mh.scaled,
+                           abund=select_mh.track_abundance)
+        selected.update( row_key(row) for row in sub_db.manifest.rows )
+
+    rows = [ row for row in db.manifest.rows if row_key(row) in selected ]
+    if not rows:
+        raise ValueError(f"no matching sketches in '{filename}' for {', '.join(map(str, selectors))}")
+
+    return select_manifest_rows(db, rows)
+
+
+def load_sketches_by_plan(plan):
+    """
+    Yield one group of (file_n, row_n, ss) per lineage, with lineages in
+    order of first appearance, loading only that lineage's sketches.
+    """
+    groups = group_plan_by_lineage(plan)
+    print(f"found {len(groups)} distinct lineages in manifests")
+
+    for group in groups.values():
+        yield load_lineage_group(plan, group)
+
+
+def group_plan_by_lineage(plan):
+    "Group planned rows by lineage name, in order of first appearance."
+    groups = defaultdict(list)
+    for _, _, rows in plan:
+        for item in rows:
+            lineage_name = item[3]
+            groups[lineage_name].append(item)
+
+    return groups
+
+
+def load_lineage_group(plan, group):
+    "Load the sketches for one group of planned rows, yielding (file_n, row_n, ss)."
+    for file_n, items in itertools.groupby(group, key=lambda x: x[0][0]):
+        items = list(items)
+        db = plan[file_n][1]
+        sketches = load_sketches_for_rows(db, [ row for _, row, _, _ in items ])
+        for ((_, row_n), row, _, _), ss in zip(items, sketches):
+            assert ss.name == row["name"], (ss.name, row["name"])
+            yield file_n, row_n, ss
+
+
+def load_sketches_for_rows(db, rows):
+    """
+    Load the sketches for the given manifest rows of db, in row order.
+    """
+    return select_manifest_rows(db, rows).signatures()
+
+
+def select_manifest_rows(db, rows):
+    "Return an Index of the sketches in db for the given manifest rows."
+    manifest = CollectionManifest(rows)
+    if isinstance(db, ZipFileLinearIndex):
+        # zip files can load directly from a reordered subset manifest
+        return ZipFileLinearIndex(db.storage,
+                                  traverse_yield_all=db.traverse_yield_all,
+                                  manifest=manifest)
+
+    return db.select(picklist=manifest.to_picklist())
+
+
+
+_spill_ids = itertools.count()
+
+
+class LineageState:
+    "Accumulated state for a single lineage; see LineageAccumulator."
+    __slots__ = ("first", "last", "ident", "mh", "counts", "runs")
+
+    def __init__(self, pos, ident):
+        self.first = pos        # position of first sketch, for output order
+        self.last = pos         # position of last sketch...
+        self.ident = ident      # ...and its ident, to name the output sketch
+        self.mh = None          # merged MinHash
+        self.counts = None      # HashCounts, with --abund
+        self.runs = []          # spilled runs, as filename prefixes
+
+    def nbytes(self):
+        "Approximate memory used by the in-memory sketch and counts."
+        size = 0
+        if self.mh is not None:
+            size += len(self.mh) * (16 if self.mh.track_abundance else 8)
+        if self.counts is not None:
+            size += self.counts.nbytes()
+        return size
+
+
+class LineageAccumulator:
+    """
+    Merge sketches by lineage, optionally counting the number of sketches
+    containing each hash (abund=True).
+
+    If max_memory is set, the in-memory sketches and counts are spilled
+    to sorted runs in spill_dir whenever their approximate size exceeds
+    max_memory bytes. The runs for each lineage are merged back together
+    as that lineage's final sketch is built.
+    """
+    def __init__(self, *, abund=False, max_memory=None, spill_dir=None):
+        if max_memory and spill_dir is None:
+            raise ValueError("max_memory requires a spill_dir")
+
+        self.abund = abund
+        self.max_memory = max_memory
+        self.spill_dir = spill_dir
+        self.lineages = {}
+        self.mem_used = 0
+        self.n_spills = 0
+
+    def __len__(self):
+        return len(self.lineages)
+
+    def add(self, lineage_name, ident, pos, minhash, *, _genome_counts=None):
+        """
+        Add a sketch to a lineage. 'pos' orders sketches across inputs;
+        the lineage is named for the ident of its last sketch. Returns the
+        in-memory merged MinHash for the lineage.
+        """
+        state = self.lineages.get(lineage_name)
+        if state is None:
+            state = LineageState(pos, ident)
+            self.lineages[lineage_name] = state
+        else:
+            state.last = pos
+            state.ident = ident
+
+        before = state.nbytes()
+
+        if state.mh is None:
+            state.mh = minhash.to_mutable()
+        else:
+            state.mh += minhash
+
+        # abundances within an individual sketch are discarded;
+        # each hash is counted once per genome.
+        if self.abund:
+            if state.counts is None:
+                state.counts = HashCounts()
+            if _genome_counts is not None:
+                hashvals, counts = minhash_to_arrays(_genome_counts)
+                state.counts.update(HashCounts.from_arrays(hashvals,
+                                                           counts.astype(np.uint32)))
+            else:
+                state.counts.add_sketch(minhash)
+
+        self.mem_used += state.nbytes() - before
+        mh = state.mh
+        self._check_memory()
+        return mh
+
+    def add_counts(self, lineage_name, ident, pos, abund_minhash):
+        """
+        Add a previously built lineage sketch, e.g. from 'createdb --abund',
+        whose abundances are the number of genomes containing each hash.
+        """
+        assert abund_minhash.track_abundance
+        return self.add(lineage_name, ident, pos, abund_minhash.flatten(),
+                        _genome_counts=abund_minhash)
+
+    def add_lineage(self, lineage_name, state, minhash):
+        """
+        Add a finished lineage from another LineageAccumulator, as yielded
+        by finished(), keeping its position and ident.
+        """
+        other = LineageAccumulator(abund=self.abund)
+        if self.abund:
+            other.add_counts(lineage_name, state.ident, state.first, minhash)
+        else:
+            other.add(lineage_name, state.ident, state.first, minhash)
+        other.lineages[lineage_name].last = state.last
+        self.update(other)
+
+    def update(self, other):
+        "Merge in the lineages accumulated by another LineageAccumulator."
+        for lineage_name, other_state in other.lineages.items():
+            state = self.lineages.get(lineage_name)
+            if state is None:
+                self.lineages[lineage_name] = other_state
+                self.mem_used += other_state.nbytes()
+                continue
+
+            before = state.nbytes()
+            if other_state.first < state.first:
+                state.first = other_state.first
+            if other_state.last > state.last:
+                state.last = other_state.last
+                state.ident = other_state.ident
+            state.mh += other_state.mh
+            if state.counts is not None:
+                state.counts.update(other_state.counts)
+            state.runs.extend(other_state.runs)
+            self.mem_used += state.nbytes() - before
+
+        self.n_spills += other.n_spills
+        self._check_memory()
+
+    def _check_memory(self):
+        if self.max_memory and self.mem_used > self.max_memory:
+            self.spill()
+
+    def spill(self):
+        "Write all in-memory sketches and counts to sorted runs on disk."
+        for state in self.lineages.values():
+            if not len(state.mh):
+                continue
+
+            prefix = os.path.join(self.spill_dir,
+                                  f"run-{os.getpid()}-{next(_spill_ids)}")
+
+            hashvals, abunds = minhash_to_arrays(state.mh)
+            np.save(prefix + ".hashvals.npy", hashvals)
+            if abunds is not None:
+                np.save(prefix + ".abunds.npy", abunds)
+            if state.counts is not None:
+                count_hashvals, counts = state.counts.arrays()
+                assert np.array_equal(count_hashvals, hashvals)
+                np.save(prefix + ".counts.npy", counts)
+                state.counts = HashCounts()
+
+            state.runs.append(prefix)
+            state.mh = state.mh.copy_and_clear()
+
+        self.mem_used = 0
+        self.n_spills += 1
+
+    def finished(self):
+        """
+        Yield (lineage_name, LineageState, minhash) in order of first
+        appearance, merging any spilled runs. With abund=True, the minhash
+        abundances are the number of sketches containing each hash.
+        Lineages are removed as they are yielded.
+        """
+        order = sorted(self.lineages, key=lambda k: self.lineages[k].first)
+        for lineage_name in order:
+            state = self.lineages.pop(lineage_name)
+            self.mem_used -= state.nbytes()
+            yield lineage_name, state, self._finish(state)
+
+    def _finish(self, state):
+        mh = state.mh
+        counts = state.counts
+
+        if state.runs:
+            hashvals, abunds = minhash_to_arrays(mh)
+            if abunds is None:
+                abunds = np.ones(len(hashvals), dtype=np.uint64)
+            sketch_runs = [(hashvals, abunds)]
+            count_runs = [counts.arrays()] if counts is not None else []
+
+            # load every spilled run, then merge them all at once
+            for prefix in state.runs:
+                run_hashvals = np.load(prefix + ".hashvals.npy")
+                if mh.track_abundance:
+                    run_abunds = np.load(prefix + ".abunds.npy")
+                else:
+                    run_abunds = np.ones(len(run_hashvals), dtype=np.uint64)
+                sketch_runs.append((run_hashvals, run_abunds))
+                if counts is not None:
+                    count_runs.append((run_hashvals,
+                                       np.load(prefix + ".counts.npy")))
+
+                for ext in (".hashvals.npy", ".abunds.npy", ".counts.npy"):
+                    if os.path.exists(prefix + ext):
+                        os.unlink(prefix + ext)
+
+            hashvals, abunds = merge_hash_count_runs(sketch_runs)
+            if counts is not None:
+                counts = HashCounts.from_arrays(*merge_hash_count_runs(count_runs))
+
+            mh = mh.copy_and_clear()
+            if mh.track_abundance:
+                mh.set_abundances(dict(zip(hashvals.tolist(), abunds.tolist())))
+            else:
+                mh.add_many(hashvals.tolist())
+
+        # Add abundance to signature if `--abund` in cli
+        if counts is not None:
+            abund_mh = mh.copy_and_clear()
+            abund_mh.track_abundance = True
+            abund_mh.set_abundances(counts)
+            return abund_mh
+
+        return mh
+
+
+def minhash_to_arrays(mh):
+    """
+    Return (hashvals, abunds) numpy arrays for a MinHash; abunds is None
+    if the sketch does not track abundance.
+    """
+    hashes = mh.hashes
+    hashvals = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+    abunds = None
+    if mh.track_abundance:
+        abunds = np.fromiter(hashes.values(), dtype=np.uint64,
+                             count=len(hashes))
+    return hashvals, abunds
+
+
+def save_lineage_sketches(save_sigs, lineages, *, rollups=()):
+    """
+    Save one merged sketch per lineage in a LineageAccumulator, removing
+    them from the accumulator. Each sketch is also merged into 'rollups',
+    a list of RankRollup.
+    """
+    if lineages.n_spills:
+        print(f"(merging {lineages.n_spills} spilled runs)")
+
+    for lineage_name, state, mh in lineages.finished():
+        n = len(save_sigs)
+        if n and n % 1000 == 0:
+            print(f"...{n} - saving")
+
+        with timed_phase("write") as phase:
+            sig_name = f"{state.ident} {lineage_name}"
+            ss = sourmash.SourmashSignature(mh, name=sig_name)
+            save_sigs.add(ss)
+            phase.add(sketches=1, hashes=len(mh))
+
+        for rollup in rollups:
+            with timed_phase("accumulate"):
+                rollup.add(lineage_name, state, mh)
+
+    lineages.n_spills = 0
+
+
+def createdb_parallel(args, plan, targets, spill_dir, *, max_memory=None):
+    """
+    Split the planned manifest rows across args.cores worker processes,
+    each of which builds a partial LineageAccumulator per CreatedbTarget.
+    The partials are then reduced into each target's LineageAccumulator,
+    in the same order as the serial code path. 'max_memory' is the limit
+    for each worker accumulator; see createdb_memory_share.
+    """
+    jobs = []
+    for filename, _, rows in plan:
+        for chunk in split_manifest_rows(rows, args.cores):
+            jobs.append((filename, chunk))
+
+    selectors = [ target.select_mh for target in targets ]
+
+    print(f"merging sketches in {len(jobs)} chunks across {args.cores} processes")
+    with ProcessPoolExecutor(max_workers=args.cores) as executor:
+        futures = [ executor.submit(_createdb_accumulate_chunk, filename, chunk,
+                                    selectors, args.abund, max_memory,
+                                    spill_dir)
+                    for filename, chunk in jobs ]
+        for n, fut in enumerate(futures, start=1):
+            for target, lineages in zip(targets, fut.result()):
+                target.lineages.update(lineages)
+            print(f"...{n} of {len(futures)} chunks merged")
+
+
+def memory_share(max_memory, n_accumulators):
+    """
+    Split a --max-memory limit evenly between n_accumulators
+    LineageAccumulators held at the same time. Returns None for no limit.
+    """
+    if not max_memory:
+        return None
+    return max(1, max_memory // n_accumulators)
+
+
+def createdb_memory_share(max_memory, n_ranks, n_selectors, cores):
+    """
+    Return the memory limit for each LineageAccumulator in
+    pangenome_createdb, so that together they stay within max_memory:
+    the parent holds one per rank and selection and, with cores > 1,
+    each worker process holds one per selection.
+    """
+    n_accumulators = n_ranks * n_selectors
+    if cores > 1:
+        n_accumulators += cores * n_selectors
+    return memory_share(max_memory, n_accumulators)
+
+
+def split_manifest_rows(rows, n_chunks):
+    """
+    Split manifest rows into at most n_chunks contiguous chunks. Rows that
+    share a (name, md5) picklist key are kept in the same chunk, so that
+    each worker's picklist selects exactly its own rows.
+    """
+    chunk_size = max(1, -(-len(rows) // n_chunks))
+
+    key_to_chunk = {}
+    chunks = []
+    for n, item in enumerate(rows):
+        row = item[1]
+        key = (row["name"], row["md5"])
+        chunk_n = key_to_chunk.get(key)
+        if chunk_n is None:
+            chunk_n = min(n // chunk_size, n_chunks - 1)
+            key_to_chunk[key] = chunk_n
+        while len(chunks) <= chunk_n:
+            chunks.append([])
+        chunks[chunk_n].append(item)
+
+    return [ c for c in chunks if c ]
+
+
+def _createdb_accumulate_chunk(filename, chunk, selectors, abund, max_memory,
+                               spill_dir):
+    """
+    Worker: merge the sketches for one chunk of manifest rows, by lineage,
+    returning a LineageAccumulator for each of 'selectors'.
+    """
+    db = load_index_for_selectors(filename, selectors)
+    sketches = load_sketches_for_rows(db, [ row for _, row, _, _ in chunk ])
+
+    targets = [ CreatedbTarget(select_mh, None,
+                               LineageAccumulator(abund=abund,
+                                                  max_memory=max_memory,
+                                                  spill_dir=spill_dir), [])
+                for select_mh in selectors ]
+    for (pos, row, ident, lineage_name), ss in zip(chunk, sketches):
+        assert ss.name == row["name"], (ss.name, row["name"])
+        for target in matching_targets(targets, ss.minhash):
+            target.lineages.add(lineage_name, ident, pos, ss.minhash)
+
+    return [ target.lineages for target in targets ]
+
+
+class CsvRowWriter:
+    """
+    Write CSV rows through a single buffered file, in chunks of
+    'chunk_size' rows. If filename ends in '.gz', the output is
+    gzip-compressed in a writer thread, overlapping compression with
+    sketch loading.
+    """
+    def __init__(self, filename, *, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.chunk = []
+        self.thread = None
+
+        if filename.endswith(".gz"):
+            self.fp = gzip.open(filename, "wt", newline="")
+            self.queue = queue.Queue(maxsize=4)
+            self.error = None
+            self.thread = threading.Thread(target=self._write_chunks,
+                                           name="CsvRowWriter", daemon=True)
+            self.thread.start()
+        else:
+            self.fp = open(filename, "w", newline="")
+        self.writer = csv.writer(self.fp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def writerow(self, row):
+        "Write a row, as a sequence of values."
+        self.chunk.append(row)
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.chunk:
+            return
+        if self.thread is None:
+            self.writer.writerows(self.chunk)
+        else:
+            if self.error is not None:
+                raise self.error
+            self.queue.put(self.chunk)
+        self.chunk = []
+
+    def _write_chunks(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            try:
+                if self.error is None:
+                    self.writer.writerows(chunk)
+            except BaseException as exc:
+                self.error = exc
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.thread is not None:
+                self.queue.put(None)
+                self.thread.join()
+            self.fp.close()
+
+        if self.thread is not None and self.error is not None:
+            raise self.error
+
+
+# @CTB do we need this?
+def check_csv(csv_file):
+    if csv_file is None:
+        return
+
+    if os.path.exists(csv_file):
+        raise argparse.ArgumentTypeError("\n%s already exists" % csv_file)
+
+    # gzip-compressed output; see CsvRowWriter.
+    if csv_file.endswith(".gz"):
+        return csv_file
+
+    count_csv = os.path.splitext(csv_file)[0] + ".csv"
+    return count_csv
+
+
+#
+# pangenome_merge
+#
+
+def pangenome_merge_main(args):
+    select_mh = sourmash_utils.create_minhash_from_args(args)
+    print(f"selecting sketches: {select_mh}")
+
+    # count the number of sketches containing each hash, across all files
+    if args.cores > 1:
+        # sketches are decoded and counted in the worker processes
+        with timed_phase("accumulate"):
+            c = merge_count_parallel(args.sketches, select_mh, args.cores)
+    else:
+        c = HashCounts()
+
+        # Load the database
+        for filename in args.sketches:
+            print(f"loading sketches from file {filename}")
+            with timed_phase("manifest select"):
+                db = sourmash_utils.load_index_and_select(filename, select_mh)
+
+            # work across the entire database
+            sketches = timed_sketches(db.signatures(),
+                                      n_hashes=lambda ss: len(ss.minhash))
+            for n, ss in enumerate(sketches):
+                if n and n % 1000 == 0:
+                    print(f"...{n} - loading")
+
+                with timed_phase("accumulate") as phase:
+                    c.add_sketch(ss.minhash)
+                    phase.add(sketches=1, hashes=len(ss.minhash))
+
+    # save!
+    print(f"Writing output sketches to '{args.output}'")
+
+    sig_name = "merged" # @CTB update with --name?
+
+    with timed_phase("write") as phase:
+        abund_mh = select_mh.copy_and_clear() # hmm, don't need mh tracked above?
+        abund_mh.track_abundance = True
+        abund_mh.set_abundances(c)
+
+        assert not os.path.exists(args.output) # @CTB
+        with sourmash_args.SaveSignaturesToLocation(args.output) as save_sigs:
+            print(f"saving to '{args.output}'")
+
+            ss = sourmash.SourmashSignature(abund_mh, name=sig_name)
+            save_sigs.add(ss)
+        phase.add(sketches=1, hashes=len(abund_mh))
+
+
+def merge_count_parallel(filenames, select_mh, n_cores):
+    """
+    Count hashes across all sketches in 'filenames' by splitting their
+    manifests across n_cores worker processes, and summing the per-worker
+    HashCounts.
+    """
+    jobs = []
+    for file_n, filename in enumerate(filenames):
+        print(f"loading manifest from file {filename}")
+        db = sourmash_utils.load_index_and_select(filename, select_mh)
+        if db.manifest is None:
+            print(f"'{filename}' has no manifest; cannot split it across cores.")
+            sys.exit(-1)
+
+        rows = [ ((file_n, row_n), row) for row_n, row in enumerate(db.manifest.rows) ]
+        for chunk in split_manifest_rows(rows, n_cores):
+            jobs.append((filename, [ row for _, row in chunk ]))
+
+    print(f"counting hashes in {len(jobs)} chunks across {n_cores} processes")
+    c = HashCounts()
+    with ProcessPoolExecutor(max_workers=n_cores) as executor:
+        futures = [ executor.submit(_merge_count_chunk, filename, rows,
+                                    select_mh)
+                    for filename, rows in jobs ]
+        for n, fut in enumerate(futures, start=1):
+            c.update(fut.result())
+            print(f"...{n} of {len(futures)} chunks counted")
+
+    return c
+
+
+def _merge_count_chunk(filename, rows, select_mh):
+    "Worker: count hashes across the sketches for one chunk of manifest rows."
+    db = sourmash_utils.load_index_and_select(filename, select_mh)
+
+    c = HashCounts()
+    for ss in load_sketches_for_rows(db, rows):
+        c.add_sketch(ss.minhash)
+
+    return c
+
+
+def load_all_sketches(
+        filename,
+        *,
+        select_mh=None,
+):
+    """
+    Process a database of sketches into a single merged pangenome sketch.
+    """
+    print(f"selecting sketches: {select_mh}")
+
+    ss_dict = {}
+    print(f"loading sketches from file '{filename}'")
+    db = sourmash_utils.load_index_and_select(filename, select_mh)
+    print(f"'{filename}' contains {len(db)} signatures")
+
+    assert len(db) == 1, len(db)
+
+    # load the entire database
+    for n, ss in enumerate(db.signatures()):
+        if n % 10 == 0:
+            print(f"...Processing {n} of {len(db)}", end="\r", flush=True)
+
+            name = ss.name
+
+            mh = ss.minhash
+            hashes = mh.hashes
+            ss_dict[name] = hashes
+
+        print(f"...Processed {n+1} of {len(db)} \n")
+
+    return ss_dict
+
+
+def load_sketches_by_lineage(filename,
+                             lineage_name,
+                             *,
+                             ignore_case=True,
+                             select_mh=None,
+):
+    """
+    Process a database of sketches into a set of merged pangenome sketches,
+    based on matches to lineage.
+    """
+    print(f"selecting sketches: {select_mh}")
+
+    ss_dict = load_sketches_by_lineage_index(filename, lineage_name,
+                                             ignore_case=ignore_case,
+                                             select_mh=select_mh)
+    if ss_dict:
+        return ss_dict
+
+    ss_dict = {}
+    print(f"loading sketches from file '{filename}'")
+    db = sourmash_utils.load_index_and_select(filename, select_mh)
+    print(f"'{filename}' contains {len(db)} signatures")
+
+    print(f"Looking for {lineage_name} signature\n")
+
+    # build the search pattern
+    if ignore_case:
+        pattern = re.compile(lineage_name, re.IGNORECASE)
+    else:
+        pattern = re.compile(lineage_name)
+
+    def search_pattern(vals):
+        return any(pattern.search(val) for val in vals)
+
+    # find all matching rows.
+    mf = db.manifest
+    sub_mf = mf.filter_on_columns(search_pattern, ["name", "filename", "md5"])
+
+    selected_sigs = []
+    print(f"Found {len(sub_mf)} signatures in '{filename}':")
+
+    for n, row in enumerate(sub_mf.rows, start=1):
+        print(f'{n:<15} \033[0;31m{row.get("name")}\033[0m')
+        selected_sigs.append(row.get("name"))
+
+    sub_picklist = sub_mf.to_picklist()
+
+    try:
+        db = db.select(picklist=sub_picklist)
+    except ValueError:
+        error("Chosen lineage name input not supported")
+        raise
+
+    for ss in db.signatures():
+        name = ss.name
+
+        print(f"Found \033[0;31m{name}\033[0m in '{filename}'")
+
+        mh = ss.minhash
+        hashes = mh.hashes
+        ss_dict[name] = hashes
+
+    total_rows_examined = 0
+    total_rows_examined += len(mf)
+
+    print(
+        f"\nloaded {total_rows_examined} total that matched ksize & molecule type"
+    )
+
+    if ss_dict:
+        print(f"extracted {len(ss_dict)} signatures from {len(db)} file(s)\n")
+
+    else:
+        print("no matching signatures found!\n")
+        sys.exit(-1)
+
+    return ss_dict
+
+
+def load_sketches_by_lineage_index(filename,
+                                   lineage_name,
+                                   *,
+                                   ignore_case=True,
+                                   select_mh=None,
+):
+    """
+    Load the sketches for an exact or prefix match to 'lineage_name' using
+    the lineage index written by createdb. Returns None if there is no
+    index or nothing matches, so that the caller can fall back to a
+    regex search of the manifest.
+    """
+    rows = find_lineage_rows(filename, lineage_name, ignore_case=ignore_case)
+    if rows is None:
+        return None
+
+    db = ZipFileLinearIndex(ZipStorage(filename),
+                            manifest=CollectionManifest(rows))
+    if select_mh is not None:
+        db = db.select(ksize=select_mh.ksize,
+                       moltype=select_mh.moltype,
+                       scaled=select_mh.scaled,
+                       abund=select_mh.track_abundance)
+    if not db.manifest:
+        print(f"no match for '{lineage_name}' in lineage index; searching manifest")
+        return None
+
+    print(f"Found {len(db.manifest)} signatures for '{lineage_name}' in lineage index:")
+
+    ss_dict = {}
+    for n, ss in enumerate(db.signatures(), start=1):
+        print(f'{n:<15} \033[0;31m{ss.name}\033[0m')
+        ss_dict[ss.name] = ss.minhash.hashes
+
+    print(f"extracted {len(ss_dict)} signatures from '{filename}'\n")
+    return ss_dict
+
+
+def pangenome_frequency_arrays(data, *, scaled=None):
+    """
+    For each {hashval: abund} dict in 'data', yield (hashvals, abunds,
+    max_value), with the arrays sorted by abund, highest first. If
+    'scaled' is given, only the hashes kept by downsampling to it are
+    yielded; max_value is still over all the hashes.
+    """
+    for name, hash_dict in data.items():
+        hashvals = np.fromiter(hash_dict.keys(), dtype=np.uint64,
+                               count=len(hash_dict))
+        abunds = np.fromiter(hash_dict.values(), dtype=np.uint32,
+                             count=len(hash_dict))
+        if not len(abunds):
+            continue
+
+        # get max abundance in genome
+        max_value = int(abunds.max())
+
+        if scaled:
+            keep = hashvals <= np.uint64(_get_max_hash_for_scaled(scaled))
+            hashvals = hashvals[keep]
+            abunds = abunds[keep]
+
+        # sort by abund, highest first; ties stay in dict order.
+        order = np.argsort(-abunds.astype(np.int64), kind="stable")
+        yield hashvals[order], abunds[order], max_value
+
+
+def calc_pangenome_element_frequency(data):
+    # get the pangenome elements of the dicts for each rank pangenome
+    for hashvals, abunds, max_value in pangenome_frequency_arrays(data):
+        for hashval, hash_abund in zip(hashvals.tolist(), abunds.tolist()):
+            freq = round(hash_abund / max_value, 4)
+            yield hashval, freq, hash_abund, max_value
+
+
+def validate_thresholds(thresholds):
+    min_threshold = 1.
+    for k, v in thresholds.items():
+        assert v == float(v)    # must be number
+        min_threshold = min(min_threshold, v)
+    assert min_threshold == 0   # must catch all hashes :)
+
+
+def classify_pangenome_element(freq, *, thresholds=DEFAULT_THRESHOLDS):
+    validate_thresholds(thresholds)
+
+    if freq >= thresholds['CENTRAL_CORE']:
+        return CENTRAL_CORE
+    if freq >= thresholds['EXTERNAL_CORE']:
+        return EXTERNAL_CORE
+    if freq >= thresholds['SHELL']:
+        return SHELL
+    if freq >= thresholds['INNER_CLOUD']:
+        return INNER_CLOUD
+    if freq >= thresholds['SURFACE_CLOUD']:
+        return SURFACE_CLOUD
+
+    raise Exception("a hash slipped through the cracks")
+
+#
+# pangenome_ranktable
+#
+
+# @CTB - rename to count_hashes or something?
+def pangenome_ranktable_main(args):
+    select_mh = sourmash_utils.create_minhash_from_args(args)
+    check_resolutions(args.pyramid, select_mh, "--pyramid")
+
+    # load a pre-existing merged/etc database, calc hash info.
+    with timed_phase("sketch decode") as phase:
+        if args.lineage:
+            ss_dict = load_sketches_by_lineage(args.data,
+                                               args.lineage,
+                                               ignore_case=args.ignore_case,
+                                               select_mh=select_mh)
+        else:
+            ss_dict = load_all_sketches(args.data, select_mh=select_mh)
+        n_hashes = sum( len(hashes) for hashes in ss_dict.values() )
+        phase.add(sketches=len(ss_dict), hashes=n_hashes)
+
+    output = args.output_hash_classification
+    if output.endswith(BINARY_RANKTABLE_EXT):
+        print(f"Writing hash classification to binary ranktable '{output}'")
+    else:
+        print(f"Writing hash classification to CSV file '{output}'")
+    with timed_phase("write") as phase:
+        write_ranktable(output, ss_dict)
+        phase.add(sketches=len(ss_dict), hashes=n_hashes)
+
+    if args.pyramid:
+        with timed_phase("write"):
+            write_ranktable_pyramid(output, ss_dict, args.pyramid)
+
+
+def check_resolutions(scaled_values, select_mh, option):
+    "Exit unless 'scaled_values' are all coarser than the sketches."
+    if scaled_values and min(scaled_values) < select_mh.scaled:
+        print(f"{option} values must be at least the sketch scaled value, {select_mh.scaled}.")
+        sys.exit(-1)
+
+
+def write_ranktable(output, ss_dict):
+    """
+    Write a ranktable for a dict of {name: {hashval: abund}}; binary if
+    'output' ends with BINARY_RANKTABLE_EXT, CSV otherwise.
+    """
+    if output.endswith(BINARY_RANKTABLE_EXT):
+        write_binary_ranktable(output, *ranktable_arrays(ss_dict))
+        return
+
+    write_csv_ranktable(output, ss_dict)
+
+
+def write_ranktable_pyramid(output, ss_dict, scaled_values):
+    """
+    Write downsampled copies of the ranktable 'output' at each of
+    'scaled_values'; see ranktable_pyramid_filename.
+    """
+    if output.endswith(BINARY_RANKTABLE_EXT):
+        arrays = ranktable_arrays(ss_dict)
+
+    for scaled in scaled_values:
+        filename = ranktable_pyramid_filename(output, scaled)
+        print(f"Writing ranktable downsampled to scaled={scaled} to '{filename}'")
+        if filename.endswith(BINARY_RANKTABLE_EXT):
+            write_binary_ranktable(filename,
+                                   *downsample_ranktable(arrays, scaled))
+        else:
+            # rows in the same order as the full CSV ranktable
+            write_csv_ranktable(filename, ss_dict, scaled=scaled)
+
+
+def write_csv_ranktable(output, ss_dict, *, scaled=None,
+                        chunk_size=1_000_000):
+    """
+    Write a CSV ranktable for a dict of {name: {hashval: abund}}, building
+    the rows in bulk with numpy rather than one csv.writer call per hash.
+    The output is identical to writing calc_pangenome_element_frequency
+    rows with csv.writer. If 'scaled' is given, the ranktable is
+    downsampled to it.
+    """
+    with open(output, "w", newline="") as fp:
+        fp.write("hashval,freq,abund,max_abund\r\n")
+
+        for hashvals, abunds, max_value in pangenome_frequency_arrays(ss_dict,
+                                                                      scaled=scaled):
+            # there are few distinct abundances, so format the
+            # freq,abund,max_abund tail of each row once per abundance.
+            # Python's round() is used to match the csv.writer output.
+            distinct, inverse = np.unique(abunds, return_inverse=True)
+            tails = np.array([ f",{round(a / max_value, 4)},{a},{max_value}\r\n"
+                               for a in distinct.tolist() ])
+
+            for start in range(0, len(hashvals), chunk_size):
+                end = start + chunk_size
+                rows = np.char.add(hashvals[start:end].astype(str),
+                                   tails[inverse[start:end]])
+                fp.write("".join(rows.tolist()))
+
+
+def pangenome_ranktable_all_main(args):
+    """
+    Write one ranktable per signature in the database into args.output_dir,
+    reading the database only once.
+    """
+    select_mh = sourmash_utils.create_minhash_from_args(args)
+    print(f"selecting sketches: {select_mh}")
+
+    print(f"loading sketches from file '{args.data}'")
+    with timed_phase("manifest select"):
+        db = sourmash_utils.load_index_and_select(args.data, select_mh)
+    print(f"'{args.data}' contains {len(db)} signatures")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    ext = ".csv" if args.output_format == "csv" else BINARY_RANKTABLE_EXT
+
+    if args.cores > 1:
+        if db.manifest is None:
+            print(f"'{args.data}' has no manifest; cannot split it across cores.")
+            sys.exit(-1)
+
+        # pick all the output filenames up front, so workers don't collide
+        used = set()
+        rows = []
+        for row in db.manifest.rows:
+            filename = ranktable_filename(row["name"], row["md5"], ext, used)
+            rows.append((filename, row))
+
+        # sketches are decoded and written in the worker processes
+        index_rows = []
+        with timed_phase("write") as phase, \
+             ProcessPoolExecutor(max_workers=args.cores) as executor:
+            futures = [ executor.submit(_ranktable_chunk, args.data, chunk,
+                                        select_mh, args.output_dir)
+                        for chunk in split_manifest_rows(rows, args.cores) ]
+            for fut in futures:
+                index_rows.extend(fut.result())
+                print(f"...{len(index_rows)} of {len(rows)} ranktables written")
+            phase.add(sketches=len(index_rows),
+                      hashes=sum( row[3] for row in index_rows ))
+    else:
+        used = set()
+        index_rows = []
+        sketches = timed_sketches(db.signatures(),
+                                  n_hashes=lambda ss: len(ss.minhash))
+        for n, ss in enumerate(sketches):
+            if n and n % 100 == 0:
+                print(f"...{n} ranktables written")
+
+            filename = ranktable_filename(ss.name, ss.md5sum(), ext, used)
+            with timed_phase("write") as phase:
+                index_rows.append(_write_signature_ranktable(ss, filename,
+                                                             args.output_dir))
+                phase.add(sketches=1, hashes=len(ss.minhash))
+
+    index_csv = os.path.join(args.output_dir, "ranktables.csv")
+    print(f"Writing {len(index_rows)} ranktables to '{args.output_dir}', listed in '{index_csv}'")
+    with open(index_csv, "w", newline="") as fp:
+        w = csv.writer(fp)
+        w.writerow(["name", "md5", "ranktable", "n_hashes"])
+        w.writerows(index_rows)
+
+
+def ranktable_filename(name, md5, ext, used):
+    """
+    Pick a ranktable filename for a signature, based on the lineage part
+    of a 'pangenome_createdb' name ("<ident> <lineage>"). Filenames in
+    'used' are avoided, and the new filename is added to it.
+    """
+    lineage_name = name.split(" ", 1)[-1] if name else md5
+    base = re.sub(r"[^A-Za-z0-9_.-]+", "_", lineage_name).strip("_") or md5
+    filename = base + ext
+    if filename in used:
+        filename = f"{base}.{md5[:8]}{ext}"
+    used.add(filename)
+    return filename
+
+
+def _write_signature_ranktable(ss, filename, output_dir):
+    hashes = ss.minhash.hashes
+    write_ranktable(os.path.join(output_dir, filename), {ss.name: hashes})
+    return [ss.name, ss.md5sum(), filename, len(hashes)]
+
+
+def _ranktable_chunk(data, chunk, select_mh, output_dir):
+    "Worker: write ranktables for one chunk of (filename, manifest row)."
+    db = sourmash_utils.load_index_and_select(data, select_mh)
+    sketches = load_sketches_for_rows(db, [ row for _, row in chunk ])
+
+    index_rows = []
+    for (filename, row), ss in zip(chunk, sketches):
+        assert ss.name == row["name"], (ss.name, row["name"])
+        index_rows.append(_write_signature_ranktable(ss, filename, output_dir))
+
+    return index_rows
+
+
+#
+# ranktable files
+#
+# A ranktable is either a CSV file with columns hashval, freq, abund,
+# max_abund, or a binary file containing the same information:
+#
+#   8 bytes   magic, BINARY_RANKTABLE_MAGIC
+#   8 bytes   number of rows n, as little-endian uint64
+#   8n bytes  hashvals, sorted, as little-endian uint64
+#   4n bytes  abund, as little-endian uint32
+#   4n bytes  max_abund, as little-endian uint32
+#
+# Binary ranktables are memory-mapped for classification, with no parsing.
+#
+
+BINARY_RANKTABLE_MAGIC = b"PGRANKT1"
+BINARY_RANKTABLE_EXT = ".bin"
+
+
+def ranktable_arrays(data):
+    """
+    Build (hashvals, abund, max_abund) arrays, sorted by hashval, from a
+    dict of {name: {hashval: abund}} as used for the CSV ranktable.
+    """
+    hashvals = []
+    abunds = []
+    max_abunds = []
+    for name, hash_dict in data.items():
+        if not hash_dict:
+            continue
+        h = np.fromiter(hash_dict.keys(), dtype=np.uint64, count=len(hash_dict))
+        a = np.fromiter(hash_dict.values(), dtype=np.uint32, count=len(hash_dict))
+        hashvals.append(h)
+        abunds.append(a)
+        max_abunds.append(np.full(len(a), a.max(), dtype=np.uint32))
+
+    if not hashvals:
+        return (np.empty(0, dtype=np.uint64),
+                np.empty(0, dtype=np.uint32),
+                np.empty(0, dtype=np.uint32))
+
+    hashvals = np.concatenate(hashvals)
+    order = np.argsort(hashvals, kind="stable")
+
+    return (hashvals[order],
+            np.concatenate(abunds)[order],
+            np.concatenate(max_abunds)[order])
+
+
+def write_binary_ranktable(filename, hashvals, abunds, max_abunds):
+    "Write sorted, distinct ranktable arrays to a binary ranktable file."
+    n = len(hashvals)
+    assert len(abunds) == n and len(max_abunds) == n
+    assert is_strictly_sorted(hashvals), "hashval already encountered"
+    with open(filename, "wb") as fp:
+        fp.write(BINARY_RANKTABLE_MAGIC)
+        fp.write(np.array([n], dtype="<u8").tobytes())
+        fp.write(np.asarray(hashvals, dtype="<u8").tobytes())
+        fp.write(np.asarray(abunds, dtype="<u4").tobytes())
+        fp.write(np.asarray(max_abunds, dtype="<u4").tobytes())
+
+
+def ranktable_pyramid_filename(filename, scaled):
+    """
+    Return the filename of the copy of ranktable 'filename' downsampled
+    to 'scaled', e.g. 'rt.bin' -> 'rt.scaled10000.bin'.
+    """
+    base, ext = os.path.splitext(filename)
+    return f"{base}.scaled{scaled}{ext}"
+
+
+def downsample_ranktable(arrays, scaled):
+    """
+    Downsample (hashvals, abund, max_abund) ranktable arrays to 'scaled'.
+    FracMinHash downsampling keeps the hashes at or below a cutoff, so for
+    arrays sorted by hashval this is a prefix; memory-mapped arrays are
+    not read.
+    """
+    hashvals, abunds, max_abunds = arrays
+    n = int(np.searchsorted(hashvals, np.uint64(_get_max_hash_for_scaled(scaled)),
+                            side="right"))
+    return hashvals[:n], abunds[:n], max_abunds[:n]
+
+
+def is_strictly_sorted(hashvals):
+    "Are 'hashvals' sorted and distinct?"
+    return not len(hashvals) or bool((hashvals[1:] > hashvals[:-1]).all())
+
+
+def is_binary_ranktable(filename):
+    with open(filename, "rb") as fp:
+        return fp.read(len(BINARY_RANKTABLE_MAGIC)) == BINARY_RANKTABLE_MAGIC
+
+
+def load_ranktable(filename):
+    """
+    Load a CSV or binary ranktable, returning (hashvals, abund, max_abund)
+    arrays sorted by hashval. Binary ranktables are memory-mapped.
+    """
+    if is_binary_ranktable(filename):
+        return _load_binary_ranktable(filename)
+    return _load_csv_ranktable(filename)
+
+
+def _load_binary_ranktable(filename):
+    header_size = len(BINARY_RANKTABLE_MAGIC) + 8
+    n, = np.fromfile(filename, dtype="<u8", count=1,
+                     offset=len(BINARY_RANKTABLE_MAGIC))
+    n = int(n)
+    if not n:
+        empty = np.empty(0, dtype=np.uint32)
+        return np.empty(0, dtype=np.uint64), empty, empty
+
+    hashvals = np.memmap(filename, dtype="<u8", mode="r",
+                         offset=header_size, shape=(n,))
+    abunds = np.memmap(filename, dtype="<u4", mode="r",
+                       offset=header_size + 8*n, shape=(n,))
+    max_abunds = np.memmap(filename, dtype="<u4", mode="r",
+                           offset=header_size + 12*n, shape=(n,))
+    return hashvals, abunds, max_abunds
+
+
+def _load_csv_ranktable(filename):
+    hashvals = []
+    abunds = []
+    max_abunds = []
+    with open(filename, "r", newline="") as fp:
+        r = csv.DictReader(fp)
+        for row in r:
+            hashvals.append(int(row["hashval"]))
+            abunds.append(int(row["abund"]))
+            max_abunds.append(int(row["max_abund"]))
+
+    hashvals = np.array(hashvals, dtype=np.uint64)
+    order = np.argsort(hashvals, kind="stable")
+    hashvals = hashvals[order]
+
+    assert is_strictly_sorted(hashvals), "hashval already encountered"
+
+    return (hashvals,
+            np.array(abunds, dtype=np.uint32)[order],
+            np.array(max_abunds, dtype=np.uint32)[order])
+
+
+def classify_frequencies(freqs, *, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Vectorized version of classify_pangenome_element: return an array of
+    pangenome element classes for an array of frequencies.
+    """
+    validate_thresholds(thresholds)
+    freqs = np.asarray(freqs)
+
+    # classes from highest to lowest priority.
+    class_thresholds = [ thresholds['CENTRAL_CORE'],
+                         thresholds['EXTERNAL_CORE'],
+                         thresholds['SHELL'],
+                         thresholds['INNER_CLOUD'],
+                         thresholds['SURFACE_CLOUD'] ]
+    bins = class_thresholds[::-1]
+    if all(lo <= hi for lo, hi in zip(bins, bins[1:])):
+        # thresholds are ordered, so a single binary search per frequency
+        # finds the highest threshold it meets.
+        # digitize gives 5 for CENTRAL_CORE ... 1 for SURFACE_CLOUD, and
+        # 0 for frequencies below every threshold.
+        idx = np.digitize(freqs, bins)
+        classes = np.where(idx > 0, SURFACE_CLOUD + 1 - idx, 0).astype(np.int8)
+    else:
+        # assign from lowest to highest priority, so that each frequency
+        # ends up with the first class whose threshold it meets.
+        classes = np.zeros(len(freqs), dtype=np.int8)
+        class_ids = [CENTRAL_CORE, EXTERNAL_CORE, SHELL, INNER_CLOUD,
+                     SURFACE_CLOUD]
+        for class_id, threshold in reversed(list(zip(class_ids,
+                                                     class_thresholds))):
+            classes[freqs >= threshold] = class_id
+
+    assert classes.all(), "a hash slipped through the cracks"
+    return classes
+
+
+class RanktableCache:
+    """
+    An on-disk cache of parsed CSV ranktables, stored as binary ranktables
+    so that they can be memory-mapped rather than parsed again.
+
+    Entries are keyed by the absolute path, size and modification time of
+    the CSV file, so an edited or replaced ranktable gets a new entry.
+    Using an entry marks it as recently used, and the least recently used
+    entries are evicted when the cache grows beyond max_size bytes.
+    """
+    ext = ".rt" + BINARY_RANKTABLE_EXT
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_path(self, filename):
+        st = os.stat(filename)
+        key = f"{os.path.abspath(filename)}\0{st.st_size}\0{st.st_mtime_ns}"
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest + self.ext)
+
+    def load_ranktable(self, filename):
+        "Load a ranktable as load_ranktable does, via the cache."
+        if is_binary_ranktable(filename):
+            return load_ranktable(filename)
+
+        path = self.cache_path(filename)
+        try:
+            os.utime(path)      # mark as recently used
+            self.hits += 1
+            return _load_binary_ranktable(path)
+        except FileNotFoundError:
+            pass
+
+        self.misses += 1
+        arrays = _load_csv_ranktable(filename)
+
+        # write atomically, so concurrent runs never see a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            write_binary_ranktable(tmp_path, *arrays)
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            print(f"WARNING: cannot cache ranktable '{filename}': {exc}")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return arrays
+
+        self.evict(keep=path)
+        return arrays
+
+    def evict(self, *, keep=None):
+        """
+        Remove least recently used entries until the cache is no larger
+        than max_size. The entry 'keep' is never removed.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(self.ext):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:   # removed by a concurrent run
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+#
+# pangenome_classify
+#
+
+def classify_hashes_main(args):
+    select_mh = sourmash_utils.create_minhash_from_args(args)
+    print(f"selecting sketches: {select_mh}")
+
+    if args.server:
+        with timed_phase("manifest select"):
+            db = sourmash_utils.load_index_and_select(args.metagenome_sig,
+                                                      select_mh)
+        sketches = prefetch_signatures(timed_sketches(db.signatures(),
+                                                      n_hashes=lambda ss: len(ss.minhash)),
+                                       args.prefetch)
+        results = classify_via_server(args.server, sketches,
+                                      abund_weighted=args.abund_weighted)
+        report_classification(results, args.output,
+                              abund_weighted=args.abund_weighted)
+        return
+
+    check_resolutions(args.resolution, select_mh, "--resolution")
+
+    # @CTB print out the thresholds or something
+    thresholds = parse_thresholds(args.thresholds)
+
+    cache = None
+    if args.cache_dir:
+        cache = RanktableCache(args.cache_dir, args.cache_max_size)
+
+    # load in all the frequencies etc, and classify, just once.
+    with timed_phase("ranktable load") as phase:
+        if args.resolution:
+            ranktables = load_ranktable_pyramid(args.ranktable_csv_files,
+                                                args.resolution,
+                                                thresholds=thresholds,
+                                                cache=cache,
+                                                max_error=args.max_error)
+            phase.add(hashes=sum( len(index.rt_ids)
+                                  for _, index in ranktables.levels ))
+        else:
+            ranktables = load_classified_ranktables(args.ranktable_csv_files,
+                                                    thresholds=thresholds,
+                                                    cache=cache)
+            phase.add(hashes=len(ranktables.rt_ids))
+    if cache is not None:
+        print(f"loaded {cache.hits} ranktable(s) from cache '{cache.cache_dir}', parsed {cache.misses}")
+
+    with timed_phase("manifest select"):
+        db = sourmash_utils.load_index_and_select(args.metagenome_sig,
+                                                  select_mh)
+
+    # sketches are decoded in the prefetch thread, and timed there.
+    sketches = timed_sketches(db.signatures(),
+                              n_hashes=lambda ss: len(ss.minhash))
+    if args.output_class_sketches:
+        # class sketches are built and saved alongside classification.
+        sketches = prefetch_signatures(sketches, args.prefetch)
+        with SaveSignaturesToLocation(args.output_class_sketches) as save_sigs:
+            results = classify_and_save_sketches(sketches, ranktables,
+                                                 save_sigs,
+                                                 abund_weighted=args.abund_weighted)
+            report_classification(results, args.output,
+                                  n_ranktables=len(ranktables),
+                                  abund_weighted=args.abund_weighted)
+        print(f"saved {len(save_sigs)} class sketches to '{args.output_class_sketches}'")
+        return
+
+    if args.cores > 1 and db.manifest is not None:
+        # sketches are decoded and classified in the worker processes
+        results = classify_parallel(args.metagenome_sig, db, select_mh,
+                                    ranktables, args.cores,
+                                    abund_weighted=args.abund_weighted)
+        results = timed_sketches(results, "classify")
+    else:
+        sketches = prefetch_signatures(sketches, args.prefetch)
+        results = classify_sketches(sketches, ranktables,
+                                    abund_weighted=args.abund_weighted)
+
+    report_classification(results, args.output, n_ranktables=len(ranktables),
+                          abund_weighted=args.abund_weighted)
+
+    if args.resolution:
+        for scaled, n in sorted(ranktables.n_classified.items(), reverse=True):
+            print(f"classified {n} sketches at scaled={scaled}")
+
+
+def classify_sketches(sketches, ranktables, *, abund_weighted=False):
+    "Yield (sketch name, classify_sketch results) for each sketch."
+    for ss in sketches:
+        with timed_phase("classify") as phase:
+            classified = classify_sketch(ss.minhash, ranktables,
+                                         abund_weighted=abund_weighted)
+            phase.add(sketches=1, hashes=len(ss.minhash))
+        yield ss.name, classified
+
+
+def prefetch_signatures(sketches, n_prefetch):
+    """
+    Iterate over 'sketches' in a reader thread, keeping up to n_prefetch
+    loaded sketches queued ahead of the caller. This overlaps loading
+    (e.g. zip decompression) with classification while keeping memory
+    bounded. With n_prefetch <= 0, 'sketches' is returned unchanged.
+    """
+    if n_prefetch <= 0:
+        return sketches
+    return _prefetch(iter(sketches), n_prefetch)
+
+
+_PREFETCH_DONE = object()
+
+
+def _prefetch(sketches, n_prefetch):
+    q = queue.Queue(maxsize=n_prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        # give up if the consumer has gone away
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            for ss in sketches:
+                if not put(ss):
+                    return
+        except BaseException as exc:
+            put(exc)
+            return
+        put(_PREFETCH_DONE)
+
+    thread = threading.Thread(target=reader, name="prefetch_signatures",
+                              daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _PREFETCH_DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def report_classification(results, output, *, n_ranktables=0,
+                          abund_weighted=False):
+    """
+    Print classification results, or write them to 'output' as CSV.
+    'results' yields (sketch name, [(ranktable name, counter_d), ...]).
+    """
+    unit = "abundance-weighted hashes" if abund_weighted else "hashes"
+    if output:
+        print(f"Writing classification results to '{output}'")
+        with open(output, "w", newline="") as fp:
+            w = csv.writer(fp)
+            w.writerow(["metagenome", "ranktable", "class", "count", "percent"])
+            n = 0
+            for n, (sketch_name, classified) in enumerate(results, start=1):
+                n_ranktables = len(classified)
+                with timed_phase("write"):
+                    for rt_name, counter_d in classified:
+                        w.writerows(classification_rows(sketch_name, rt_name,
+                                                        counter_d))
+        print(f"classified {n} sketches against {n_ranktables} ranktables.")
+    else:
+        for sketch_name, classified in results:
+            with timed_phase("write"):
+                for rt_name, counter_d in classified:
+                    print_classification(sketch_name, rt_name, counter_d,
+                                         unit=unit)
+
+
+def parse_thresholds(thresholds_str):
+    "Parse colon-separated percentage thresholds into a thresholds dict."
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    if thresholds_str:
+        threshold_vals = thresholds_str.split(':')
+        assert len(threshold_vals) == 5
+        threshold_vals = [ int(t)/100 for t in threshold_vals ]
+        assert max(threshold_vals) <= 1
+        assert min(threshold_vals) >= 0
+
+        thresholds['CENTRAL_CORE'] = threshold_vals[0]
+        thresholds['EXTERNAL_CORE'] = threshold_vals[1]
+        thresholds['SHELL'] = threshold_vals[2]
+        thresholds['INNER_CLOUD'] = threshold_vals[3]
+        thresholds['SURFACE_CLOUD'] = threshold_vals[4]
+
+    return thresholds
+
+
+def load_classified_ranktables(filenames, *, thresholds=DEFAULT_THRESHOLDS,
+                               cache=None, scaled=None):
+    """
+    Load ranktables, classify their hashes, and combine them into a
+    single RanktableIndex. CSV ranktables are loaded via 'cache', a
+    RanktableCache, if given.
+
+    If 'scaled' is given, the ranktables are downsampled to it, using
+    the copies written by 'pangenome_ranktable --pyramid' where present.
+    """
+    load = cache.load_ranktable if cache is not None else load_ranktable
+
+    ranktables = []
+    for filename in filenames:
+        if scaled:
+            level_filename = ranktable_pyramid_filename(filename, scaled)
+            if os.path.exists(level_filename):
+                arrays = load(level_filename)
+            else:
+                arrays = load(filename)
+            arrays = downsample_ranktable(arrays, scaled)
+        else:
+            arrays = load(filename)
+        rt_hashvals, rt_abunds, rt_max_abunds = arrays
+        freqs = rt_abunds / rt_max_abunds
+        rt_classes = classify_frequencies(freqs, thresholds=thresholds)
+        ranktables.append((filename, rt_hashvals, rt_classes))
+
+    return RanktableIndex(ranktables)
+
+
+class RanktableIndex:
+    """
+    A combined index over many classified ranktables, so that each query
+    hash is looked up once rather than once per ranktable.
+
+    The index is stored CSR-style: a sorted array of distinct hashvals,
+    an offsets array, and parallel (ranktable id, class) entry arrays;
+    the entries for hashvals[i] are entries[offsets[i]:offsets[i+1]].
+    If each hash has exactly one entry, offsets is None and entry i is
+    for hashvals[i].
+    """
+    n_classes = max(NAMES) + 1
+
+    def __init__(self, ranktables):
+        """
+        Build from a list of (name, sorted hashvals, classes). A single
+        ranktable is indexed in place, so that the hashvals of a
+        memory-mapped binary ranktable are neither copied nor sorted.
+        """
+        self.names = [ name for name, _, _ in ranktables ]
+
+        if len(ranktables) == 1 and is_strictly_sorted(ranktables[0][1]):
+            _, self.hashvals, classes = ranktables[0]
+            self.classes = np.asarray(classes).view(np.uint8)
+            self.rt_ids = np.broadcast_to(np.uint32(0), self.classes.shape)
+            self.offsets = None
+            return
+
+        if ranktables:
+            all_hashvals = np.concatenate([ h for _, h, _ in ranktables ])
+            all_classes = np.concatenate([ c for _, _, c in ranktables ])
+        else:
+            all_hashvals = np.empty(0, dtype=np.uint64)
+            all_classes = np.empty(0, dtype=np.int8)
+        all_ids = np.repeat(np.arange(len(ranktables), dtype=np.uint32),
+                            [ len(h) for _, h, _ in ranktables ])
+
+        # each ranktable is sorted, so a stable sort only has to merge
+        # the sorted runs.
+        order = np.argsort(all_hashvals, kind="stable")
+        all_hashvals = all_hashvals[order]
+        self.rt_ids = all_ids[order]
+        self.classes = all_classes[order].astype(np.uint8)
+
+        self.hashvals, starts = np.unique(all_hashvals, return_index=True)
+        self.offsets = np.append(starts, len(all_hashvals))
+
+    def __len__(self):
+        return len(self.names)
+
+    def tally(self, query_hashvals, weights=None):
+        """
+        Count query hashes by class, for every ranktable at once. Returns
+        an (n ranktables, n_classes) array of counts; column 0 holds the
+        number of query hashes not in each ranktable. If 'weights' is
+        given, each hash counts as its weight, e.g. its abundance.
+        """
+        return self.tally_many([query_hashvals], weights=[weights])[0]
+
+    def tally_many(self, queries, weights=None):
+        """
+        As tally, for a batch of queries in one pass. Returns an
+        (n queries, n ranktables, n_classes) array of counts. 'weights',
+        if given, is a list with weights (or None) for each query.
+        """
+        queries = [ np.asarray(q, dtype=np.uint64) for q in queries ]
+        n_q = len(queries)
+        n_rt = len(self.names)
+        table = np.zeros((n_q, n_rt, self.n_classes), dtype=np.int64)
+        if not n_q or not n_rt:
+            return table
+
+        query_lengths = np.array([ len(q) for q in queries ], dtype=np.int64)
+        query_ids = np.repeat(np.arange(n_q, dtype=np.int64), query_lengths)
+        positions, entry_idx = self._lookup(np.concatenate(queries))
+
+        keys = query_ids[positions] * n_rt
+        keys += self.rt_ids[entry_idx]
+        keys *= self.n_classes
+        keys += self.classes[entry_idx]
+
+        if weights is None or all( w is None for w in weights ):
+            table += np.bincount(keys, minlength=table.size).reshape(table.shape)
+            totals = query_lengths
+        else:
+            weights = [ np.ones(len(q)) if w is None
+                        else np.asarray(w, dtype=np.float64)
+                        for q, w in zip(queries, weights) ]
+            query_weights = np.concatenate(weights)
+            counts = np.bincount(keys, weights=query_weights[positions],
+                                 minlength=table.size)
+            table += np.rint(counts).astype(np.int64).reshape(table.shape)
+            totals = np.array([ int(w.sum()) for w in weights ],
+                              dtype=np.int64)
+
+        table[:, :, 0] = totals[:, None] - table.sum(axis=2)
+        return table
+
+    def classify_hashes(self, query_hashvals):
+        """
+        Return an (n ranktables, n query hashes) array with the class of
+        each query hash in each ranktable, or 0 if it is not there.
+        """
+        query_hashvals = np.asarray(query_hashvals, dtype=np.uint64)
+        classes = np.zeros((len(self.names), len(query_hashvals)),
+                           dtype=np.int8)
+        positions, entry_idx = self._lookup(query_hashvals)
+        classes[self.rt_ids[entry_idx], positions] = self.classes[entry_idx]
+        return classes
+
+    def _lookup(self, query_hashvals):
+        """
+        Find the index entries for each query hash. Returns parallel
+        arrays of (query position, entry index), one per entry.
+        """
+        if len(self.hashvals):
+            idx = np.searchsorted(self.hashvals, query_hashvals)
+            idx[idx == len(self.hashvals)] = 0
+            positions = np.flatnonzero(self.hashvals[idx] == query_hashvals)
+            idx = idx[positions]
+        else:
+            idx = np.empty(0, dtype=np.intp)
+            positions = np.empty(0, dtype=np.intp)
+
+        if self.offsets is None:
+            return positions, idx
+
+        # expand each found hash into its range of entries
+        starts = self.offsets[idx]
+        lengths = self.offsets[idx + 1] - starts
+        entry_idx = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        entry_idx += np.arange(len(entry_idx))
+
+        return np.repeat(positions, lengths), entry_idx
+
+
+class RanktablePyramid:
+    """
+    RanktableIndexes for the same ranktables at several resolutions,
+    coarsest first. 'tally' classifies a query at the coarsest resolution,
+    and moves to finer ones only while the class percentages in some
+    ranktable are uncertain: while their standard error is more than
+    'max_error' percentage points. Ranktables that share no hashes with
+    the query are not considered uncertain.
+
+    Supports 'tally' in place of a RanktableIndex; tallies count the
+    query hashes at the resolution used.
+    """
+    def __init__(self, levels, *, max_error=1.0):
+        "Build from a list of (scaled, RanktableIndex), coarsest first."
+        self.levels = levels
+        self.max_error = max_error
+        self.names = levels[0][1].names
+        self.max_hashes = [ np.uint64(_get_max_hash_for_scaled(scaled))
+                            for scaled, _ in levels ]
+        self.n_classified = defaultdict(int)    # scaled -> number of queries
+
+    def __len__(self):
+        return len(self.names)
+
+    def tally(self, query_hashvals, weights=None):
+        "As RanktableIndex.tally, at the coarsest adequate resolution."
+        query_hashvals = np.asarray(query_hashvals, dtype=np.uint64)
+        for (scaled, index), max_hash in zip(self.levels, self.max_hashes):
+            keep = query_hashvals <= max_hash
+            table = index.tally(query_hashvals[keep],
+                                weights=None if weights is None
+                                else np.asarray(weights)[keep])
+            if not self.is_uncertain(table):
+                break
+
+        self.n_classified[scaled] += 1
+        return table
+
+    def is_uncertain(self, table):
+        "Is the standard error of any class percentage above max_error?"
+        classified = table[:, 1:]
+        n = classified.sum(axis=1, keepdims=True)
+        found = n[:, 0] > 0
+        if not found.any():
+            return False
+
+        p = classified[found] / n[found]
+        stderr = 100 * np.sqrt(p * (1 - p) / n[found])
+        return bool((stderr > self.max_error).any())
+
+
+def load_ranktable_pyramid(filenames, resolutions, *,
+                           thresholds=DEFAULT_THRESHOLDS, cache=None,
+                           max_error=1.0):
+    "Load ranktables at each scaled value in 'resolutions', coarsest first."
+    levels = [ (scaled, load_classified_ranktables(filenames,
+                                                   thresholds=thresholds,
+                                                   cache=cache,
+                                                   scaled=scaled))
+               for scaled in sorted(resolutions, reverse=True) ]
+    return RanktablePyramid(levels, max_error=max_error)
+
+
+def classify_sketch(minhash, ranktables, *, abund_weighted=False):
+    """
+    Classify the hashes in 'minhash' against each ranktable in a
+    RanktableIndex. Returns a list of (ranktable name, {class: count}),
+    where class -1 counts the hashes not in the ranktable. With
+    abund_weighted, each hash counts as its abundance in 'minhash'.
+    """
+    hashvals, abunds = minhash_to_arrays(minhash)
+    weights = abunds if abund_weighted else None    # None if untracked
+
+    table = ranktables.tally(hashvals, weights=weights).tolist()
+    return tally_to_counters(ranktables.names, table)
+
+
+def class_sketches(minhash, ranktables):
+    """
+    Split 'minhash' by class in each ranktable of a RanktableIndex.
+    Yields (ranktable name, class, sub-sketch) for each non-empty class;
+    sub-sketches keep the abundances of 'minhash', if any.
+    """
+    hashvals, abunds = minhash_to_arrays(minhash)
+    classes = ranktables.classify_hashes(hashvals)
+
+    for rt_name, rt_classes in zip(ranktables.names, classes):
+        for int_id in sorted(NAMES):
+            mask = rt_classes == int_id
+            if not mask.any():
+                continue
+
+            sub_mh = minhash.copy_and_clear()
+            if sub_mh.track_abundance:
+                sub_mh.set_abundances(dict(zip(hashvals[mask].tolist(),
+                                               abunds[mask].tolist())))
+            else:
+                sub_mh.add_many(hashvals[mask].tolist())
+            yield rt_name, int_id, sub_mh
+
+
+def classify_and_save_sketches(sketches, ranktables, save_sigs, *,
+                               abund_weighted=False):
+    """
+    Classify sketches as classify_sketch does, saving the class
+    sub-sketches from class_sketches to 'save_sigs' along the way.
+    """
+    for ss in sketches:
+        with timed_phase("classify") as phase:
+            classified = classify_sketch(ss.minhash, ranktables,
+                                         abund_weighted=abund_weighted)
+            phase.add(sketches=1, hashes=len(ss.minhash))
+        yield ss.name, classified
+
+        with timed_phase("write") as phase:
+            for rt_name, int_id, sub_mh in class_sketches(ss.minhash,
+                                                          ranktables):
+                name = f"{ss.name} {NAMES[int_id]} ({rt_name})"
+                save_sigs.add(sourmash.SourmashSignature(sub_mh, name=name))
+                phase.add(sketches=1, hashes=len(sub_mh))
+
+
+def tally_to_counters(names, table):
+    "Convert RanktableIndex.tally rows to [(ranktable name, counter_d)]."
+    results = []
+    for rt_name, row in zip(names, table):
+        counter_d = { int_id: row[int_id] for int_id in NAMES }
+        counter_d[-1] = row[0]
+        results.append((rt_name, counter_d))
+
+    return results
+
+
+def classification_rows(sketch_name, rt_name, counter_d):
+    "Yield tidy CSV rows for the classification of one sketch."
+    total_classified = sum( v for k, v in counter_d.items() if k >= 0 )
+    for int_id in sorted(NAMES):
+        count = counter_d.get(int_id, 0)
+        percent = count / total_classified * 100 if total_classified else 0.
+        yield [sketch_name, rt_name, NAMES[int_id], count, f"{percent:.2f}"]
+
+    yield [sketch_name, rt_name, "not in ranktable", counter_d.get(-1, 0), ""]
+
+
+def print_classification(sketch_name, rt_name, counter_d, *, unit="hashes"):
+    total_classified = sum( v for k, v in counter_d.items() if k >= 0 )
+
+    print(f"For '{rt_name}', signature '{sketch_name}' contains:")
+    for int_id in sorted(NAMES):
+        name = NAMES[int_id]
+        count = counter_d.get(int_id, 0)
+        percent = count / total_classified * 100 if total_classified else 0.
+        print(f"\t {count} ({percent:.1f}%) {unit} are classified as {name}")
+
+    count = counter_d.get(-1, 0)
+    print(f"\t ...and {count} {unit} are NOT IN the csv file")
+
+
+# ranktables shared with classify worker processes
+_worker_ranktables = None
+
+
+def _init_classify_worker(ranktables):
+    global _worker_ranktables
+    _worker_ranktables = ranktables
+
+
+def _classify_chunk(filename, rows, select_mh, abund_weighted):
+    """
+    Worker: classify the sketches for one chunk of manifest rows. Returns
+    the results, and for a RanktablePyramid the number of sketches
+    classified at each resolution in this chunk.
+    """
+    n_classified = getattr(_worker_ranktables, "n_classified", None)
+    if n_classified is not None:
+        n_classified.clear()
+
+    db = sourmash_utils.load_index_and_select(filename, select_mh)
+    results = [ (ss.name, classify_sketch(ss.minhash, _worker_ranktables,
+                                          abund_weighted=abund_weighted))
+                for ss in load_sketches_for_rows(db, rows) ]
+    return results, dict(n_classified or {})
+
+
+def classify_parallel(filename, db, select_mh, ranktables, n_cores, *,
+                      abund_weighted=False):
+    """
+    Classify the sketches in db across n_cores worker processes, which
+    share the loaded ranktables. Yields results in manifest order. For a
+    RanktablePyramid, the workers' counts of sketches classified at each
+    resolution are added to ranktables.n_classified.
+    """
+    rows = [ (n, row) for n, row in enumerate(db.manifest.rows) ]
+    chunks = split_manifest_rows(rows, n_cores * 4)
+
+    with ProcessPoolExecutor(max_workers=n_cores,
+                             initializer=_init_classify_worker,
+                             initargs=(ranktables,)) as executor:
+        futures = [ executor.submit(_classify_chunk, filename,
+                                    [ row for _, row in chunk ], select_mh,
+                                    abund_weighted)
+                    for chunk in chunks ]
+        for fut in futures:
+            results, n_classified = fut.result()
+            for scaled, n in n_classified.items():
+                ranktables.n_classified[scaled] += n
+            yield from results
+
+
+#
+# pangenome_serve
+#
+# pangenome_serve holds a RanktableIndex in memory and classifies sketches
+# sent over a Unix socket or a localhost TCP port, so that repeated
+# classifications don't pay for loading the ranktables each time.
+# Requests and responses are single lines of JSON:
+#
+#   request:  {"id": 0, "name": "sketch name", "hashes": "<base64>",
+#              "abunds": "<base64>"}
+#   response: {"id": 0, "name": "sketch name", "results": [[rt name, row], ...]}
+#
+# where "hashes" holds the sketch hashvals as base64-encoded little-endian
+# uint64, and each row is a RanktableIndex.tally row. "abunds" is optional;
+# if present, it holds uint64 weights for the hashes, as with
+# pangenome_classify --abund-weighted. Errors are returned
+# as {"id": 0, "error": "message"}. Responses are sent in request order.
+#
+
+# maximum size of a single request line
+MAX_REQUEST_SIZE = 2**30
+
+
+def pangenome_serve_main(args):
+    thresholds = parse_thresholds(args.thresholds)
+
+    cache = None
+    if args.cache_dir:
+        cache = RanktableCache(args.cache_dir, args.cache_max_size)
+
+    ranktables = load_classified_ranktables(args.ranktable_csv_files,
+                                            thresholds=thresholds,
+                                            cache=cache)
+
+    server = ClassifyServer(ranktables, batch_wait=args.batch_wait)
+    try:
+        asyncio.run(server.serve(socket_path=args.socket, port=args.port))
+    finally:
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+    print(f"served {server.n_requests} requests in {server.n_batches} batches.")
+
+
+class ClassifyServer:
+    """
+    Classify sketches against a RanktableIndex for clients connected over
+    a Unix socket or localhost TCP. Requests that are waiting when a batch
+    starts - from any client - are classified together, with a single
+    RanktableIndex.tally_many call.
+    """
+    def __init__(self, ranktables, *, batch_wait=0., max_batch_hashes=10_000_000):
+        self.ranktables = ranktables
+        self.batch_wait = batch_wait
+        self.max_batch_hashes = max_batch_hashes
+        self.n_requests = 0
+        self.n_batches = 0
+
+    async def serve(self, *, socket_path=None, port=None):
+        "Serve until SIGINT or SIGTERM."
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        batcher = asyncio.create_task(self._batcher())
+
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+
+        if socket_path:
+            server = await asyncio.start_unix_server(self._handle,
+                                                     path=socket_path,
+                                                     limit=MAX_REQUEST_SIZE)
+            where = f"Unix socket '{socket_path}'"
+        else:
+            server = await asyncio.start_server(self._handle,
+                                                host="127.0.0.1", port=port,
+                                                limit=MAX_REQUEST_SIZE)
+            where = f"127.0.0.1:{port}"
+
+        print(f"serving {len(self.ranktables)} ranktables on {where}",
+              flush=True)
+        async with server:
+            await stop.wait()
+
+        batcher.cancel()
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if self.batch_wait:
+                await asyncio.sleep(self.batch_wait)
+
+            batch = [item]
+            n_hashes = len(item[0])
+            while n_hashes < self.max_batch_hashes and not self.queue.empty():
+                item = self.queue.get_nowait()
+                batch.append(item)
+                n_hashes += len(item[0])
+
+            queries = [ hashvals for hashvals, _, _ in batch ]
+            weights = [ abunds for _, abunds, _ in batch ]
+            try:
+                tables = await loop.run_in_executor(None,
+                                                    self.ranktables.tally_many,
+                                                    queries, weights)
+            except Exception as exc:
+                for _, _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(exc)
+                continue
+
+            for (_, _, fut), table in zip(batch, tables):
+                if not fut.done():
+                    fut.set_result(table)
+            self.n_batches += 1
+
+    async def _handle(self, reader, writer):
+        "Read requests from one client, queueing responses in order."
+        responses = asyncio.Queue()
+        sender = asyncio.create_task(self._send_responses(responses, writer))
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:      # request longer than MAX_REQUEST_SIZE
+                    await responses.put(self._error({}, "request too large"))
+                    break
+                if not line:
+                    break
+                await responses.put(self._submit(line))
+        except ConnectionError:
+            pass
+        finally:
+            await responses.put(None)
+            try:
+                await sender
+            except ConnectionError:
+                pass
+            writer.close()
+
+    def _error(self, request, message):
+        fut = asyncio.get_running_loop().create_future()
+        fut.set_exception(ValueError(message))
+        return request, fut
+
+    def _submit(self, line):
+        "Parse a request and queue it for classification."
+        # errors are reported with the request's id, once it is readable
+        request = {}
+        try:
+            parsed = json.loads(line)
+            if not isinstance(parsed, dict):
+                return self._error({}, "request must be a JSON object")
+            request = parsed
+            hashvals = np.frombuffer(base64.b64decode(request["hashes"]),
+                                     dtype="<u8")
+            abunds = None
+            if request.get("abunds") is not None:
+                abunds = np.frombuffer(base64.b64decode(request["abunds"]),
+                                       dtype="<u8")
+                if len(abunds) != len(hashvals):
+                    raise ValueError("hashes and abunds differ in length")
+        except (ValueError, KeyError, TypeError) as exc:
+            return self._error(request, f"bad request: {exc!r}")
+
+        fut = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((hashvals, abunds, fut))
+        self.n_requests += 1
+        return request, fut
+
+    async def _send_responses(self, responses, writer):
+        while True:
+            item = await responses.get()
+            if item is None:
+                break
+
+            request, fut = item
+            try:
+                table = await fut
+                response = dict(id=request.get("id"),
+                                name=request.get("name"),
+                                results=[ [rt_name, row] for rt_name, row in
+                                          zip(self.ranktables.names,
+                                              table.tolist()) ])
+            except Exception as exc:
+                response = dict(id=request.get("id"), error=str(exc))
+
+            writer.write(json.dumps(response).encode("utf-8") + b"\n")
+            await writer.drain()
+
+
+def connect_to_server(address):
+    """
+    Connect to a pangenome_serve server. 'address' is PORT or HOST:PORT
+    for TCP, otherwise a Unix socket path.
+    """
+    host, _, port = address.rpartition(":")
+    try:
+        if port.isdigit():
+            return socket.create_connection((host or "127.0.0.1", int(port)))
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+        return sock
+    except OSError as exc:
+        print(f"cannot connect to pangenome_serve at '{address}': {exc}")
+        sys.exit(-1)
+
+
+def classify_via_server(address, sketches, *, abund_weighted=False,
+                        window=64):
+    """
+    Classify sketches with a pangenome_serve server. Yields the same
+    (sketch name, [(ranktable name, counter_d), ...]) as classify_sketch,
+    in order. Up to 'window' requests are in flight at once, so that the
+    server can batch them.
+    """
+    sock = connect_to_server(address)
+    with sock, sock.makefile("rb") as rfile:
+        def receive():
+            line = rfile.readline()
+            if not line:
+                print("pangenome_serve closed the connection")
+                sys.exit(-1)
+            response = json.loads(line)
+            if "error" in response:
+                print(f"error from pangenome_serve: {response['error']}")
+                sys.exit(-1)
+            names = [ rt_name for rt_name, _ in response["results"] ]
+            table = [ row for _, row in response["results"] ]
+            return response["name"], tally_to_counters(names, table)
+
+        n_sent = n_received = 0
+        for ss in sketches:
+            hashvals, abunds = minhash_to_arrays(ss.minhash)
+            request = dict(id=n_sent, name=ss.name,
+                           hashes=base64.b64encode(hashvals.astype("<u8").tobytes()).decode("ascii"))
+            if abund_weighted and abunds is not None:
+                request["abunds"] = base64.b64encode(abunds.astype("<u8").tobytes()).decode("ascii")
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            n_sent += 1
+
+            if n_sent - n_received >= window:
+                yield receive()
+                n_received += 1
+
+        while n_received < n_sent:
+            yield receive()
+            n_received += 1
@@ -1,12 +1,76 @@
 import os
 import sys
+import random
 
 import pytest
 
+import sourmash
+from sourmash import sourmash_args
+
 from sourmash_tst_utils import TempDirectory, RunnerContext
 sys.stdout = sys.stderr
 
+# species -> genus for the synthetic taxonomy built below.
+SYNTHETIC_LINEAGES = {
+    "s__Fakea alpha": "g__Fakea",
+    "s__Fakea beta": "g__Fakea",
+    "s__Mockia gamma": "g__Mockia",
+}
+
+
+def make_synthetic_pangenome(location, *, genomes_per_lineage=6,
+                             lineages=SYNTHETIC_LINEAGES,
+                             core_size=200, shell_size=300, cloud_size=50,
+                             ksizes=(31,), seed=1):
+    """
+    Write a zip of synthetic genome sketches and a matching taxonomy CSV
+    into 'location'. Each lineage gets a core set of hashes present in
+    every genome, a shell pool that genomes sample ~half of, and a few
+    genome-unique cloud hashes.
+
+    Returns (sketch_zip, taxonomy_csv).
+    """
+    rng = random.Random(seed)
+    sketch_zip = os.path.join(location, "synthetic.sig.zip")
+    taxonomy_csv = os.path.join(location, "synthetic.lineages.csv")
+
+    def new_hashes(n):
+        return [rng.randrange(1, 2**63) for _ in range(n)]
+
+    tax_rows = []
+    with sourmash_args.SaveSignaturesToLocation(sketch_zip) as save_sigs:
+        for lin_n, (species, genus) in enumerate(lineages.items()):
+            core = new_hashes(core_size)
+            shell = new_hashes(shell_size)
+            for g_n in range(genomes_per_lineage):
+                ident = f"GCA_{lin_n + 1:03d}{g_n:06d}.1"
+                hashes = list(core)
+                hashes += rng.sample(shell, shell_size // 2)
+                hashes += new_hashes(cloud_size)
+                for ksize in ksizes:
+                    mh = sourmash.MinHash(n=0, ksize=ksize, scaled=1)
+                    mh.add_many(hashes)
+                    ss = sourmash.SourmashSignature(mh, name=f"{ident} synthetic genome")
+                    save_sigs.add(ss)
+
+                tax_rows.append((ident, "d__Bacteria", "p__Fakeota",
+                                 "c__Fakeia", "o__Fakeales", "f__Fakeaceae",
+                                 genus, species))
+
+    with open(taxonomy_csv, "w") as fp:
+        fp.write("ident,superkingdom,phylum,class,order,family,genus,species\n")
+        for row in tax_rows:
+            fp.write(",".join(row) + "\n")
+
+    return sketch_zip, taxonomy_csv
+
+
 @pytest.fixture
 def runtmp():
     with TempDirectory() as location:
         yield RunnerContext(location)
+
+
+@pytest.fixture
+def synthetic_db(runtmp):
+    return make_synthetic_pangenome(runtmp.location)
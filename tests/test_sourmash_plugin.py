@@ -16,3 +16,1385 @@ def test_run_sourmash(runtmp):
     print(runtmp.last_result.out)
     print(runtmp.last_result.err)
     assert runtmp.last_result.status != 0                    # no args provided, ok ;)
+
+
+def _zip_contents(filename):
+    "Return the (name, CRC) of each member, ignoring zip timestamps."
+    import zipfile
+    with zipfile.ZipFile(filename) as zf:
+        return sorted((info.filename, info.CRC) for info in zf.infolist())
+
+
+def _load_sketches(filename):
+    return { ss.name: ss for ss in sourmash.load_file_as_signatures(filename) }
+
+
+def test_createdb_abund(runtmp, synthetic_db):
+    sketches, taxonomy = synthetic_db
+    out = runtmp.output('merged.sig.zip')
+
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches, '-t', taxonomy,
+                    '-o', out, '--abund', '-k', '31', '--scaled', '1')
+
+    merged = _load_sketches(out)
+    assert list(merged) == ['GCA_001000005 s__Fakea alpha',
+                            'GCA_002000005 s__Fakea beta',
+                            'GCA_003000005 s__Mockia gamma']
+    for ss in merged.values():
+        assert ss.minhash.track_abundance
+        # core hashes are present in all six genomes
+        assert max(ss.minhash.hashes.values()) == 6
+        assert min(ss.minhash.hashes.values()) == 1
+
+
+@pytest.mark.parametrize("abund", [True, False])
+def test_createdb_cores_identical(runtmp, synthetic_db, abund):
+    sketches, taxonomy = synthetic_db
+    serial = runtmp.output('serial.sig.zip')
+    parallel = runtmp.output('parallel.sig.zip')
+    extra = ['--abund'] if abund else []
+
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches, '-t', taxonomy,
+                    '-o', serial, '-k', '31', '--scaled', '1', *extra)
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches, '-t', taxonomy,
+                    '-o', parallel, '-k', '31', '--scaled', '1', *extra,
+                    '--cores', '4')
+
+    assert _zip_contents(serial) == _zip_contents(parallel)
+
+
+def test_createdb_cores_csv_fail(runtmp, synthetic_db):
+    sketches, taxonomy = synthetic_db
+
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                        '-t', taxonomy, '-o', runtmp.output('x.sig.zip'),
+                        '-k', '31', '--scaled', '1', '--cores', '2',
+                        '--csv', runtmp.output('x.csv'))
+
+
+@pytest.mark.parametrize("csv_name", ["stats.csv", "stats.csv.gz"])
+def test_createdb_csv(runtmp, synthetic_db, csv_name):
+    import csv
+    import gzip
+
+    sketches, taxonomy = synthetic_db
+    out = runtmp.output('merged.sig.zip')
+    stats = runtmp.output(csv_name)
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches, '-t', taxonomy,
+                    '-o', out, '--csv', stats, '-k', '31', '--scaled', '1')
+
+    opener = gzip.open if csv_name.endswith('.gz') else open
+    with opener(stats, 'rt', newline='') as fp:
+        rows = list(csv.reader(fp))
+    assert len(rows) == 18
+
+    # hash_count and genome_count are the running numbers of distinct
+    # hashes and of genomes in the lineage
+    seen = {}
+    n_genomes = {}
+    for ss, (lineage, sig_name, hash_count, genome_count) in \
+            zip(sourmash.load_file_as_signatures(sketches), rows):
+        assert sig_name == ss.name
+        seen.setdefault(lineage, set()).update(ss.minhash.hashes)
+        n_genomes[lineage] = n_genomes.get(lineage, 0) + 1
+        assert int(hash_count) == len(seen[lineage])
+        assert int(genome_count) == n_genomes[lineage]
+
+    merged = _load_sketches(out)
+    assert { len(ss.minhash) for ss in merged.values() } == \
+        { len(hashes) for hashes in seen.values() }
+
+
+@pytest.mark.parametrize("input_type", ["zip", "sig"])
+def test_createdb_presence(runtmp, synthetic_db, input_type):
+    from sourmash_plugin_pangenomics import PresenceMatrix
+
+    sketches, taxonomy = synthetic_db
+    if input_type == "sig":
+        # no manifest: lineages are buffered until the end
+        runtmp.sourmash('sig', 'cat', sketches, '-o', runtmp.output('all.sig'))
+        sketches = runtmp.output('all.sig')
+
+    out = runtmp.output('merged.sig.zip')
+    presence_file = runtmp.output('presence.zip')
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches, '-t', taxonomy,
+                    '-o', out, '--abund', '--presence', presence_file,
+                    '-k', '31', '--scaled', '1')
+
+    genome_hashes = { ss.name.split('.')[0]: set(ss.minhash.hashes)
+                      for ss in sourmash.load_file_as_signatures(sketches) }
+
+    presence = PresenceMatrix(presence_file)
+    assert len(presence) == 3
+    for ss in _load_sketches(out).values():
+        lineage = presence[ss.name.split(' ', 1)[1]]
+        assert len(lineage.genomes) == 6
+
+        # genome counts over all genomes match the --abund sketch
+        assert dict(zip(lineage.hashvals.tolist(),
+                        lineage.frequencies().tolist())) == \
+            ss.minhash.hashes
+
+        subset = lineage.genomes[1:4]
+        expected = [ sum( hashval in genome_hashes[ident] for ident in subset )
+                     for hashval in lineage.hashvals.tolist() ]
+        assert lineage.frequencies(subset).tolist() == expected
+
+        hashval = int(lineage.hashvals[len(lineage) // 2])
+        assert lineage.genomes_with_hash(hashval) == \
+            [ ident for ident in lineage.genomes
+              if hashval in genome_hashes[ident] ]
+
+    assert lineage.genomes_with_hash(0) == []
+    with pytest.raises(KeyError):
+        lineage.frequencies(['GCA_nothere'])
+
+
+def test_createdb_presence_fail(runtmp, synthetic_db):
+    sketches, taxonomy = synthetic_db
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                        '-t', taxonomy, '-o', runtmp.output('merged.sig.zip'),
+                        '--presence', runtmp.output('presence.zip'),
+                        '-c', '2', '-k', '31', '--scaled', '1')
+    assert '--presence cannot be used' in runtmp.last_result.out
+
+
+def test_csv_row_writer_chunks(runtmp):
+    import gzip
+    from sourmash_plugin_pangenomics import CsvRowWriter
+
+    rows = [ (n, f'name{n}') for n in range(2500) ]
+    for filename in ('rows.csv', 'rows.csv.gz'):
+        filename = runtmp.output(filename)
+        with CsvRowWriter(filename, chunk_size=1000) as w:
+            for row in rows:
+                w.writerow(row)
+
+        opener = gzip.open if filename.endswith('.gz') else open
+        with opener(filename, 'rt') as fp:
+            assert fp.read().splitlines() == [ f'{n},{name}' for n, name in rows ]
+
+
+def test_hash_counts_matches_counter():
+    import random
+    from collections import Counter
+    from sourmash_plugin_pangenomics import HashCounts
+
+    rng = random.Random(2)
+    expected = Counter()
+    hc = HashCounts()
+    hc.batch_size = 50          # force several batched merges
+
+    other = HashCounts()
+    for n in range(40):
+        hashvals = set(rng.randrange(2**64) for _ in range(10))
+        hashvals.update(rng.sample(range(1, 100), 10))
+        expected.update(hashvals)
+
+        target = hc if n % 2 else other
+        mh = sourmash.MinHash(n=0, ksize=31, scaled=1)
+        mh.add_many(hashvals)
+        target.add_sketch(mh)
+
+    hc.update(other)
+    assert len(hc) == len(expected)
+    assert dict(hc.items()) == dict(expected)
+    assert list(hc.hashvals) == sorted(expected)
+
+    abund_mh = sourmash.MinHash(n=0, ksize=31, scaled=1, track_abundance=True)
+    abund_mh.set_abundances(hc)
+    assert dict(abund_mh.hashes) == dict(expected)
+
+
+def test_merge_hash_count_runs():
+    import numpy as np
+    from collections import Counter
+    from sourmash_plugin_pangenomics import merge_hash_count_runs
+
+    rng = np.random.default_rng(3)
+    runs = []
+    expected = Counter()
+    for _ in range(6):
+        hashvals = np.unique(rng.integers(0, 50, 20, dtype=np.uint64))
+        counts = rng.integers(1, 5, len(hashvals), dtype=np.uint64)
+        runs.append((hashvals, counts))
+        expected.update(dict(zip(hashvals.tolist(), counts.tolist())))
+    runs.append((np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint64)))
+
+    hashvals, counts = merge_hash_count_runs(runs)
+    assert hashvals.tolist() == sorted(expected)
+    assert dict(zip(hashvals.tolist(), counts.tolist())) == dict(expected)
+
+
+@pytest.mark.parametrize("extra", [['--abund'], [], ['--abund', '--cores', '2']])
+def test_createdb_max_memory_identical(runtmp, synthetic_db, extra):
+    # spill after (nearly) every sketch and check the output is unchanged
+    sketches, taxonomy = synthetic_db
+    inmem = runtmp.output('inmem.sig.zip')
+    spilled = runtmp.output('spilled.sig.zip')
+
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches, '-t', taxonomy,
+                    '-o', inmem, '-k', '31', '--scaled', '1', *extra)
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches, '-t', taxonomy,
+                    '-o', spilled, '-k', '31', '--scaled', '1', *extra,
+                    '--max-memory', '1K')
+
+    assert 'spilled runs' in runtmp.last_result.out
+    assert _zip_contents(inmem) == _zip_contents(spilled)
+
+
+def test_parse_memory_size():
+    from sourmash_plugin_pangenomics import parse_memory_size
+
+    assert parse_memory_size('1000') == 1000
+    assert parse_memory_size('2K') == 2048
+    assert parse_memory_size('1.5g') == int(1.5 * 2**30)
+    assert parse_memory_size('500MB') == 500 * 2**20
+
+
+def test_memory_share():
+    from sourmash_plugin_pangenomics import memory_share
+
+    assert memory_share(None, 4) is None
+    assert memory_share(0, 4) is None
+    assert memory_share(1000, 4) == 250
+    assert memory_share(3, 4) == 1
+
+
+@pytest.mark.parametrize("n_ranks,n_selectors,cores",
+                         [(1, 1, 1), (3, 1, 1), (1, 1, 4), (3, 2, 4)])
+def test_createdb_memory_share_total(n_ranks, n_selectors, cores):
+    from sourmash_plugin_pangenomics import createdb_memory_share
+
+    # parent accumulators plus every worker's accumulators fit the budget
+    max_memory = 10**9
+    share = createdb_memory_share(max_memory, n_ranks, n_selectors, cores)
+    n_parent = n_ranks * n_selectors
+    n_workers = cores * n_selectors if cores > 1 else 0
+    assert (n_parent + n_workers) * share <= max_memory
+    assert (n_parent + n_workers + 1) * share > max_memory
+    assert createdb_memory_share(None, n_ranks, n_selectors, cores) is None
+
+
+def test_createdb_multiple_files_interleaved(runtmp, synthetic_db):
+    # lineages spread across several files, in interleaved order
+    sketches, taxonomy = synthetic_db
+    all_sigs = list(sourmash.load_file_as_signatures(sketches))
+
+    file1 = runtmp.output('one.sig.zip')
+    file2 = runtmp.output('two.sig')
+    with sourmash.save_load.SaveSignaturesToLocation(file1) as save_sigs:
+        for ss in all_sigs[::2]:
+            save_sigs.add(ss)
+    with sourmash.save_load.SaveSignaturesToLocation(file2) as save_sigs:
+        for ss in all_sigs[1::2]:
+            save_sigs.add(ss)
+
+    out = runtmp.output('merged.sig.zip')
+    runtmp.sourmash('scripts', 'pangenome_createdb', file1, file2,
+                    '-t', taxonomy, '-o', out, '--abund',
+                    '-k', '31', '--scaled', '1')
+    assert 'found 3 distinct lineages in manifests' in runtmp.last_result.out
+
+    expected = runtmp.output('expected.sig.zip')
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                    '-t', taxonomy, '-o', expected, '--abund',
+                    '-k', '31', '--scaled', '1')
+
+    merged = _load_sketches(out)
+    assert list(merged) == list(_load_sketches(expected))
+    for name, ss in _load_sketches(expected).items():
+        assert merged[name].minhash == ss.minhash
+
+
+def test_createdb_missing_ident(runtmp, synthetic_db):
+    sketches, taxonomy = synthetic_db
+    with open(taxonomy) as fp:
+        lines = fp.readlines()
+    short_tax = runtmp.output('short.csv')
+    with open(short_tax, 'w') as fp:
+        fp.writelines(lines[:-1])
+
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                        '-t', short_tax, '-o', runtmp.output('x.sig.zip'),
+                        '-k', '31', '--scaled', '1')
+
+    assert 'cannot find 1 ident(s)' in runtmp.last_result.out
+    assert 'GCA_003000005' in runtmp.last_result.out
+
+
+def test_build_ident_index():
+    from sourmash.tax.tax_utils import LineagePair
+    from sourmash_plugin_pangenomics import build_ident_index
+
+    def lin(species):
+        return (LineagePair('superkingdom', 'd__Bacteria'),
+                LineagePair('genus', 'g__Fakea'),
+                LineagePair('species', species))
+
+    taxdb = {'GCA_1.2': lin('s__Fakea two'),
+             'GCA_1.1': lin('s__Fakea one'),
+             'GCA_2': lin('s__Fakea noversion'),
+             'GCA_2.1': lin('s__Fakea versioned')}
+
+    assert build_ident_index(taxdb, 'species') == {
+        'GCA_1': 's__Fakea one',
+        'GCA_2': 's__Fakea noversion'}
+    assert build_ident_index(taxdb, 'genus') == {'GCA_1': 'g__Fakea',
+                                                 'GCA_2': 'g__Fakea'}
+
+
+def test_taxonomy_index_matches_build_ident_index(runtmp):
+    from sourmash.tax.tax_utils import LineagePair
+    from sourmash_plugin_pangenomics import (build_ident_index,
+                                             write_taxonomy_index,
+                                             TaxonomyIndex)
+
+    def lin(species):
+        return (LineagePair('superkingdom', 'd__Bacteria'),
+                LineagePair('genus', 'g__Fakea'),
+                LineagePair('species', species))
+
+    taxdb = {'GCA_1.2': lin('s__Fakea two'),
+             'GCA_1.1': lin('s__Fakea one'),
+             'GCA_2': lin('s__Fakea noversion'),
+             'GCA_2.1': lin('s__Fakea versioned')}
+    for n in range(1000):
+        taxdb[f'GCF_{n:06d}.1'] = lin(f's__Fakea x{n % 7}')
+
+    filename = runtmp.output('tax.taxidx')
+    n_idents, ranks = write_taxonomy_index(filename, taxdb)
+    assert n_idents == 1002
+
+    taxindex = TaxonomyIndex(filename)
+    assert len(taxindex) == 1002
+    for rank in ('species', 'genus', 'superkingdom'):
+        expected = build_ident_index(taxdb, rank)
+        ident_index = taxindex.ident_index(rank)
+        assert { k: ident_index.get(k) for k in expected } == expected
+
+    assert ident_index.get('GCA_3') is None
+    assert ident_index.get('GCA_1.1') is None
+    assert set(taxindex) == set(expected)
+
+
+def test_createdb_taxonomy_index(runtmp, synthetic_db):
+    sketches, taxonomy = synthetic_db
+    taxindex = runtmp.output('synthetic.taxidx')
+    runtmp.sourmash('scripts', 'pangenome_taxindex', '-t', taxonomy,
+                    '-o', taxindex)
+    assert 'wrote index of 18 identifiers' in runtmp.last_result.out
+
+    for rank in ('species', 'genus'):
+        expected = runtmp.output(f'expected-{rank}.sig.zip')
+        out = runtmp.output(f'indexed-{rank}.sig.zip')
+        runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                        '-t', taxonomy, '-o', expected, '-r', rank,
+                        '--abund', '-k', '31', '--scaled', '1')
+        runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                        '-t', taxindex, '-o', out, '-r', rank,
+                        '--abund', '-k', '31', '--scaled', '1')
+        assert _zip_contents(out) == _zip_contents(expected)
+
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                    '-t', taxindex, '-o', runtmp.output('multi-{rank}.sig.zip'),
+                    '-r', 'species,genus', '--abund', '-k', '31', '--scaled', '1')
+    for rank in ('species', 'genus'):
+        assert _zip_contents(runtmp.output(f'multi-{rank}.sig.zip')) == \
+            _zip_contents(runtmp.output(f'expected-{rank}.sig.zip'))
+
+    # idents missing from the index are reported as usual
+    sigs = list(sourmash.load_file_as_signatures(sketches))
+    extra = runtmp.output('extra.sig')
+    with sourmash.save_load.SaveSignaturesToLocation(extra) as save_sigs:
+        mh = sigs[0].minhash.copy_and_clear()
+        mh.add_many(range(1, 11))
+        save_sigs.add(sourmash.SourmashSignature(mh, name='GCA_999000001.1 x'))
+
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'pangenome_createdb', extra,
+                        '-t', taxindex, '-o', runtmp.output('x.sig.zip'),
+                        '-k', '31', '--scaled', '1')
+    assert 'cannot find 1 ident(s)' in runtmp.last_result.out
+
+
+@pytest.mark.parametrize("extra", [[], ['--abund'], ['--abund', '-c', '2'],
+                                   ['--abund', '--max-memory', '1K']])
+def test_createdb_multiple_ranks(runtmp, synthetic_db, extra):
+    sketches, taxonomy = synthetic_db
+
+    # one pass for all ranks, with the ranks in any order...
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches, '-t', taxonomy,
+                    '-o', runtmp.output('multi-{rank}.sig.zip'),
+                    '-r', 'genus,family,species',
+                    '-k', '31', '--scaled', '1', *extra)
+
+    # ...is the same as one run per rank.
+    for rank, n_lineages in (('species', 3), ('genus', 2), ('family', 1)):
+        expected = runtmp.output(f'single-{rank}.sig.zip')
+        runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                        '-t', taxonomy, '-o', expected, '-r', rank,
+                        '-k', '31', '--scaled', '1', *extra)
+
+        out = runtmp.output(f'multi-{rank}.sig.zip')
+        assert _zip_contents(out) == _zip_contents(expected)
+        assert len(_load_sketches(out)) == n_lineages
+
+        with open(out + '.genomes.csv') as fp1, \
+             open(expected + '.genomes.csv') as fp2:
+            assert sorted(fp1) == sorted(fp2)
+
+
+def test_createdb_multiple_ranks_requires_template(runtmp, synthetic_db):
+    sketches, taxonomy = synthetic_db
+
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                        '-t', taxonomy, '-o', runtmp.output('x.sig.zip'),
+                        '-r', 'species,genus', '-k', '31', '--scaled', '1')
+    assert "must contain '{rank}'" in runtmp.last_result.out
+
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                        '-t', taxonomy, '-o', runtmp.output('x.sig.zip'),
+                        '-r', 'species,genera', '-k', '31', '--scaled', '1')
+    assert "unknown rank 'genera'" in runtmp.last_result.out
+
+
+@pytest.mark.parametrize("extra", [[], ['--abund', '-c', '2'],
+                                   ['--abund', '-r', 'species,genus']])
+def test_createdb_multiple_selections(runtmp, extra):
+    from conftest import make_synthetic_pangenome
+
+    sketches, taxonomy = make_synthetic_pangenome(runtmp.location,
+                                                  ksizes=(21, 31, 51))
+
+    # one pass for all ksizes...
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches, '-t', taxonomy,
+                    '-o', runtmp.output('multi-k{ksize}-{rank}.sig.zip'),
+                    '-k', '31', '--scaled', '1',
+                    '-s', 'k=21', '--select', 'dna,k=51,scaled=1', *extra)
+    assert runtmp.last_result.out.count('selecting sketches:') == 3
+
+    # ...is the same as one run per ksize.
+    ranks = ['species', 'genus'] if '-r' in extra else ['species']
+    for ksize in (21, 31, 51):
+        expected = runtmp.output(f'single-k{ksize}-{{rank}}.sig.zip')
+        runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                        '-t', taxonomy, '-o', expected,
+                        '-k', str(ksize), '--scaled', '1', *extra)
+
+        for rank in ranks:
+            out = runtmp.output(f'multi-k{ksize}-{rank}.sig.zip')
+            expected = runtmp.output(f'single-k{ksize}-{rank}.sig.zip')
+            assert _zip_contents(out) == _zip_contents(expected)
+            assert all( ss.minhash.ksize == ksize
+                        for ss in _load_sketches(out).values() )
+
+            with open(out + '.genomes.csv') as fp1, \
+                 open(expected + '.genomes.csv') as fp2:
+                assert sorted(fp1) == sorted(fp2)
+
+
+def test_createdb_multiple_selections_untaxed(runtmp, synthetic_db):
+    # sketches that match no selection need not be in the taxonomy, even
+    # when there is no manifest to select on up front.
+    sketches, taxonomy = synthetic_db
+    all_sigs = list(sourmash.load_file_as_signatures(sketches))
+
+    mh = sourmash.MinHash(n=0, ksize=21, scaled=1)
+    mh.add_many([1, 2, 3])
+    untaxed = sourmash.SourmashSignature(mh, name="GCA_999999999.1 unknown")
+
+    sigfile = runtmp.output('all.sig')
+    with sourmash.save_load.SaveSignaturesToLocation(sigfile) as save_sigs:
+        for ss in all_sigs + [untaxed]:
+            save_sigs.add(ss)
+
+    runtmp.sourmash('scripts', 'pangenome_createdb', sigfile, '-t', taxonomy,
+                    '-o', runtmp.output('db-k{ksize}.sig.zip'),
+                    '-k', '31', '--scaled', '1', '-s', 'k=51')
+
+    db = _load_sketches(runtmp.output('db-k31.sig.zip'))
+    assert len(db) == 3
+    assert all( ss.minhash.ksize == 31 for ss in db.values() )
+
+
+def test_createdb_multiple_selections_fail(runtmp, synthetic_db):
+    sketches, taxonomy = synthetic_db
+
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                        '-t', taxonomy, '-o', runtmp.output('x.sig.zip'),
+                        '-k', '31', '--select', 'k=21')
+    assert "must contain '{ksize}', '{moltype}' or '{scaled}'" in runtmp.last_result.out
+
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                        '-t', taxonomy, '-o', runtmp.output('x-{ksize}.sig.zip'),
+                        '-k', '31', '--select', 'k=twenty-one')
+    assert "cannot parse --select 'k=twenty-one'" in runtmp.last_result.out
+
+
+def test_createdb_update(runtmp, synthetic_db):
+    sketches, taxonomy = synthetic_db
+    all_sigs = list(sourmash.load_file_as_signatures(sketches))
+
+    # first release: half of the genomes from the first two lineages
+    first = runtmp.output('first.sig.zip')
+    with sourmash.save_load.SaveSignaturesToLocation(first) as save_sigs:
+        for ss in all_sigs[0:3] + all_sigs[6:9]:
+            save_sigs.add(ss)
+
+    old_db = runtmp.output('old.sig.zip')
+    runtmp.sourmash('scripts', 'pangenome_createdb', first, '-t', taxonomy,
+                    '-o', old_db, '--abund', '-k', '31', '--scaled', '1')
+    assert os.path.exists(old_db + '.genomes.csv')
+
+    # second release contains everything; only new genomes are added.
+    new_db = runtmp.output('new.sig.zip')
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches, '-t', taxonomy,
+                    '-o', new_db, '--abund', '-k', '31', '--scaled', '1',
+                    '--update', old_db)
+    out = runtmp.last_result.out
+    assert 'skipping 6 sketches already in the database' in out
+    assert 'updated 2, and added 1 new lineages' in out
+
+    full_db = runtmp.output('full.sig.zip')
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches, '-t', taxonomy,
+                    '-o', full_db, '--abund', '-k', '31', '--scaled', '1')
+
+    assert _zip_contents(new_db) == _zip_contents(full_db)
+    with open(new_db + '.genomes.csv') as fp:
+        assert len(fp.readlines()) == 1 + 18
+
+    # updating again with the same genomes changes nothing.
+    again_db = runtmp.output('again.sig.zip')
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches, '-t', taxonomy,
+                    '-o', again_db, '--abund', '-k', '31', '--scaled', '1',
+                    '--update', new_db)
+    assert 'copied 3 unchanged sketches, updated 0' in runtmp.last_result.out
+    assert _zip_contents(again_db) == _zip_contents(full_db)
+
+
+def test_createdb_update_requires_abund(runtmp, synthetic_db):
+    sketches, taxonomy = synthetic_db
+
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                        '-t', taxonomy, '-o', runtmp.output('x.sig.zip'),
+                        '-k', '31', '--scaled', '1',
+                        '--update', runtmp.output('old.sig.zip'))
+    assert 'requires --abund' in runtmp.last_result.out
+
+
+@pytest.mark.parametrize("update_args", [['-r', 'genus', '-k', '31'],
+                                         ['-k', '21']])
+def test_createdb_update_params_mismatch(runtmp, synthetic_db, update_args):
+    # --update refuses to mix ranks or sketch selections.
+    sketches, taxonomy = synthetic_db
+
+    old_db = runtmp.output('old.sig.zip')
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches, '-t', taxonomy,
+                    '-o', old_db, '--abund', '-k', '31', '--scaled', '1')
+    with open(old_db + '.genomes.csv') as fp:
+        assert fp.readline().strip() == 'ident,lineage,rank,ksize,moltype,scaled'
+
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                        '-t', taxonomy, '-o', runtmp.output('new.sig.zip'),
+                        '--abund', '--scaled', '1', *update_args,
+                        '--update', old_db)
+    out = runtmp.last_result.out
+    assert "was built with rank=species, ksize=31, moltype=DNA, scaled=1" in out
+    assert "use the same -r/--rank and sketch selection with --update" in out
+
+
+@pytest.mark.parametrize("cores", ['1', '3'])
+def test_merge_multiple_files(runtmp, synthetic_db, cores):
+    # counts accumulate across all input files
+    sketches, taxonomy = synthetic_db
+    all_sigs = list(sourmash.load_file_as_signatures(sketches))
+
+    file1 = runtmp.output('one.sig.zip')
+    file2 = runtmp.output('two.sig.zip')
+    with sourmash.save_load.SaveSignaturesToLocation(file1) as save_sigs:
+        for ss in all_sigs[:6]:
+            save_sigs.add(ss)
+    with sourmash.save_load.SaveSignaturesToLocation(file2) as save_sigs:
+        for ss in all_sigs[6:12]:
+            save_sigs.add(ss)
+
+    out = runtmp.output('merged.sig.zip')
+    runtmp.sourmash('scripts', 'pangenome_merge', file1, file2, '-o', out,
+                    '-k', '31', '--scaled', '1', '--cores', cores)
+
+    expected = {}
+    for ss in all_sigs[:12]:
+        for hashval in ss.minhash.hashes:
+            expected[hashval] = expected.get(hashval, 0) + 1
+
+    merged, = sourmash.load_file_as_signatures(out)
+    assert merged.name == 'merged'
+    assert dict(merged.minhash.hashes) == expected
+
+
+def _make_ranktable(runtmp, synthetic_db, output, lineage='s__Fakea alpha'):
+    sketches, taxonomy = synthetic_db
+    merged = runtmp.output('merged.sig.zip')
+    if not os.path.exists(merged):
+        runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                        '-t', taxonomy, '-o', merged, '--abund',
+                        '-k', '31', '--scaled', '1')
+    runtmp.sourmash('scripts', 'pangenome_ranktable', merged,
+                    '-o', output, '-l', lineage, '-k', '31', '--scaled', '1')
+    return output
+
+
+def _make_metagenome(runtmp, synthetic_db, n_extra=100):
+    "A 'metagenome' of two genomes plus some unknown hashes."
+    sketches, taxonomy = synthetic_db
+    all_sigs = list(sourmash.load_file_as_signatures(sketches))
+    mh = all_sigs[0].minhash.to_mutable()
+    mh += all_sigs[7].minhash
+    mh.add_many(range(1, n_extra + 1))
+
+    filename = runtmp.output('metagenome.sig')
+    with sourmash.save_load.SaveSignaturesToLocation(filename) as save_sigs:
+        save_sigs.add(sourmash.SourmashSignature(mh, name='metagenome'))
+    return filename
+
+
+def test_ranktable_binary_matches_csv(runtmp, synthetic_db):
+    from sourmash_plugin_pangenomics import load_ranktable
+
+    rt_csv = _make_ranktable(runtmp, synthetic_db, runtmp.output('rt.csv'))
+    rt_bin = _make_ranktable(runtmp, synthetic_db, runtmp.output('rt.bin'))
+
+    csv_arrays = load_ranktable(rt_csv)
+    bin_arrays = load_ranktable(rt_bin)
+    assert 200 + 6 * 50 < len(csv_arrays[0]) <= 200 + 300 + 6 * 50
+    for a, b in zip(csv_arrays, bin_arrays):
+        assert list(a) == list(b)
+
+
+@pytest.mark.parametrize("lineage,ignore_case,indexed", [
+    ('s__Fakea alpha', False, True),            # exact match
+    ('s__Fakea', False, True),                  # prefix match, two species
+    ('S__FAKEA BETA', True, True),              # exact match, ignoring case
+    ('GCA_001000005 s__Fakea alpha', False, True),  # sketch name
+    ('GCA_00100000', False, True),              # sketch name prefix
+    ('alpha$', False, False),                   # regex fallback
+])
+def test_ranktable_lineage_index(runtmp, synthetic_db, lineage, ignore_case,
+                                 indexed):
+    from sourmash_plugin_pangenomics import find_lineage_rows
+
+    _make_ranktable(runtmp, synthetic_db, runtmp.output('rt.csv'))
+    merged = runtmp.output('merged.sig.zip')
+    assert os.path.exists(merged + '.lineages.sqlite')
+    assert [ row['name'].split(' ', 1)[1]
+             for row in find_lineage_rows(merged, 's__Fakea alpha') ] == \
+           ['s__Fakea alpha']
+    assert len(find_lineage_rows(merged, 's__Fakea')) == 2
+    assert find_lineage_rows(merged, 's__Nothere') == []
+    assert find_lineage_rows(merged, 'gca_001000005 S__FAKEA ALPHA',
+                             ignore_case=True)[0]['name'] == \
+           'GCA_001000005 s__Fakea alpha'
+
+    args = ['-k', '31', '--scaled', '1', '-l', lineage]
+    if ignore_case:
+        args.append('-i')
+    runtmp.sourmash('scripts', 'pangenome_ranktable', merged,
+                    '-o', runtmp.output('indexed.csv'), *args)
+    assert ('in lineage index:' in runtmp.last_result.out) == indexed
+
+    # the manifest search finds the same sketches without the index
+    os.unlink(merged + '.lineages.sqlite')
+    runtmp.sourmash('scripts', 'pangenome_ranktable', merged,
+                    '-o', runtmp.output('scanned.csv'), *args)
+    assert 'in lineage index:' not in runtmp.last_result.out
+
+    with open(runtmp.output('indexed.csv')) as fp1, \
+         open(runtmp.output('scanned.csv')) as fp2:
+        assert fp1.read() == fp2.read()
+
+
+def test_classify_binary_matches_csv(runtmp, synthetic_db):
+    rt_csv = _make_ranktable(runtmp, synthetic_db, runtmp.output('rt.csv'))
+    rt_bin = _make_ranktable(runtmp, synthetic_db, runtmp.output('rt.bin'))
+    metagenome = _make_metagenome(runtmp, synthetic_db)
+
+    runtmp.sourmash('scripts', 'pangenome_classify', metagenome, rt_csv,
+                    '-k', '31', '--scaled', '1')
+    csv_out = runtmp.last_result.out
+    runtmp.sourmash('scripts', 'pangenome_classify', metagenome, rt_bin,
+                    '-k', '31', '--scaled', '1')
+    bin_out = runtmp.last_result.out
+
+    # all 400 hashes from the first genome are classified
+    counts = [ int(line.split()[0]) for line in csv_out.splitlines()
+               if 'hashes are classified as' in line ]
+    assert sum(counts) == 400
+    assert counts[0] >= 200                 # central core
+    # the second genome and the extra hashes aren't in the ranktable
+    assert '...and 500 hashes are NOT IN the csv file' in csv_out
+    assert csv_out.replace(rt_csv, 'RT') == bin_out.replace(rt_bin, 'RT')
+
+
+@pytest.mark.parametrize("ext", [".csv", ".bin"])
+def test_ranktable_pyramid(runtmp, synthetic_db, ext):
+    from sourmash_plugin_pangenomics import (load_ranktable,
+                                             downsample_ranktable,
+                                             ranktable_pyramid_filename)
+
+    sketches, taxonomy = synthetic_db
+    merged = runtmp.output('merged.sig.zip')
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches,
+                    '-t', taxonomy, '-o', merged, '--abund',
+                    '-k', '31', '--scaled', '1')
+    rt = runtmp.output('rt' + ext)
+    runtmp.sourmash('scripts', 'pangenome_ranktable', merged, '-o', rt,
+                    '-l', 's__Fakea alpha', '-k', '31', '--scaled', '1',
+                    '--pyramid', '4,8')
+
+    full = load_ranktable(rt)
+    n_hashes = [len(full[0])]
+    for scaled in (4, 8):
+        level_file = ranktable_pyramid_filename(rt, scaled)
+        assert level_file == runtmp.output(f'rt.scaled{scaled}{ext}')
+        level = load_ranktable(level_file)
+        expected = downsample_ranktable(full, scaled)
+        for a, b in zip(level, expected):
+            assert list(a) == list(b)
+        n_hashes.append(len(level[0]))
+
+    assert n_hashes[0] > n_hashes[1] > n_hashes[2] > 0
+
+    if ext == '.csv':
+        # each level has the full CSV's rows, in the same order
+        from sourmash.minhash import _get_max_hash_for_scaled
+        with open(rt) as fp:
+            full_rows = fp.read().splitlines()
+        with open(ranktable_pyramid_filename(rt, 4)) as fp:
+            level_rows = fp.read().splitlines()
+        max_hash = _get_max_hash_for_scaled(4)
+        assert level_rows == full_rows[:1] + \
+            [ row for row in full_rows[1:]
+              if int(row.split(',')[0]) <= max_hash ]
+
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'pangenome_ranktable', merged, '-o', rt,
+                        '-l', 's__Fakea alpha', '-k', '31', '--scaled', '10',
+                        '--pyramid', '4,8')
+    assert '--pyramid values must be at least' in runtmp.last_result.out
+
+
+def test_classify_resolution(runtmp, synthetic_db):
+    from sourmash_plugin_pangenomics import ranktable_pyramid_filename
+
+    rt = _make_ranktable(runtmp, synthetic_db, runtmp.output('rt.bin'))
+    metagenome = _make_metagenome(runtmp, synthetic_db)
+    classify = ['scripts', 'pangenome_classify', metagenome, rt,
+                '-k', '31', '--scaled', '1']
+
+    def classified(*args):
+        runtmp.sourmash(*classify, *args)
+        return [ line for line in runtmp.last_result.out.splitlines()
+                 if 'hashes are' in line ]
+
+    full = classified()
+    coarse = classified('--resolution', '4')
+    assert coarse != full
+
+    # the same at scaled=4 with a pyramid level written by ranktable
+    runtmp.sourmash('scripts', 'pangenome_ranktable',
+                    runtmp.output('merged.sig.zip'), '-o', rt,
+                    '-l', 's__Fakea alpha', '-k', '31', '--scaled', '1',
+                    '--pyramid', '4')
+    assert os.path.exists(ranktable_pyramid_filename(rt, 4))
+    assert classified('--resolution', '4') == coarse
+
+    # refine until certain; a small max error refines to the full ranktable
+    assert classified('--resolution', '4,1', '--max-error', '100') == coarse
+    assert 'classified 1 sketches at scaled=4' in runtmp.last_result.out
+    assert classified('--resolution', '4,1', '--max-error', '0.01') == full
+    assert 'classified 1 sketches at scaled=1' in runtmp.last_result.out
+
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'pangenome_classify', metagenome, rt,
+                        '-k', '31', '--scaled', '10', '--resolution', '4')
+    assert '--resolution values must be at least' in runtmp.last_result.out
+
+
+def test_classify_resolution_parallel(runtmp, synthetic_db):
+    # the workers' per-resolution counts are summed in the parent
+    sketches, _ = synthetic_db
+    rt = _make_ranktable(runtmp, synthetic_db, runtmp.output('rt.bin'))
+
+    outputs = []
+    for cores in ('1', '2'):
+        output = runtmp.output(f'classify{cores}.csv')
+        runtmp.sourmash('scripts', 'pangenome_classify', sketches, rt,
+                        '-k', '31', '--scaled', '1', '-o', output,
+                        '--resolution', '16,4,1', '--cores', cores)
+        summary = [ line for line in runtmp.last_result.out.splitlines()
+                    if line.startswith('classified') and 'at scaled=' in line ]
+        with open(output) as fp:
+            outputs.append((fp.read(), summary))
+
+    assert outputs[0] == outputs[1]
+    counts = [ int(line.split()[1]) for line in outputs[1][1] ]
+    assert sum(counts) == 18
+
+
+def test_classify_frequencies_matches_scalar():
+    from sourmash_plugin_pangenomics import (classify_frequencies,
+                                             classify_pangenome_element)
+    import numpy as np
+
+    freqs = np.array([1.0, 0.95, 0.94, 0.9, 0.5, 0.1, 0.05, 0.01, 0.001, 0])
+    expected = [ classify_pangenome_element(f) for f in freqs ]
+    assert list(classify_frequencies(freqs)) == expected
+
+
+def test_classify_frequencies_unordered_thresholds():
+    from sourmash_plugin_pangenomics import (classify_frequencies,
+                                             classify_pangenome_element,
+                                             DEFAULT_THRESHOLDS)
+    import numpy as np
+
+    # shell threshold above external core: falls back to masked assignment.
+    thresholds = dict(DEFAULT_THRESHOLDS, SHELL=0.92)
+    freqs = np.linspace(0, 1, 101)
+    expected = [ classify_pangenome_element(f, thresholds=thresholds)
+                 for f in freqs ]
+    assert list(classify_frequencies(freqs, thresholds=thresholds)) == expected
+
+
+def test_write_csv_ranktable_matches_csv_writer(runtmp):
+    from sourmash_plugin_pangenomics import (write_csv_ranktable,
+                                             calc_pangenome_element_frequency)
+    import csv
+    import random
+
+    rng = random.Random(3)
+    ss_dict = {'x': { rng.randrange(1, 2**64): rng.randrange(1, 40)
+                      for _ in range(5000) }}
+
+    expected = runtmp.output('expected.csv')
+    with open(expected, 'w', newline='') as fp:
+        w = csv.writer(fp)
+        w.writerow(["hashval", "freq", "abund", "max_abund"])
+        for item in calc_pangenome_element_frequency(ss_dict):
+            w.writerow(item)
+
+    output = runtmp.output('rt.csv')
+    write_csv_ranktable(output, ss_dict, chunk_size=1000)
+
+    with open(expected, 'rb') as fp1, open(output, 'rb') as fp2:
+        assert fp1.read() == fp2.read()
+
+
+def test_ranktable_arrays_skips_empty_sketches():
+    from sourmash_plugin_pangenomics import ranktable_arrays
+
+    hashvals, abunds, max_abunds = ranktable_arrays({'a': {}, 'b': {7: 2, 3: 5}})
+    assert list(hashvals) == [3, 7]
+    assert list(abunds) == [5, 2]
+    assert list(max_abunds) == [5, 5]
+
+    hashvals, abunds, max_abunds = ranktable_arrays({'a': {}})
+    assert len(hashvals) == len(abunds) == len(max_abunds) == 0
+
+
+def test_ranktable_duplicate_hashvals(runtmp):
+    # CSV and binary ranktables both refuse duplicate hashvals.
+    from sourmash_plugin_pangenomics import (write_binary_ranktable,
+                                             load_ranktable)
+    import numpy as np
+
+    hashvals = np.array([3, 5, 5], dtype=np.uint64)
+    abunds = np.ones(3, dtype=np.uint32)
+    with pytest.raises(AssertionError, match="hashval already encountered"):
+        write_binary_ranktable(runtmp.output('rt.bin'),
+                               hashvals, abunds, abunds)
+
+    csv_file = runtmp.output('rt.csv')
+    with open(csv_file, 'w') as fp:
+        fp.write("hashval,freq,abund,max_abund\n")
+        for hashval in hashvals:
+            fp.write(f"{hashval},1.0,1,1\n")
+    with pytest.raises(AssertionError, match="hashval already encountered"):
+        load_ranktable(csv_file)
+
+
+@pytest.mark.parametrize("cores,fmt", [('1', 'csv'), ('2', 'csv'), ('2', 'bin')])
+def test_ranktable_all_lineages(runtmp, synthetic_db, cores, fmt):
+    import csv
+    from sourmash_plugin_pangenomics import load_ranktable
+
+    rt_single = _make_ranktable(runtmp, synthetic_db,
+                                runtmp.output('beta.csv'),
+                                lineage='s__Fakea beta')
+
+    outdir = runtmp.output('ranktables')
+    runtmp.sourmash('scripts', 'pangenome_ranktable',
+                    runtmp.output('merged.sig.zip'), '--all-lineages',
+                    '--output-dir', outdir, '--output-format', fmt,
+                    '--cores', cores, '-k', '31', '--scaled', '1')
+
+    with open(os.path.join(outdir, 'ranktables.csv'), newline='') as fp:
+        rows = list(csv.DictReader(fp))
+    assert [ row['ranktable'] for row in rows ] == [
+        f's__Fakea_alpha.{fmt}', f's__Fakea_beta.{fmt}',
+        f's__Mockia_gamma.{fmt}']
+
+    beta = os.path.join(outdir, f's__Fakea_beta.{fmt}')
+    if fmt == 'csv':
+        with open(beta) as fp1, open(rt_single) as fp2:
+            assert fp1.read() == fp2.read()
+    for a, b in zip(load_ranktable(beta), load_ranktable(rt_single)):
+        assert list(a) == list(b)
+
+
+def test_ranktable_filename():
+    from sourmash_plugin_pangenomics import ranktable_filename
+
+    used = set()
+    assert ranktable_filename('GCA_1 s__Escherichia coli', 'abcdef0123',
+                              '.csv', used) == 's__Escherichia_coli.csv'
+    assert ranktable_filename('GCA_2 s__Escherichia coli', '0123456789',
+                              '.csv', used) == 's__Escherichia_coli.01234567.csv'
+    assert ranktable_filename('', '0123456789', '.bin', used) == '0123456789.bin'
+
+
+@pytest.mark.parametrize("cores", ['1', '2'])
+def test_classify_collection_csv(runtmp, synthetic_db, cores):
+    import csv
+
+    sketches, taxonomy = synthetic_db
+    rt_alpha = _make_ranktable(runtmp, synthetic_db, runtmp.output('a.bin'))
+    rt_gamma = _make_ranktable(runtmp, synthetic_db, runtmp.output('g.csv'),
+                               lineage='s__Mockia gamma')
+
+    out = runtmp.output('classify.csv')
+    runtmp.sourmash('scripts', 'pangenome_classify', sketches,
+                    rt_alpha, rt_gamma, '-o', out, '--cores', cores,
+                    '-k', '31', '--scaled', '1')
+    assert 'classified 18 sketches against 2 ranktables' in runtmp.last_result.out
+
+    with open(out, newline='') as fp:
+        rows = list(csv.DictReader(fp))
+    assert len(rows) == 18 * 2 * 6
+
+    # genomes from gamma are entirely classified by the gamma ranktable,
+    # and don't overlap the alpha ranktable at all.
+    gamma_name = 'GCA_003000000.1 synthetic genome'
+    by_rt = { (row['ranktable'], row['class']): row for row in rows
+              if row['metagenome'] == gamma_name }
+    assert by_rt[(rt_gamma, 'not in ranktable')]['count'] == '0'
+    assert by_rt[(rt_alpha, 'not in ranktable')]['count'] == '400'
+    assert by_rt[(rt_alpha, 'central core')]['percent'] == '0.00'
+
+    # and the same counts are printed when classifying a single sketch
+    all_sigs = list(sourmash.load_file_as_signatures(sketches))
+    single = runtmp.output('single.sig')
+    with sourmash.save_load.SaveSignaturesToLocation(single) as save_sigs:
+        save_sigs.add(all_sigs[12])
+
+    runtmp.sourmash('scripts', 'pangenome_classify', single, rt_gamma,
+                    '-k', '31', '--scaled', '1')
+    core = by_rt[(rt_gamma, 'central core')]
+    assert f"\t {core['count']} ({float(core['percent']):.1f}%) hashes are classified as central core" in runtmp.last_result.out
+
+
+def test_ranktable_index_matches_per_ranktable_lookup():
+    import numpy as np
+    from sourmash_plugin_pangenomics import RanktableIndex
+
+    rng = np.random.default_rng(3)
+    universe = rng.choice(2**62, size=2000, replace=False).astype(np.uint64)
+
+    ranktables = []
+    for n in range(5):
+        hashvals = np.sort(rng.choice(universe, size=400 * n, replace=False))
+        classes = rng.integers(1, 6, size=len(hashvals)).astype(np.int8)
+        ranktables.append((f'rt{n}', hashvals, classes))
+
+    index = RanktableIndex(ranktables)
+    query = np.concatenate([rng.choice(universe, size=500, replace=False),
+                            np.arange(1, 50, dtype=np.uint64)])
+    table = index.tally(query)
+
+    for (name, hashvals, classes), row in zip(ranktables, table):
+        class_of = dict(zip(hashvals.tolist(), classes.tolist()))
+        found = np.array([ class_of.get(h, -1) for h in query.tolist() ])
+        assert row[0] == (found == -1).sum()
+        for class_id in range(1, 6):
+            assert row[class_id] == (found == class_id).sum()
+
+    assert RanktableIndex([]).tally(query).shape == (0, 6)
+
+
+def test_classify_cache_dir(runtmp, synthetic_db):
+    rt_csv = _make_ranktable(runtmp, synthetic_db, runtmp.output('rt.csv'))
+    metagenome = _make_metagenome(runtmp, synthetic_db)
+    cache_dir = runtmp.output('cache')
+
+    runtmp.sourmash('scripts', 'pangenome_classify', metagenome, rt_csv,
+                    '-k', '31', '--scaled', '1')
+    expected = runtmp.last_result.out
+
+    runtmp.sourmash('scripts', 'pangenome_classify', metagenome, rt_csv,
+                    '-k', '31', '--scaled', '1', '--cache-dir', cache_dir)
+    assert "loaded 0 ranktable(s) from cache" in runtmp.last_result.out
+    assert len(os.listdir(cache_dir)) == 1
+
+    runtmp.sourmash('scripts', 'pangenome_classify', metagenome, rt_csv,
+                    '-k', '31', '--scaled', '1', '--cache-dir', cache_dir)
+    out = runtmp.last_result.out
+    assert "loaded 1 ranktable(s) from cache" in out
+    assert out.split("parsed 0\n")[1] in expected
+
+
+def test_ranktable_cache_invalidate_and_evict(runtmp):
+    from sourmash_plugin_pangenomics import (RanktableCache, write_ranktable,
+                                             load_ranktable)
+    import numpy as np
+
+    cache = RanktableCache(runtmp.output('cache'), max_size=10_000)
+
+    rt1 = runtmp.output('rt1.csv')
+    write_ranktable(rt1, {'x': { i: i % 7 + 1 for i in range(1, 201) }})
+    hashvals, abunds, _ = cache.load_ranktable(rt1)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert np.array_equal(abunds, load_ranktable(rt1)[1])
+
+    cache.load_ranktable(rt1)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # a rewritten ranktable is parsed again
+    write_ranktable(rt1, {'x': { i: 1 for i in range(1, 301) }})
+    hashvals, abunds, _ = cache.load_ranktable(rt1)
+    assert cache.misses == 2
+    assert len(hashvals) == 300
+
+    # each entry is ~16 bytes/hash; filling the cache evicts old entries.
+    for i in range(5):
+        rt = runtmp.output(f'rt-{i}.csv')
+        write_ranktable(rt, {'x': { j: 1 for j in range(1, 201) }})
+        cache.load_ranktable(rt)
+
+    sizes = [ os.path.getsize(os.path.join(cache.cache_dir, name))
+              for name in os.listdir(cache.cache_dir) ]
+    assert sum(sizes) <= 10_000
+    assert len(sizes) >= 1
+
+
+def test_ranktable_index_tally_many():
+    from sourmash_plugin_pangenomics import RanktableIndex
+    import numpy as np
+
+    index = RanktableIndex([('a', np.array([1, 2, 3], dtype=np.uint64),
+                             np.array([1, 3, 5], dtype=np.int8)),
+                            ('b', np.array([2, 4], dtype=np.uint64),
+                             np.array([2, 2], dtype=np.int8))])
+    queries = [[1, 2, 5], [], [4, 3, 2]]
+    tables = index.tally_many(queries)
+    assert tables.shape == (3, 2, 6)
+    for query, table in zip(queries, tables):
+        assert (table == index.tally(query)).all()
+
+    assert tables[0].tolist() == [[1, 1, 0, 1, 0, 0], [2, 0, 1, 0, 0, 0]]
+    assert tables[2].tolist() == [[1, 0, 0, 1, 0, 1], [1, 0, 2, 0, 0, 0]]
+
+    weighted = index.tally_many(queries, weights=[[10, 20, 30], None, None])
+    assert weighted[0].tolist() == [[30, 10, 0, 20, 0, 0],
+                                    [40, 0, 20, 0, 0, 0]]
+    assert (weighted[1:] == tables[1:]).all()
+
+    assert index.classify_hashes([4, 1, 2, 9]).tolist() == [[0, 1, 3, 0],
+                                                            [2, 0, 2, 0]]
+
+
+def test_ranktable_index_binary_in_place(runtmp, synthetic_db):
+    from sourmash_plugin_pangenomics import (load_classified_ranktables,
+                                             RanktableIndex)
+    import numpy as np
+
+    rt = _make_ranktable(runtmp, synthetic_db, runtmp.output('rt.bin'))
+    index = load_classified_ranktables([rt])
+
+    # a single binary ranktable is indexed without copying its hashvals
+    assert isinstance(index.hashvals, np.memmap)
+    assert index.offsets is None
+
+    # ...and gives the same answers as a merged index
+    merged = RanktableIndex([(rt, index.hashvals, index.classes),
+                             ('empty', np.empty(0, dtype=np.uint64),
+                              np.empty(0, dtype=np.int8))])
+    assert merged.offsets is not None
+    query = np.concatenate([index.hashvals[::3],
+                            np.array([1, 2, 3], dtype=np.uint64)])
+    assert (merged.tally(query)[:1] == index.tally(query)).all()
+    assert (merged.classify_hashes(query)[:1] ==
+            index.classify_hashes(query)).all()
+
+
+def test_serve_and_classify(runtmp, synthetic_db):
+    import subprocess
+    import sys
+
+    sketches, taxonomy = synthetic_db
+    rt_alpha = _make_ranktable(runtmp, synthetic_db, runtmp.output('a.csv'))
+    rt_gamma = _make_ranktable(runtmp, synthetic_db, runtmp.output('g.bin'),
+                               lineage='s__Mockia gamma')
+
+    expected = runtmp.output('expected.csv')
+    runtmp.sourmash('scripts', 'pangenome_classify', sketches,
+                    rt_alpha, rt_gamma, '-o', expected,
+                    '-k', '31', '--scaled', '1')
+
+    sock = runtmp.output('serve.sock')
+    server = subprocess.Popen([sys.executable, '-m', 'sourmash', 'scripts',
+                               'pangenome_serve', rt_alpha, rt_gamma,
+                               '--socket', sock],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        for line in server.stdout:
+            if line.startswith('serving 2 ranktables'):
+                break
+
+        out = runtmp.output('served.csv')
+        runtmp.sourmash('scripts', 'pangenome_classify', sketches,
+                        '--server', sock, '-o', out,
+                        '-k', '31', '--scaled', '1')
+        assert 'classified 18 sketches against 2 ranktables' in runtmp.last_result.out
+    finally:
+        server.terminate()
+        rest = server.communicate(timeout=30)[0]
+
+    assert 'served 18 requests' in rest
+    assert not os.path.exists(sock)
+    with open(expected) as fp1, open(out) as fp2:
+        assert fp1.read() == fp2.read()
+
+
+def test_serve_bad_request_keeps_id(runtmp, synthetic_db):
+    import base64
+    import json
+    import subprocess
+    import sys
+    from sourmash_plugin_pangenomics import connect_to_server
+
+    rt = _make_ranktable(runtmp, synthetic_db, runtmp.output('a.bin'))
+    sock_path = runtmp.output('serve.sock')
+    server = subprocess.Popen([sys.executable, '-m', 'sourmash', 'scripts',
+                               'pangenome_serve', rt, '--socket', sock_path],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        for line in server.stdout:
+            if line.startswith('serving 1 ranktables'):
+                break
+
+        hashes = base64.b64encode(bytes(8)).decode('ascii')
+        requests = [ {"id": 7, "name": "no hashes"},
+                     {"id": 8, "hashes": "not base64!"},
+                     [1, 2],
+                     {"id": 9, "name": "ok", "hashes": hashes} ]
+        with connect_to_server(sock_path) as sock:
+            sock.sendall(b"".join( json.dumps(r).encode() + b"\n"
+                                   for r in requests ))
+            fp = sock.makefile('r')
+            responses = [ json.loads(fp.readline()) for _ in requests ]
+    finally:
+        server.terminate()
+        server.communicate(timeout=30)
+
+    # a pipelined client can match each error to its request
+    assert [ r['id'] for r in responses ] == [7, 8, None, 9]
+    assert [ 'error' in r for r in responses ] == [True, True, True, False]
+    assert responses[3]['results'][0][0] == rt
+
+
+def test_classify_server_requires_no_ranktables(runtmp, synthetic_db):
+    sketches, taxonomy = synthetic_db
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'pangenome_classify', sketches,
+                        'rt.csv', '--server', 'serve.sock')
+    assert 'cannot be given with --server' in runtmp.last_result.out
+
+
+def test_prefetch_signatures():
+    from sourmash_plugin_pangenomics import prefetch_signatures
+
+    assert list(prefetch_signatures(range(100), 4)) == list(range(100))
+
+    def failing():
+        yield 1
+        raise ValueError("bad sketch")
+
+    it = prefetch_signatures(failing(), 2)
+    assert next(it) == 1
+    with pytest.raises(ValueError, match="bad sketch"):
+        next(it)
+
+    # stopping early stops the reader thread
+    it = prefetch_signatures(iter(range(10**9)), 2)
+    assert next(it) == 0
+    it.close()
+
+
+def test_classify_prefetch(runtmp, synthetic_db):
+    sketches, taxonomy = synthetic_db
+    rt = _make_ranktable(runtmp, synthetic_db, runtmp.output('a.csv'))
+
+    outputs = []
+    for prefetch in ('0', '3'):
+        out = runtmp.output(f'classify-{prefetch}.csv')
+        runtmp.sourmash('scripts', 'pangenome_classify', sketches, rt,
+                        '-o', out, '--prefetch', prefetch,
+                        '-k', '31', '--scaled', '1')
+        with open(out) as fp:
+            outputs.append(fp.read())
+
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0].splitlines()) == 1 + 18 * 6
+
+
+def test_classify_abund_weighted_and_class_sketches(runtmp, synthetic_db):
+    import csv
+
+    sketches, taxonomy = synthetic_db
+    rt = _make_ranktable(runtmp, synthetic_db, runtmp.output('a.csv'))
+
+    # an abundance-tracking metagenome: genome 0 at 3x, plus unknown hashes
+    all_sigs = list(sourmash.load_file_as_signatures(sketches))
+    mh = sourmash.MinHash(n=0, ksize=31, scaled=1, track_abundance=True)
+    mh.set_abundances({ h: 3 for h in all_sigs[0].minhash.hashes })
+    mh.add_many(range(1, 11))
+    metagenome = runtmp.output('metagenome.sig')
+    with sourmash.save_load.SaveSignaturesToLocation(metagenome) as save_sigs:
+        save_sigs.add(sourmash.SourmashSignature(mh, name='metagenome'))
+
+    counts = {}
+    for weighted in (False, True):
+        out = runtmp.output(f'classify-{weighted}.csv')
+        args = ['--abund-weighted'] if weighted else []
+        runtmp.sourmash('scripts', 'pangenome_classify', metagenome, rt,
+                        '-o', out, '-k', '31', '--scaled', '1', *args)
+        with open(out, newline='') as fp:
+            counts[weighted] = { row['class']: int(row['count'])
+                                 for row in csv.DictReader(fp) }
+
+    assert counts[False]['not in ranktable'] == 10
+    assert counts[True]['not in ranktable'] == 10
+    for name in ('central core', 'external core', 'shell', 'inner cloud'):
+        assert counts[True][name] == 3 * counts[False][name]
+
+    class_sigs = runtmp.output('classes.sig.zip')
+    runtmp.sourmash('scripts', 'pangenome_classify', metagenome, rt,
+                    '--output-class-sketches', class_sigs,
+                    '-k', '31', '--scaled', '1')
+    saved = { ss.name: ss.minhash
+              for ss in sourmash.load_file_as_signatures(class_sigs) }
+    assert len(saved) == sum( 1 for k, v in counts[False].items()
+                              if v and k != 'not in ranktable' )
+
+    core = saved[f'metagenome central core ({rt})']
+    assert len(core) == counts[False]['central core']
+    assert set(core.hashes.values()) == {3}
+    assert sum( len(m) for m in saved.values() ) == len(mh) - 10
+
+    # class sketches are built serially; --cores is refused, not ignored
+    with pytest.raises(SourmashCommandFailed):
+        runtmp.sourmash('scripts', 'pangenome_classify', metagenome, rt,
+                        '--output-class-sketches', class_sigs, '-c', '2',
+                        '-k', '31', '--scaled', '1')
+    assert '--output-class-sketches cannot be used with --cores' in \
+        runtmp.last_result.out
+
+
+def test_benchmark_smoke(runtmp):
+    # run the benchmark harness at a tiny size, to keep it working.
+    import importlib.util
+    import json
+
+    path = os.path.join(os.path.dirname(__file__), '..', 'benchmarks',
+                        'bench_pangenome.py')
+    spec = importlib.util.spec_from_file_location('bench_pangenome', path)
+    bench = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench)
+
+    out = runtmp.output('bench.json')
+    bench.main(['--lineages', '2', '--genomes-per-lineage', '3',
+                '--hashes-per-genome', '50', '--samples', '2',
+                '--workdir', runtmp.output('bench'), '--json', out])
+
+    with open(out) as fp:
+        results = json.load(fp)['results']
+    assert [ r['command'] for r in results ] == ['pangenome_createdb',
+                                                 'pangenome_merge',
+                                                 'pangenome_ranktable',
+                                                 'pangenome_classify']
+    assert all( r['max_rss'] > 0 for r in results )
+
+
+def test_timings_and_profile(runtmp, synthetic_db):
+    import json
+    import pstats
+
+    sketches, taxonomy = synthetic_db
+    out = runtmp.output('merged.sig.zip')
+    timings = runtmp.output('timings.json')
+    profile = runtmp.output('createdb.prof')
+
+    runtmp.sourmash('scripts', 'pangenome_createdb', sketches, '-t', taxonomy,
+                    '-o', out, '--abund', '-k', '31', '--scaled', '1',
+                    '--timings', timings, '--profile', profile)
+
+    with open(timings) as fp:
+        report = json.load(fp)
+    assert report['command'] == 'pangenome_createdb'
+    assert report['max_rss_bytes'] > 0
+    assert all( 0 < phase['max_rss_at_end_bytes'] <= report['max_rss_bytes']
+                for phase in report['phases'] )
+
+    phases = { phase['name']: phase for phase in report['phases'] }
+    assert set(phases) == {'taxonomy load', 'manifest select',
+                           'sketch decode', 'accumulate', 'write'}
+    assert phases['sketch decode']['sketches'] == 18
+    assert phases['accumulate']['sketches'] == 18
+    assert phases['accumulate']['hashes'] == phases['sketch decode']['hashes']
+    assert phases['write']['sketches'] == 3
+
+    assert pstats.Stats(profile).total_calls > 0
+
+    # the other commands report their phases, too
+    rt = runtmp.output('a.csv')
+    runtmp.sourmash('scripts', 'pangenome_ranktable', out,
+                    '-o', rt, '-l', 'alpha', '-k', '31', '--scaled', '1',
+                    '--timings', timings)
+    with open(timings) as fp:
+        report = json.load(fp)
+    assert report['command'] == 'pangenome_ranktable'
+    assert [ p['name'] for p in report['phases'] ] == ['sketch decode',
+                                                       'write']
+
+
+def test_plugin_import_is_lightweight():
+    # sourmash discovers the plugin on every run; that should not import
+    # the command implementations or their dependencies.
+    import importlib.util
+
+    path = os.path.join(os.path.dirname(__file__), '..', 'benchmarks',
+                        'bench_import.py')
+    spec = importlib.util.spec_from_file_location('bench_import', path)
+    bench = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench)
+
+    assert bench.plugin_imports() == ['sourmash_plugin_pangenomics']